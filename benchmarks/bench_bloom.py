@@ -0,0 +1,76 @@
+""" Benchmark the Bloom filter in front of the seen index
+
+Loads 10 days of (id, email) history into a SeenIndex, with and without
+a DailyBloomFilter, then filters an hour of emails of which most are new.
+Reports the time per email, the false positive rate seen and the memory
+of the filter against a Python set of the same keys.
+
+Usage
+-----
+python -m benchmarks.bench_bloom [history_rows] [batch_rows]
+"""
+# standard lib
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# local modules
+from fc.bloom import DailyBloomFilter
+from fc.records import Email
+from fc.seen import SeenIndex
+
+
+def make_history(n):
+    """ n synthetic Email rows spread evenly over 10 days """
+    per_day = n // 10 or 1
+    return [Email(i, '2016-01-{:02d} 12:00:00'.format(1 + min(i // per_day, 9)),
+                  'user{}@example.com'.format(i)) for i in range(n)]
+
+
+def set_memory(emails):
+    tracemalloc.start()
+    keys = {(e.id, e.email) for e in emails}
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del keys
+    return size
+
+
+def main(history_rows, batch_rows):
+    history = make_history(history_rows)
+    # a tenth of the batch has been seen before
+    batch = ([Email(i, '2016-01-11 00:00:00', 'user{}@example.com'.format(i))
+              for i in range(history_rows, history_rows + batch_rows)] +
+             history[:batch_rows // 10])
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for label, days in (('exact', None),
+                            ('bloom', DailyBloomFilter(
+                                os.path.join(tmp_dir, 'seen.bloom'),
+                                capacity=history_rows // 10 or 1,
+                                fp_rate=0.001))):
+            db_path = os.path.join(tmp_dir, label + '.db')
+            with SeenIndex(db_path, days) as seen_index:
+                seen_index.add(history)
+
+                start = time.perf_counter()
+                unseen = list(seen_index.filter_unseen(batch))
+                elapsed = time.perf_counter() - start
+                assert len(unseen) == batch_rows
+
+            print('{:<6} {:>8.2f} us per email'.format(
+                label, elapsed / len(batch) * 1e6))
+
+        new = [b'x' + str(i).encode() for i in range(100000)]
+        false_positives = sum(key in days for key in new)
+        bloom_bytes = days.masks.itemsize * len(days.masks)
+        print('false positive rate {:.3%}'.format(false_positives / len(new)))
+        print('bloom {:.1f}MB | set of keys {:.1f}MB'.format(
+            bloom_bytes / 2**20, set_memory(history) / 2**20))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 10000)
@@ -0,0 +1,66 @@
+""" Benchmark range-split extraction against a sqlite stand-in
+
+Fills a sqlite dbtable with synthetic rows spread over 10 days, like the
+history pull, then fetches the whole range as one query and split into
+concurrent sub-ranges over a connection pool.  sqlite has no network
+round trips, so this mostly measures the overhead of the split and merge;
+against SQL Server the sub-ranges also overlap network and server time.
+
+Usage
+-----
+python -m benchmarks.bench_db [num_rows] [pool_size]
+"""
+# standard lib
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+# local modules
+from fc.db import (ConnectionPool,
+                   create_sqlite_table,
+                   iter_batches_split)
+from fc.emails import iter_emails
+
+from benchmarks.bench_extract import make_xml
+
+START = datetime.datetime(2016, 1, 1)
+END = START + datetime.timedelta(days=10)
+
+
+def main(num_rows, pool_size):
+    step = (END - START) / num_rows
+    xml = make_xml(1, 20)[0]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        source = create_sqlite_table(
+            os.path.join(tmp_dir, 'dbtable.db'),
+            ((START + step * i, str(i), xml) for i in range(num_rows)))
+
+        print('{:>6} {:>6} {:>12} {:>12}'.format('parts', 'pool',
+                                                 'fetch (s)', 'emails (s)'))
+        for parts, size in ((1, 1), (pool_size, pool_size),
+                            (4 * pool_size, pool_size)):
+            pool = ConnectionPool(source, size)
+
+            start = time.perf_counter()
+            n = sum(len(rows) for rows in
+                    iter_batches_split(pool, START, END, parts=parts))
+            fetch = time.perf_counter() - start
+            assert n == num_rows
+
+            start = time.perf_counter()
+            n = sum(1 for _ in iter_emails(START, END, end_inclusive=False,
+                                           xml_workers=0, pool=pool,
+                                           parts=parts))
+            extract = time.perf_counter() - start
+            assert n == num_rows
+
+            print('{:>6} {:>6} {:>12.3f} {:>12.3f}'.format(parts, size,
+                                                           fetch, extract))
+            pool.close()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 4)
@@ -0,0 +1,61 @@
+""" Benchmark the hashed anti-join used by compare_namedtuples
+
+Holds the hourly batch fixed and grows the comparison set, which mimics
+deduping an hour of emails against the last 10 days of history.  If the
+anti-join is linear then the time per comparison row stays flat as the
+comparison set grows.
+
+Usage
+-----
+python -m benchmarks.bench_dedupe [max_compare_rows]
+"""
+# standard lib
+from collections import namedtuple
+import sys
+import time
+
+# local modules
+from fc.dedupe import anti_join
+
+Email = namedtuple('Email', ['id', 'dt', 'email'])
+
+BATCH_ROWS = 10000  # roughly an hour of emails
+
+
+def make_emails(n, offset=0):
+    """ Generate n synthetic Email named tuples
+
+    Parameters
+    ----------
+    n : number of Email named tuples to generate
+
+    offset : starting id so that separate calls can overlap or not
+
+    Returns
+    -------
+    emails : a list of Email named tuples
+    """
+    return [Email(i, '2016-01-01 00:00:00', 'user{}@example.com'.format(i))
+            for i in range(offset, offset + n)]
+
+
+def main(max_compare_rows):
+    # half of the batch has already been seen in the comparison set
+    items_base = make_emails(BATCH_ROWS, offset=-BATCH_ROWS // 2)
+
+    print('{:>12} {:>10} {:>14}'.format('compare', 'seconds', 'ns per row'))
+    n = 1000
+    while n <= max_compare_rows:
+        items_compare = make_emails(n)
+        start = time.perf_counter()
+        output = list(anti_join(items_base, items_compare, ('id', 'email')))
+        elapsed = time.perf_counter() - start
+        assert len(output) == BATCH_ROWS - min(n, BATCH_ROWS // 2)
+        print('{:>12,} {:>10.3f} {:>14.1f}'.format(
+            n, elapsed, elapsed / (n + BATCH_ROWS) * 1e9))
+        del items_compare
+        n *= 10
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000000)
@@ -0,0 +1,84 @@
+""" Benchmark extracting the email address from XML payloads
+
+Compares the original per-row approach (fromstring plus a string xpath with
+a namespace dict) against the compiled extractor with and without early
+exit.  The synthetic payloads put the email node near the top of the
+document followed by padding elements, like the rows in schema.dbtable.
+
+Usage
+-----
+python -m benchmarks.bench_extract [num_rows] [padding_elements]
+"""
+# standard lib
+import sys
+import time
+
+# third party
+from lxml import etree as et
+
+# local modules
+from fc import (EMAIL_NSMAP,
+                EMAIL_XPATH)
+from fc.extract import make_email_extractor
+
+XML_TEMPLATE = ('<ns0:some xmlns:ns0="http://custom-ns0"'
+                ' xmlns:ns1="http://custom-ns1"'
+                ' xmlns:ns2="http://custom-ns2">'
+                '<ns1:long><ns2:xpath>'
+                '<ns2:name>User {i}</ns2:name>'
+                '<ns2:email>user{i}@example.com</ns2:email>'
+                '</ns2:xpath></ns1:long>'
+                '<ns1:detail>{padding}</ns1:detail>'
+                '</ns0:some>')
+
+
+def make_xml(n, padding):
+    """ Generate n synthetic XML payloads
+
+    Parameters
+    ----------
+    n : number of payloads
+
+    padding : number of padding elements after the email node
+
+    Returns
+    -------
+    payloads : a list of XML strings
+    """
+    pad = ''.join('<ns1:item key="{0}">value {0}</ns1:item>'.format(j)
+                  for j in range(padding))
+    return [XML_TEMPLATE.format(i=i, padding=pad) for i in range(n)]
+
+
+def extract_original(xml):
+    """ The per-row extraction used before the compiled extractor """
+    tree = et.fromstring(xml)
+    try:
+        return str(tree.xpath(EMAIL_XPATH, namespaces=EMAIL_NSMAP)[0])
+    except IndexError:
+        return None
+
+
+def main(num_rows, padding):
+    payloads = make_xml(num_rows, padding)
+    extractors = [
+        ('original', extract_original),
+        ('compiled', make_email_extractor(EMAIL_XPATH, EMAIL_NSMAP)),
+        ('early exit', make_email_extractor(EMAIL_XPATH, EMAIL_NSMAP,
+                                            early_exit=True)),
+    ]
+
+    print('{:,} rows with {} padding elements'.format(num_rows, padding))
+    print('{:>12} {:>10} {:>14}'.format('extractor', 'seconds', 'rows / sec'))
+    for name, extract in extractors:
+        start = time.perf_counter()
+        emails = [extract(xml) for xml in payloads]
+        elapsed = time.perf_counter() - start
+        assert emails[-1] == 'user{}@example.com'.format(num_rows - 1)
+        print('{:>12} {:>10.3f} {:>14,.0f}'.format(name, elapsed,
+                                                   num_rows / elapsed))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 50)
@@ -0,0 +1,74 @@
+""" Benchmark loading and writing the Email history file
+
+Writes num_rows synthetic Email rows as newline delimited json and times
+loading them with the original read_json_as_namedtuple (a new named tuple
+class per line), the current read_json_as_namedtuple, streaming through
+records.EmailFile, and loading the EmailFile binary sidecar.  Writing is
+timed for write_namedtuple_as_json and EmailFile.write.
+
+Usage
+-----
+python -m benchmarks.bench_history [num_rows]
+"""
+# standard lib
+from collections import namedtuple
+import json
+import os
+import sys
+import tempfile
+import time
+
+# local modules
+from fc.records import (Email,
+                        EmailFile,
+                        EmailTable)
+from fc.utils import (read_json_as_namedtuple,
+                      write_namedtuple_as_json)
+
+
+def read_original(file_path, nt):
+    """ read_json_as_namedtuple before it was bound to one class """
+    with open(file_path, 'r') as f:
+        items_json = f.read().splitlines()
+
+        list_nt = []
+        for item in items_json:
+            item_nt = json.loads(item,
+                object_hook=lambda d: namedtuple(nt, d.keys())(*d.values()))
+            list_nt.append(item_nt)
+    return list_nt
+
+
+def timed(label, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    print('{:<32} {:>8.3f}s'.format(label, time.perf_counter() - start))
+    return result
+
+
+def main(num_rows):
+    emails = [Email(str(i), '2016-01-01 {:02d}:{:02d}:00'.format(
+                        i // 60 % 24, i % 60),
+                    'user{}@example.com'.format(i % (num_rows // 2 or 1)))
+              for i in range(num_rows)]
+    table = EmailTable(emails)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'emails_to_process.json')
+        history = EmailFile(path)
+
+        timed('write_namedtuple_as_json', write_namedtuple_as_json, path,
+              emails, 'w')
+        timed('EmailFile.write', history.write, table, 'w')
+
+        timed('read_json_as_namedtuple (orig)', read_original, path,
+              'Emails')
+        timed('read_json_as_namedtuple', read_json_as_namedtuple, path,
+              'Emails')
+        timed('EmailFile streaming', list, history)
+        loaded = timed('EmailFile sidecar', history.read_sidecar)
+        assert len(loaded) == num_rows
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
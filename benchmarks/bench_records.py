@@ -0,0 +1,71 @@
+""" Benchmark the memory held by Email rows
+
+Builds the same rows, spread over an hour or over 10 days, as a list of
+Email named tuples with a fresh dt string per row (as strftime returns
+them) and as a records.EmailTable, and reports the memory allocated by
+each with tracemalloc.  A share of the email addresses repeat, as the
+same person signs up under several ids.
+
+Usage
+-----
+python -m benchmarks.bench_records [num_rows]
+"""
+# standard lib
+import datetime
+import gc
+import sys
+import tracemalloc
+
+# local modules
+from fc.records import (Email,
+                        EmailTable)
+
+START = datetime.datetime(2016, 1, 1)
+
+
+def make_rows(n, span):
+    """ Generate n synthetic (id, datetime, email) rows over span seconds
+    """
+    for i in range(n):
+        dt = START + datetime.timedelta(seconds=i * span // n)
+        yield i, dt, 'user{}@example.com'.format(i % (n // 2 or 1))
+
+
+def as_namedtuples(rows):
+    return [Email(id_val, dt.strftime('%Y-%m-%d %H:%M:%S'), email)
+            for id_val, dt, email in rows]
+
+
+def as_table(rows):
+    table = EmailTable()
+    for id_val, dt, email in rows:
+        table.append(id_val, dt.strftime('%Y-%m-%d %H:%M:%S'), email)
+    return table
+
+
+def measure(build, rows):
+    """ Return the memory held by the result of build """
+    gc.collect()
+    tracemalloc.start()
+    result = build(rows)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def main(num_rows):
+    print('{:>8} {:>12} {:>10} {:>12} {:>10}'.format(
+        'span', 'namedtuple', 'bytes/row', 'EmailTable', 'bytes/row'))
+    for label, span in (('1 hour', 60 * 60), ('10 days', 10 * 24 * 60 * 60)):
+        sizes = []
+        for build in (as_namedtuples, as_table):
+            size = measure(build, make_rows(num_rows, span))
+            sizes.append(size)
+        print('{:>8} {:>10.1f}MB {:>10.1f} {:>10.1f}MB {:>10.1f}'.format(
+            label, sizes[0] / 2**20, sizes[0] / num_rows,
+            sizes[1] / 2**20, sizes[1] / num_rows))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,97 @@
+""" Benchmark scheduling latency of process_queue
+
+Queues items due at evenly spaced times over a few seconds and measures
+how late each one is dispatched, plus the CPU time used while waiting.
+The original sleep polling loop over a queue.PriorityQueue can be run for
+comparison with the TimerQueue based process_queue.  It sleeps at least
+1 ms per dispatch, so at 100k items it falls behind by over a minute.
+
+Usage
+-----
+python -m benchmarks.bench_scheduler [num_items] [spread_seconds] [legacy]
+"""
+# standard lib
+import logging
+import queue
+import statistics
+import sys
+import time
+
+# local modules
+from fc.scheduler import (TimerQueue,
+                          process_queue)
+
+
+class InlinePool(object):
+    """ Stand-in for a thread pool that runs the function immediately """
+    def submit(self, func, *args):
+        func(*args)
+
+
+def legacy_process_queue(q, pool, func, timeout):
+    """ The sleep polling loop that process_queue used to be """
+    priority, count, id_val, dt, email, attempts = q.get()
+    while True:
+        diff = priority - time.time()
+        if diff <= 0:
+            pool.submit(func, q, count, id_val, dt, email, attempts, None)
+            try:
+                priority, count, id_val, dt, email, attempts = \
+                        q.get(timeout=timeout)
+            except queue.Empty:
+                break
+        if diff <= 0.1:
+            time.sleep(0.001)
+        elif diff <= 0.5:
+            time.sleep(0.01)
+        elif diff <= 1.5:
+            time.sleep(0.1)
+        else:
+            time.sleep(1)
+
+
+def run(name, q, process, num_items, spread):
+    latencies = []
+
+    def record(q, count, id_val, dt, email, attempts, client):
+        latencies.append(time.time() - q_priority[count])
+
+    start = time.time() + 0.5
+    step = spread / num_items
+    q_priority = [start + i * step for i in range(num_items)]
+    for i, priority in enumerate(q_priority):
+        q.put((priority, i, i, '2016-01-01 00:00:00', 'a@b.com', ()))
+
+    cpu_start = time.process_time()
+    process(q, InlinePool(), record)
+    cpu = time.process_time() - cpu_start
+
+    latencies.sort()
+    print('{:>10} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.2f}'.format(
+        name,
+        statistics.median(latencies) * 1000,
+        latencies[int(len(latencies) * 0.99)] * 1000,
+        latencies[-1] * 1000,
+        cpu))
+
+
+def main(num_items, spread, legacy):
+    # logging every submission would dominate the measurement
+    logging.disable(logging.INFO)
+
+    print('{:,} items due over {} seconds'.format(num_items, spread))
+    print('{:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+        'scheduler', 'p50 ms', 'p99 ms', 'max ms', 'cpu s'))
+    if legacy:
+        run('legacy', queue.PriorityQueue(),
+            lambda q, pool, func: legacy_process_queue(q, pool, func, 0.5),
+            num_items, spread)
+    run('timer', TimerQueue(),
+        lambda q, pool, func: process_queue(q, pool, func, timeout=0.5),
+        num_items, spread)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000,
+         float(sys.argv[2]) if len(sys.argv) > 2 else 5.0,
+         len(sys.argv) > 3 and sys.argv[3] == 'legacy')
@@ -0,0 +1,130 @@
+""" Synthetic data for the benchmark suite
+
+Every generator takes a seed so the same data is produced on every run
+and every commit.
+"""
+# standard lib
+import datetime
+import random
+
+# local modules
+from fc.records import Email
+
+START = datetime.datetime(2016, 1, 1)
+
+# the shape EMAIL_XPATH expects: /ns0:some/ns1:long/ns2:xpath/ns2:email
+XML_TEMPLATE = ('<ns0:some xmlns:ns0="http://custom-ns0"'
+                ' xmlns:ns1="http://custom-ns1"'
+                ' xmlns:ns2="http://custom-ns2">'
+                '<ns1:long><ns2:xpath>'
+                '<ns2:name>User {i}</ns2:name>'
+                '{email}'
+                '</ns2:xpath></ns1:long>'
+                '<ns1:detail>{padding}</ns1:detail>'
+                '</ns0:some>')
+EMAIL_ELEMENT = '<ns2:email>{}</ns2:email>'
+
+
+def _dt(i, n, days):
+    # n rows spread evenly over days from START, as a dt string
+    seconds = int(i * days * 86400 / max(n, 1))
+    return (START + datetime.timedelta(seconds=seconds)).strftime(
+        '%Y-%m-%d %H:%M:%S')
+
+
+def _keys(n, dup_rate, rng, offset=0):
+    # (id, email) per row, where dup_rate of the rows repeat an earlier key
+    keys = []
+    for i in range(n):
+        if keys and rng.random() < dup_rate:
+            keys.append(keys[rng.randrange(len(keys))])
+        else:
+            j = offset + i
+            keys.append((j, 'user{}@example.com'.format(j)))
+    return keys
+
+
+def xml_rows(n, dup_rate=0.0, fail_rate=0.0, padding=5, days=1.0, seed=0):
+    """ Rows of schema.dbtable, in dt order
+
+    Parameters
+    ----------
+    n : number of rows
+
+    dup_rate : fraction of rows repeating the id and email of an earlier row
+
+    fail_rate : fraction of rows whose XML has no email element
+
+    padding : number of elements after the email element
+
+    days : number of days the rows are spread over from START
+
+    seed : random seed
+
+    Returns
+    -------
+    rows : list of tuples (dt, id, XML), as taken by
+        fc.db.create_sqlite_table
+    """
+    rng = random.Random(seed)
+    pad = ''.join('<ns1:item key="{0}">value {0}</ns1:item>'.format(j)
+                  for j in range(padding))
+    rows = []
+    for i, (id_val, email) in enumerate(_keys(n, dup_rate, rng)):
+        element = '' if rng.random() < fail_rate else \
+                EMAIL_ELEMENT.format(email)
+        rows.append((_dt(i, n, days), str(id_val),
+                     XML_TEMPLATE.format(i=i, email=element, padding=pad)))
+    return rows
+
+
+def emails(n, dup_rate=0.0, days=1.0, seed=0, offset=0):
+    """ Email named tuples, in dt order
+
+    Parameters
+    ----------
+    n : number of emails
+
+    dup_rate : fraction repeating the id and email of an earlier email
+
+    days : number of days the emails are spread over from START
+
+    seed : random seed
+
+    offset : first id, so separate calls can be kept apart
+
+    Returns
+    -------
+    emails : list of Email named tuples
+    """
+    rng = random.Random(seed)
+    return [Email(id_val, _dt(i, n, days), email)
+            for i, (id_val, email) in enumerate(_keys(n, dup_rate, rng,
+                                                      offset))]
+
+
+def batch_and_history(batch_size, history_size, seen_rate=0.1, seed=0):
+    """ An hour of emails and the history it is deduped against
+
+    Parameters
+    ----------
+    batch_size : number of emails in the batch
+
+    history_size : number of emails in the history, spread over 10 days
+
+    seen_rate : fraction of the batch that is also in the history
+
+    seed : random seed
+
+    Returns
+    -------
+    batch, history : lists of Email named tuples
+    """
+    rng = random.Random(seed)
+    history = emails(history_size, days=10.0, seed=seed)
+    batch = emails(batch_size, seed=seed + 1, offset=history_size)
+    num_seen = min(int(batch_size * seen_rate), history_size)
+    for i, h in zip(rng.sample(range(batch_size), num_seen),
+                    rng.sample(history, num_seen)):
+        batch[i] = Email(h.id, batch[i].dt, h.email)
+    return batch, history
@@ -0,0 +1,236 @@
+""" Load test the lookup path against a local Person API stand-in
+
+Starts a fc.stub.StubPersonAPI, points PERSON_API_URL at it and drives
+the same queue path as main.py, person.run_lookups: every email is put on
+a journaled TimerQueue and worked through by the scheduler and a thread
+pool (or the asyncio engine) with the shared rate limiter, retry policy,
+response cache and output store.  Other settings keep their production
+defaults.  Reports:
+
+    throughput : finished emails and API calls per second
+    rate limit utilization : calls the stub accepted against the calls
+        allowed in the rate limit windows the run spanned, the pace
+        against limit / period, and the 403s when it was exceeded
+    enrichment latency : p50/p95/p99 from first submission to the final
+        response being handed to the store, from the trace spans
+
+Retry delays (202 polling, 5xx backoff) are scaled by --retry-scale so a
+run takes seconds rather than minutes.  --repeat-rate of the emails repeat
+an earlier one, so some are answered from the response cache.  The run
+fails if any rate limit token was not handed back to the limiter.
+
+Usage
+-----
+python -m benchmarks.load [--emails 1000] [--workers 100]
+                          [--rate-limit 6000] [--period 60]
+                          [--latency lognormal:0.1:0.5]
+                          [--pending-polls 0,2] [--not-found 0.2]
+                          [--error-503 0.01] [--error-403 0.0]
+                          [--retry-scale 0.01] [--engine threads|async]
+                          [--repeat-rate 0.1]
+                          [--out results.json]
+"""
+# standard lib
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import tempfile
+import time
+
+# local modules
+import fc
+import fc.journal as journal
+import fc.person as person
+import fc.ratelimit as ratelimit
+import fc.retry as retry
+import fc.scheduler as scheduler
+import fc.trace as trace
+from fc.stub import StubPersonAPI
+
+from benchmarks import generators
+from benchmarks.suite import config
+
+
+def scaled_policy(policy, scale):
+    """ A copy of a RetryPolicy with every delay multiplied by scale """
+    return retry.RetryPolicy({
+        status: rule._replace(base=rule.base * scale,
+                              max_delay=rule.max_delay * scale)
+        for status, rule in policy.rules.items()})
+
+
+def run(num_emails, workers=100, rate_limit=6000, period=60.0,
+        latency='lognormal:0.1:0.5', pending_polls=(0, 2),
+        not_found_rate=0.2, error_503_rate=0.01, error_403_rate=0.0,
+        retry_scale=0.01, engine='threads', repeat_rate=0.1, seed=0):
+    """ Run one load test
+
+    Every other setting is left at the production default, so the response
+    cache is on and the queue has a journal attached.
+
+    Returns
+    -------
+    results : dict of the settings and measurements
+    """
+    stub = StubPersonAPI(rate_limit, period, latency, pending_polls,
+                         not_found_rate, error_503_rate, error_403_rate,
+                         retry_after=max(30 * retry_scale, 0.01), seed=seed)
+    url = stub.serve()
+    # repeated emails are answered from the response cache
+    emails = generators.emails(num_emails, dup_rate=repeat_rate, seed=seed)
+    # stop shortly after the last retry rather than QUEUE_TIMEOUT
+    timeout = max(2.0, 130 * retry_scale)
+
+    with tempfile.TemporaryDirectory() as tmp_dir, \
+            config(PERSON_API_URL=url, OUT_DIR=tmp_dir, OUT_FORMAT='segments',
+                   RESPONSE_CACHE_FILE=os.path.join(tmp_dir, 'responses.db'),
+                   RETRY_POLICY=scaled_policy(fc.RETRY_POLICY, retry_scale),
+                   ASYNC_ENGINE=engine == 'async', MAX_WORKERS=workers,
+                   ASYNC_MAX_IN_FLIGHT=workers,
+                   ASYNC_MAX_CONNECTIONS=workers, QUEUE_TIMEOUT=timeout):
+        # the store and cache are opened with the settings above
+        person._store = None
+        person._response_cache = None
+        trace_file = os.path.join(tmp_dir, 'trace.jsonl')
+        trace.start_tracing(trace_file)
+
+        queue_journal = journal.Journal(
+            os.path.join(tmp_dir, 'queue.journal'), fc.JOURNAL_COMPACT_EVERY,
+            fc.JOURNAL_FSYNC)
+        q = scheduler.TimerQueue(queue_journal)
+        start = time.time()
+        for i, email in enumerate(emails):
+            q.put((start, i, email.id, email.dt, email.email, ()))
+        limiter = ratelimit.RateLimiter(rate_limit, period)
+
+        person.run_lookups(q, limiter, url, api_key='stub')
+
+        person.get_store().close()
+        person._store = None
+        person.get_response_cache().close()
+        person._response_cache = None
+        trace.stop_tracing()
+        spans = trace.read_spans(trace_file)
+        # lookups that never completed
+        unfinished = len(queue_journal.pending)
+        queue_journal.close()
+
+    stub.shutdown()
+    stats = stub.stats()
+
+    summary = trace.summarize(spans)
+    end = max((s[2] for email_spans in spans.values() for s in email_spans),
+              default=start)
+    elapsed = max(end - start, 1e-9)
+    counts = stats['status_counts']
+    finished = counts.get(200, 0) + counts.get(404, 0)
+    accepted = stats['requests'] - counts.get(403, 0)
+    # every rate limit window the run touched
+    allowed = rate_limit * math.ceil(elapsed / period)
+    latency_values = summary['latency']
+    return {
+        'settings': {'emails': num_emails, 'workers': workers,
+                     'rate_limit': rate_limit, 'period': period,
+                     'latency': latency, 'pending_polls': list(pending_polls),
+                     'not_found_rate': not_found_rate,
+                     'error_503_rate': error_503_rate,
+                     'error_403_rate': error_403_rate,
+                     'retry_scale': retry_scale, 'engine': engine,
+                     'repeat_rate': repeat_rate},
+        'elapsed': elapsed,
+        'status_counts': {str(k): v for k, v in sorted(counts.items())},
+        'finished': finished,
+        'emails_per_second': finished / elapsed,
+        'requests_per_second': stats['requests'] / elapsed,
+        'rate_limit_utilization': accepted / allowed,
+        'rate_limit_pace': accepted / elapsed / (rate_limit / period),
+        'max_in_flight': stats['max_in_flight'],
+        'unfinished': unfinished,
+        'limiter_in_flight': limiter.in_flight,
+        'latency': {'p50': trace.percentile(latency_values, 50),
+                    'p95': trace.percentile(latency_values, 95),
+                    'p99': trace.percentile(latency_values, 99)},
+        'stage_share': summary['share'],
+    }
+
+
+def print_results(results, out=sys.stdout):
+    s = results['settings']
+    print('{} emails, {} engine with {} workers, rate limit {} / {:g}s'
+          .format(s['emails'], s['engine'], s['workers'], s['rate_limit'],
+                  s['period']), file=out)
+    print('responses        {}'.format(', '.join(
+        '{}: {}'.format(k, v) for k, v in results['status_counts'].items())),
+        file=out)
+    print('elapsed          {:.2f}s'.format(results['elapsed']), file=out)
+    print('throughput       {:.1f} emails/s, {:.1f} calls/s'.format(
+        results['emails_per_second'], results['requests_per_second']),
+        file=out)
+    print('rate limit       {:.1%} of the calls allowed in the windows'
+          ' used, at {:.1%} of the limit rate, {} 403s'.format(
+              results['rate_limit_utilization'], results['rate_limit_pace'],
+              results['status_counts'].get('403', 0)), file=out)
+    print('max in flight    {}'.format(results['max_in_flight']), file=out)
+    print('unfinished       {} emails, {} rate limit tokens not handed'
+          ' back'.format(results['unfinished'],
+                         results['limiter_in_flight']), file=out)
+    print('latency          p50 {p50:.3f}s  p95 {p95:.3f}s  p99 {p99:.3f}s'
+          .format(**results['latency']), file=out)
+    print('time by stage    {}'.format(', '.join(
+        '{} {:.1%}'.format(stage, share) for stage, share in
+        sorted(results['stage_share'].items(), key=lambda kv: -kv[1]))),
+        file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Load test the lookup path against a local stub API')
+    parser.add_argument('--emails', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=100)
+    parser.add_argument('--rate-limit', type=int, default=6000,
+                        help='calls allowed per period')
+    parser.add_argument('--period', type=float, default=60.0)
+    parser.add_argument('--latency', default='lognormal:0.1:0.5',
+                        help='fixed:S, uniform:LOW:HIGH, exponential:MEAN'
+                             ' or lognormal:MEDIAN:SIGMA')
+    parser.add_argument('--pending-polls', default='0,2',
+                        help='202s before the final response, N or MIN,MAX')
+    parser.add_argument('--not-found', type=float, default=0.2)
+    parser.add_argument('--error-503', type=float, default=0.01)
+    parser.add_argument('--error-403', type=float, default=0.0)
+    parser.add_argument('--retry-scale', type=float, default=0.01,
+                        help='multiplier for every retry delay')
+    parser.add_argument('--engine', choices=('threads', 'async'),
+                        default='threads')
+    parser.add_argument('--repeat-rate', type=float, default=0.1,
+                        help='fraction of emails repeating an earlier one')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=None,
+                        help='JSON file for the results')
+    args = parser.parse_args(argv)
+
+    polls = [int(p) for p in args.pending_polls.split(',')]
+    results = run(args.emails, args.workers, args.rate_limit, args.period,
+                  args.latency, (polls[0], polls[-1]), args.not_found,
+                  args.error_503, args.error_403, args.retry_scale,
+                  args.engine, args.repeat_rate, args.seed)
+    print_results(results)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+    # every call must hand its rate limit token back
+    if results['limiter_in_flight'] != 0:
+        print('rate limiter leaked {} tokens'
+              .format(results['limiter_in_flight']), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    # logging every lookup would dominate the measurement
+    logging.disable(logging.INFO)
+    sys.exit(main())
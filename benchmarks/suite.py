@@ -0,0 +1,301 @@
+""" Benchmark suite for the extraction and dedupe hot paths
+
+Runs each case over synthetic data (see benchmarks.generators) at every
+input size and writes the timings as JSON, so that runs on different
+commits can be compared:
+
+    parse_xml : extracting the email from each XML row (the get_emails
+        parse step)
+    get_emails : fetch, parse and drop duplicate rows, against a sqlite
+        stand-in for schema.dbtable
+    get_unique_emails : fetch, parse and keep the earliest row per id and
+        email, against the same stand-in
+    compare_namedtuples : an hour of 10,000 emails against a history of
+        the given size
+    unique_namedtuples : emails with 20% duplicates
+    read_json_as_namedtuple, write_namedtuple_as_json : a history file
+
+The cases that go through sqlite build a table per size first, which at
+10M rows takes a while and several GB of disk; the in-memory cases hold
+the generated emails, several GB at 10M.
+
+Usage
+-----
+python -m benchmarks.suite [--sizes 1000,10000,100000] [--cases ...]
+                           [--repeat 3] [--out results.json]
+                           [--compare baseline.json] [--threshold 0.1]
+
+Sizes accept k and M suffixes, for example --sizes 1k,100k,1M,10M.  With
+--compare, cases more than threshold slower than the baseline are listed
+and the exit status is 1.
+"""
+# standard lib
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# local modules
+import fc
+import fc.db as db
+import fc.emails as emails
+import fc.extract as extract
+import fc.utils as utils
+
+from benchmarks import generators
+
+BATCH_SIZE = 10000  # roughly an hour of emails
+
+
+@contextlib.contextmanager
+def config(**values):
+    """ Set fc globals for the duration of a block """
+    old = {name: getattr(fc, name) for name in values}
+    for name, value in values.items():
+        setattr(fc, name, value)
+    try:
+        yield
+    finally:
+        for name, value in old.items():
+            setattr(fc, name, value)
+
+
+@contextlib.contextmanager
+def sqlite_source(tmp_dir, size):
+    """ Point the extraction at a sqlite dbtable of size synthetic rows
+    with 10% duplicates and 1% rows without an email, over one day
+    """
+    db_path = os.path.join(tmp_dir, 'dbtable_{}.db'.format(size))
+    if not os.path.isfile(db_path):
+        db.create_sqlite_table(db_path, generators.xml_rows(
+            size, dup_rate=0.1, fail_rate=0.01))
+    with config(DB_SQLITE_FILE=db_path, PARTITION_CACHE=False,
+                XML_WORKERS=0):
+        # the shared pool is tied to the database it was opened on
+        emails._pool = None
+        try:
+            yield
+        finally:
+            if emails._pool is not None:
+                emails._pool.close()
+            emails._pool = None
+
+
+def case_parse_xml(size, tmp_dir):
+    rows = generators.xml_rows(size, fail_rate=0.01)
+    extract_email = extract.make_email_extractor(fc.EMAIL_XPATH,
+                                                 fc.EMAIL_NSMAP,
+                                                 early_exit=fc.XML_EARLY_EXIT)
+    return lambda: [extract_email(xml) for _, _, xml in rows]
+
+
+def case_get_emails(size, tmp_dir):
+    start, end = generators.START, generators.START + datetime.timedelta(1)
+
+    def run():
+        with sqlite_source(tmp_dir, size):
+            return emails.get_emails(start, end)
+    # build the table before timing
+    with sqlite_source(tmp_dir, size):
+        pass
+    return run
+
+
+def case_get_unique_emails(size, tmp_dir):
+    start, end = generators.START, generators.START + datetime.timedelta(1)
+
+    def run():
+        with sqlite_source(tmp_dir, size):
+            return emails.get_unique_emails(start, end)
+    with sqlite_source(tmp_dir, size):
+        pass
+    return run
+
+
+def case_compare_namedtuples(size, tmp_dir):
+    batch, history = generators.batch_and_history(min(BATCH_SIZE, size),
+                                                  size)
+    return lambda: utils.compare_namedtuples(batch, history, ('id', 'email'))
+
+
+def case_unique_namedtuples(size, tmp_dir):
+    items = generators.emails(size, dup_rate=0.2)
+    return lambda: utils.unique_namedtuples(items, ('id', 'email'))
+
+
+def case_read_json_as_namedtuple(size, tmp_dir):
+    path = os.path.join(tmp_dir, 'read_{}.json'.format(size))
+    utils.write_namedtuple_as_json(path, generators.emails(size, days=10.0),
+                                   'w')
+    return lambda: utils.read_json_as_namedtuple(path, 'Email')
+
+
+def case_write_namedtuple_as_json(size, tmp_dir):
+    path = os.path.join(tmp_dir, 'write_{}.json'.format(size))
+    items = generators.emails(size, days=10.0)
+    return lambda: utils.write_namedtuple_as_json(path, items, 'w')
+
+
+CASES = {
+    'parse_xml': case_parse_xml,
+    'get_emails': case_get_emails,
+    'get_unique_emails': case_get_unique_emails,
+    'compare_namedtuples': case_compare_namedtuples,
+    'unique_namedtuples': case_unique_namedtuples,
+    'read_json_as_namedtuple': case_read_json_as_namedtuple,
+    'write_namedtuple_as_json': case_write_namedtuple_as_json,
+}
+
+
+def parse_size(text):
+    """ '10k' -> 10000, '1M' -> 1000000 """
+    text = text.strip()
+    multiplier = {'k': 10**3, 'K': 10**3, 'm': 10**6, 'M': 10**6}.get(
+        text[-1:], 1)
+    if multiplier != 1:
+        text = text[:-1]
+    return int(float(text) * multiplier)
+
+
+def git_commit():
+    """ Return the current commit, or None outside of a git checkout """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.realpath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(cases, sizes, repeat=3, out=sys.stdout):
+    """ Time every case at every size
+
+    Each case is set up (data generated, files written) outside of the
+    timing and then run repeat times, fewer for a million rows or more.
+
+    Returns
+    -------
+    results : dict ready to be dumped as JSON
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name in cases:
+            for size in sizes:
+                func = CASES[name](size, tmp_dir)
+                times = []
+                for _ in range(repeat if size < 10**6 else 1):
+                    start = time.perf_counter()
+                    func()
+                    times.append(time.perf_counter() - start)
+                result = {'case': name, 'size': size, 'times': times,
+                          'min': min(times),
+                          'median': statistics.median(times),
+                          'rows_per_second': size / min(times)}
+                results.append(result)
+                print('{:<26} {:>10,} {:>10.4f}s {:>14,.0f} rows/s'.format(
+                    name, size, result['min'], result['rows_per_second']),
+                    file=out)
+    return {'commit': git_commit(),
+            'created': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': results}
+
+
+def compare(results, baseline, threshold=0.1, out=sys.stdout):
+    """ Print the change against a baseline run and return the regressions
+
+    Parameters
+    ----------
+    results, baseline : outputs of run
+
+    threshold : fraction slower than the baseline that counts as a
+        regression
+
+    Returns
+    -------
+    regressions : list of (case, size, ratio) slower than the threshold
+    """
+    before = {(r['case'], r['size']): r['min'] for r in baseline['results']}
+    print('\nagainst {}'.format(baseline.get('commit')), file=out)
+    regressions = []
+    for r in results['results']:
+        key = (r['case'], r['size'])
+        if key not in before:
+            continue
+        ratio = r['min'] / before[key]
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  slower'
+            regressions.append((r['case'], r['size'], ratio))
+        elif ratio < 1 - threshold:
+            flag = '  faster'
+        print('{:<26} {:>10,} {:>8.2f}x{}'.format(r['case'], r['size'],
+                                                   ratio, flag), file=out)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the extraction and dedupe hot paths')
+    parser.add_argument('--sizes', default='1k,10k,100k',
+                        help='comma separated input sizes, such as'
+                             ' 1k,10k,100k,1M,10M')
+    parser.add_argument('--cases', default=','.join(CASES),
+                        help='comma separated cases, from ' +
+                             ', '.join(CASES))
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per case below a million rows, the'
+                             ' fastest is kept')
+    parser.add_argument('--out', default=None,
+                        help='JSON file for the results, defaults to'
+                             ' benchmarks/results/<commit>.json')
+    parser.add_argument('--compare', default=None,
+                        help='JSON results of an earlier run to compare'
+                             ' against')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='fraction slower than the baseline that counts'
+                             ' as a regression')
+    args = parser.parse_args(argv)
+
+    cases = [c.strip() for c in args.cases.split(',') if c.strip()]
+    unknown = set(cases) - set(CASES)
+    if unknown:
+        parser.error('unknown cases: ' + ', '.join(sorted(unknown)))
+    sizes = [parse_size(s) for s in args.sizes.split(',') if s.strip()]
+
+    results = run(cases, sizes, args.repeat)
+
+    out_path = args.out
+    if out_path is None:
+        out_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                               'results')
+        os.makedirs(out_dir, exist_ok=True)
+        out_path = os.path.join(out_dir, '{}.json'.format(
+            (results['commit'] or 'results')[:12]))
+    with open(out_path, 'w') as f:
+        json.dump(results, f, indent=2)
+        f.write('\n')
+    print('\nwrote {}'.format(out_path))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    # keep the per-row log lines out of the timings
+    import logging
+    logging.disable(logging.INFO)
+    sys.exit(main())
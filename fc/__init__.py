@@ -3,17 +3,52 @@ import logging
 import os
 
 # local imports
+from .aperson import *
+
+from .bloom import *
+
+from .cache import *
+
+from .daemon import *
+
+from .db import *
+
 from .emails import *
 
+from .extract import *
+
+from .journal import *
+
+from .metrics import *
+
+from .partitions import *
+
 from .person import *
 
+from .ratelimit import *
+
+from .records import *
+
+from .retry import *
+
 from .scheduler import *
 
+from .seen import *
+
+from .store import *
+
+from .stub import *
+
+from .trace import *
+
 from .utils import *
 
+from .writer import *
+
 ###
 # constants
 ###
+# initial rate limit until synced from the X-Rate-Limit-* headers
 RATE_LIMIT = 300  # calls per rate limit remaining
 RATE_LIMIT_REMAINING = 60  # calls remaining in seconds
 
@@ -22,11 +57,146 @@ RATE_LIMIT_REMAINING = 60  # calls remaining in seconds
 QUEUE_TIMEOUT = 60.0
 MAX_WORKERS = 100  # maximum number of worker threads
 
+# Person API endpoint, point it at a local stand-in such as fc.stub to load
+#   test without spending quota
+PERSON_API_URL = 'https://api.fullcontact.com/v2/person.json'
+
+# use the asyncio engine (fc.aperson) rather than a thread pool
+#   to query the Person API
+ASYNC_ENGINE = False
+ASYNC_MAX_IN_FLIGHT = 1000  # maximum number of concurrent lookups
+ASYNC_MAX_CONNECTIONS = 100  # maximum number of open connections
+
+# with main.py --daemon, poll the database for new emails every __ seconds
+#   starting __ seconds before where the last poll ended so that rows
+#   committed late are not missed
+DAEMON_POLL_INTERVAL = 60.0
+DAEMON_OVERLAP = 300.0
+
 # directory containing the Full Contact returned JSON
 OUT_DIR = '/work/JSON Files'
+# 'files' writes one '{dt}_{id}.json' file per lookup
+# 'segments' appends to hourly NDJSON segment files with a sidecar index
+#   optionally compressed with OUT_COMPRESSION of 'gzip' or 'lzma'
+OUT_FORMAT = 'files'
+OUT_COMPRESSION = None
+# responses are written as returned by the API; set to a list of top level
+#   fields, such as ['status', 'contactInfo'], to only keep those fields
+OUT_FIELDS = None
+# results are handed to a background writer thread that writes them in
+#   batches of up to __ results at least every __ seconds
+# 'batch' fsyncs after every batch, 'never' leaves it to the OS
+WRITER_BACKGROUND = True
+WRITER_QUEUE_SIZE = 10000
+WRITER_BATCH_SIZE = 500
+WRITER_FLUSH_INTERVAL = 1.0
+WRITER_FSYNC = 'never'
+
+# schema.dbtable is queried over a pool of up to __ connections, each
+#   range split into __ sub-ranges fetched concurrently, __ rows at a time
+DB_POOL_SIZE = 4
+DB_SPLIT_PARTS = 4
+DB_ARRAYSIZE = 5000
+# set to the path of a sqlite file with a dbtable table (see
+#   fc.db.create_sqlite_table) to use it instead of SQL Server
+DB_SQLITE_FILE = None
+
+# xpath and namespaces used to extract the email address from the XML
+#   column of schema.dbtable
+EMAIL_NSMAP = {'ns0': 'http://custom-ns0',
+               'ns1': 'http://custom-ns1',
+               'ns2': 'http://custom-ns2'}
+EMAIL_XPATH = '/ns0:some/ns1:long/ns2:xpath/ns2:email/text()'
+# stop parsing each XML document once the email address has been found
+XML_EARLY_EXIT = False
+# parse XML in a pool of __ worker processes, each handed a batch of
+#   DB_ARRAYSIZE rows; set XML_WORKERS to 0 to parse within the main process
+# the pool is started once from a fork server and shared by every query
+XML_WORKERS = os.cpu_count()
+
+# each complete hour extracted from the database is cached locally as a
+#   partition file so that it is only ever extracted once
+# the file name includes a key of EMAIL_XPATH and EMAIL_NSMAP, so changing
+#   them extracts every hour again
+PARTITION_CACHE = True
+PARTITION_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..',
+                             'data/partitions')
+# an hour is only cached __ seconds after it ends, until then it is queried
+#   so that rows committed late are not lost
+PARTITION_GRACE = 900.0
+# partitions of days more than __ days before today are deleted at the end
+#   of each run, one more than the 10 days the seen index is loaded from
+PARTITION_KEEP_DAYS = 11
+
+# a Bloom filter partitioned by day in front of data/seen.db answers most
+#   emails that are new without probing the index
+# each day holds 250,000 keys at a false positive rate of 0.1%, so a check
+#   across the 10 days has roughly a 1% false positive rate
+SEEN_BLOOM = True
+SEEN_BLOOM_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                               '..',
+                               'data/seen.bloom')
+SEEN_BLOOM_CAPACITY = 250000
+SEEN_BLOOM_FP_RATE = 0.001
+# the filter is written to SEEN_BLOOM_FILE at most every __ seconds and
+#   when the index is closed; a filter left behind by a crash is rebuilt
+SEEN_BLOOM_SAVE_INTERVAL = 300.0
+
+# counters, histograms and gauges across the pipeline are written in the
+#   Prometheus text format to METRICS_FILE at the end of each run
+# with main.py --daemon they are also served over HTTP on localhost at
+#   METRICS_PORT unless it is None
+METRICS = True
+METRICS_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                            '..',
+                            'data/metrics.prom')
+METRICS_PORT = None
+
+# record a span for each stage of each lookup (queue, thread pool, http,
+#   202 backoff, write) to TRACE_FILE, summarized with
+#   python -m fc.trace data/trace.jsonl
+TRACE = False
+TRACE_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                          '..',
+                          'data/trace.jsonl')
+
+# cache final Person API responses by normalized email so that an email
+#   seen under another id, or again after 10 days, is not looked up again
+RESPONSE_CACHE = True
+RESPONSE_CACHE_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                   '..',
+                                   'data/responses.db')
+# seconds to keep a response, per status code
+RESPONSE_CACHE_TTL = {200: 30 * 24 * 60 * 60,  # 30 days
+                      404: 24 * 60 * 60}  # 1 day
+RESPONSE_CACHE_MAX_ENTRIES = None  # no limit
+
+# every change to the lookup queue is journaled so that a run that dies can
+#   be picked up with main.py --resume
+# the journal is rewritten with only the pending lookups every __ events
+JOURNAL_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                            '..',
+                            'data/queue.journal')
+JOURNAL_COMPACT_EVERY = 10000
+JOURNAL_FSYNC = False
 
-# if receive a 202 response code, wait __ seconds before trying again
-RETRY_TIME = 30.0
+# when to retry a lookup, per status code
+# 202s are polled after 5, 10, 20, ... seconds (at most 120) so that emails
+#   that resolve quickly are picked up sooner, giving up after 20 polls
+# 503s wait for Retry-After when given, other 5xx back off from 30 seconds
+RETRY_POLICY = RetryPolicy({
+    202: RetryRule(base=5.0, factor=2.0, max_delay=120.0, max_attempts=20,
+                   jitter=0.2, retry_after=False),
+    500: RetryRule(base=30.0, factor=2.0, max_delay=300.0, max_attempts=3,
+                   jitter=0.2, retry_after=True),
+    502: RetryRule(base=30.0, factor=2.0, max_delay=300.0, max_attempts=3,
+                   jitter=0.2, retry_after=True),
+    503: RetryRule(base=30.0, factor=2.0, max_delay=600.0, max_attempts=5,
+                   jitter=0.2, retry_after=True),
+    504: RetryRule(base=30.0, factor=2.0, max_delay=300.0, max_attempts=3,
+                   jitter=0.2, retry_after=True),
+})
 
 # testing
 TEST_FLAG = False
@@ -0,0 +1,418 @@
+# standard library
+from urllib.parse import (urlencode,
+                          urlsplit)
+import asyncio
+import http.client
+import io
+import json
+import logging
+import ssl
+import time
+
+# local modules
+import fc.person as person
+import fc.scheduler as scheduler
+import fc.trace as trace
+import fc.utils as utils
+
+
+logger = logging.getLogger()
+
+class Response(object):
+    """ The parts of a requests object used by person.handle_response
+
+    Parameters
+    ----------
+    status_code : HTTP status code
+
+    headers : case insensitive mapping of response headers
+
+    content : response body as bytes
+    """
+    __slots__ = ('status_code', 'headers', 'content')
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
+
+class AsyncHTTPClient(object):
+    """ Minimal asyncio HTTP/1.1 client with keep-alive connection reuse
+
+    Built on asyncio streams so that thousands of requests can be in flight
+    on a single thread.  Only the features needed to talk to the Full
+    Contact API are supported: Content-Length and chunked bodies, no
+    redirects and no content encoding.
+
+    Parameters
+    ----------
+    url : base url; the scheme, host and port are used for connections
+
+    max_connections : maximum number of open connections
+        requests beyond this wait for a connection to be released
+
+    timeout : seconds to wait for a connection to open and, separately,
+        for the full response, as for PersonClient
+        raises TimeoutError (an OSError) when it expires
+    """
+    def __init__(self, url, max_connections=100, timeout=30.0):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.path = parts.path
+        if parts.scheme == 'https':
+            self.port = parts.port or 443
+            self.ssl = ssl.create_default_context()
+        else:
+            self.port = parts.port or 80
+            self.ssl = None
+        self.timeout = timeout
+        self._idle = []  # idle keep-alive (reader, writer) pairs
+        self._slots = asyncio.Semaphore(max_connections)
+
+    async def _wait(self, aw, what):
+        try:
+            return await asyncio.wait_for(aw, self.timeout)
+        except asyncio.TimeoutError:
+            # a plain TimeoutError is an OSError, like any connection error
+            raise TimeoutError('{} {}:{} timed out after {}s'.format(
+                what, self.host, self.port, self.timeout)) from None
+
+    async def _connect(self):
+        return await self._wait(asyncio.open_connection(self.host, self.port,
+                                                        ssl=self.ssl),
+                                'connecting to')
+
+    async def _send(self, conn, method, target, headers, body):
+        reader, writer = conn
+
+        lines = ['{} {} HTTP/1.1'.format(method, target),
+                 'Host: {}'.format(self.host),
+                 'Content-Length: {}'.format(len(body))]
+        lines.extend('{}: {}'.format(k, v) for k, v in headers.items())
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') +
+                     body)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError('connection closed by server')
+        version, status_code = status_line.split(None, 2)[:2]
+
+        header_lines = []
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            header_lines.append(line)
+        resp_headers = http.client.parse_headers(
+            io.BytesIO(b''.join(header_lines) + b'\r\n'))
+
+        keep_alive = (version == b'HTTP/1.1' and
+                      resp_headers.get('Connection', '').lower() != 'close')
+        if resp_headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()  # CRLF after each chunk
+            # skip any trailers
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            content = b''.join(chunks)
+        elif 'Content-Length' in resp_headers:
+            content = await reader.readexactly(
+                int(resp_headers['Content-Length']))
+        else:
+            content = await reader.read()
+            keep_alive = False
+
+        return Response(int(status_code), resp_headers, content), keep_alive
+
+    async def request(self, method, target, headers=None, body=b''):
+        """ Send a request and read the full response
+
+        A keep-alive connection is reused when one is idle.  If a reused
+        connection turns out to have been closed by the server the request
+        is retried once on a fresh connection.  A connection that times out
+        is closed and the TimeoutError raised.
+
+        Parameters
+        ----------
+        method : HTTP method such as POST
+
+        target : path and query string
+
+        headers : dict of request headers
+
+        body : request body as bytes
+
+        Returns
+        -------
+        r : a Response
+        """
+        headers = headers or {}
+        async with self._slots:
+            reused = bool(self._idle)
+            conn = self._idle.pop() if reused else await self._connect()
+            try:
+                r, keep_alive = await self._wait(
+                    self._send(conn, method, target, headers, body),
+                    'waiting on')
+            except (ConnectionError, asyncio.IncompleteReadError):
+                conn[1].close()
+                if not reused:
+                    raise
+                conn = await self._connect()
+                try:
+                    r, keep_alive = await self._wait(
+                        self._send(conn, method, target, headers, body),
+                        'waiting on')
+                except BaseException:
+                    conn[1].close()
+                    raise
+            except BaseException:
+                conn[1].close()
+                raise
+
+            if keep_alive:
+                self._idle.append(conn)
+            else:
+                conn[1].close()
+        return r
+
+    async def close(self):
+        """ Close all idle connections """
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
+
+
+async def query_person_async(client, api_key, lookup, lookup_value):
+    """ Query the Full Contact Person API without blocking the event loop
+
+    Parameters
+    ----------
+    client : an AsyncHTTPClient
+
+    api_key : Full Contact API key
+
+    lookup : lookup type
+        possible values include email, phone, or twitter handle
+
+    lookup_value : lookup value associated with lookup
+
+    Returns
+    -------
+    r : a Response
+    """
+    parameters = person.query_parameters(lookup, lookup_value)
+    target = '{}?{}'.format(client.path, urlencode(parameters))
+    headers = {'X-FullContact-APIKey': api_key}
+
+    person.IN_FLIGHT.inc()
+    start = time.perf_counter()
+    try:
+        r = await client.request('POST', target, headers)
+    finally:
+        person.IN_FLIGHT.dec()
+    person.HTTP_SECONDS.observe(time.perf_counter() - start)
+    return r
+
+
+async def process_one_email_async(q, count, id_val, dt, email, attempts,
+                                  client, api_key, limiter=None):
+    """ Asyncio counterpart of person.process_one_email
+
+    Parameters
+    ----------
+    q : an instance of scheduler.TimerQueue
+
+    count : the count from the original placement in the queue
+
+    id_val : id associated with email address
+
+    dt : datetime when the id was created
+
+    email : email address
+
+    attempts : tuple of retry.Attempt for earlier responses for this email
+
+    client : an AsyncHTTPClient
+
+    api_key : Full Contact API key
+
+    limiter : a ratelimit.RateLimiter re-synced from the response
+
+    Returns
+    -------
+    null
+    """
+    dt = dt.split()[0]
+
+    # a cached response is written without calling the API
+    # a retry (such as a 202 poll) was a miss when it was first submitted
+    if not attempts and person.check_cache(count, id_val, dt, email):
+        # the token taken for this lookup was not used
+        if limiter is not None:
+            limiter.release()
+        person.complete(q, count)
+        return
+
+    logger.info(('Post | email: {_email}  id: {_id}'
+                 ' | {_email} posted to the Full Contact Person API')
+            .format(_email=email, _id=id_val))
+    try:
+        with trace.timed(count, 'http', len(attempts)):
+            r = await query_person_async(client, api_key, 'email', email)
+    except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+        logger.info(('Error | email: {_email}  id: {_id}'
+                     ' | request failed: {_err!r}')
+                .format(_email=email, _id=id_val, _err=e))
+        person.LOOKUPS.labels(status='error').inc()
+        if limiter is not None:
+            limiter.update()
+        return
+
+    if limiter is not None:
+        limiter.update(r.status_code, r.headers)
+
+    with trace.timed(count, 'write', len(attempts)):
+        person.handle_response(q, count, id_val, dt, email, r, attempts)
+
+
+async def process_queue_async(q, max_in_flight=1000, max_connections=100,
+                              limiter=None, url=None, api_key=None,
+                              timeout=30.0, forever=False):
+    """ Process a priority queue based on time using asyncio
+
+    Same contract as scheduler.process_queue: an item is submitted once
+    the current time passes its priority and processing completes when
+    nothing has been submitted for QUEUE_TIMEOUT seconds and no request is
+    in flight.  The wait for the next due items is TimerQueue.get_due on
+    an executor thread, so the loop wakes exactly when an item comes due
+    or is put ahead of the head, such as a 202 put back by handle_response
+    from the event loop.
+
+    Parameters
+    ----------
+    q : an instance of scheduler.TimerQueue
+
+    max_in_flight : maximum number of concurrent lookups
+        bounds memory regardless of the size of the queue
+
+    max_connections : maximum number of open connections to the API
+
+    limiter : a ratelimit.RateLimiter
+        a token is taken before each submission
+
+    url : Person API endpoint, defaults to PERSON_API_URL
+
+    api_key : Full Contact API key, defaults to the contents of ~/.fc_key
+
+    timeout : seconds to wait for a connection or a response before the
+        lookup fails as with a connection error, see AsyncHTTPClient
+
+    forever : if True, keep waiting for new items however long the queue
+        is empty, until q.close() is called
+
+    Returns
+    -------
+    null
+    """
+    # import global
+    from fc import (PERSON_API_URL,
+                    QUEUE_TIMEOUT)
+
+    if api_key is None:
+        api_key = utils.get_api_key('fc_key')
+    client = AsyncHTTPClient(url if url is not None else PERSON_API_URL,
+                             max_connections, timeout)
+    slots = asyncio.Semaphore(max_in_flight)
+    in_flight = set()
+    last_submit = time.time()
+
+    def done(task):
+        in_flight.discard(task)
+        slots.release()
+
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            wait = (None if forever else
+                    max(QUEUE_TIMEOUT - (time.time() - last_submit), 0.0))
+            items = await loop.run_in_executor(None, q.get_due, wait)
+            if not items:
+                if not in_flight:
+                    break
+                # only lookups in flight can still add to the queue, each
+                #   putting its retry back before it finishes
+                await asyncio.wait(set(in_flight),
+                                   return_when=asyncio.FIRST_COMPLETED)
+                continue
+
+            # dispatch every item that is due
+            for priority, count, id_val, dt, email, attempts in items:
+                logger.info(('Submit | email: {_email}  id: {_id}'
+                             ' | submit {_email} for execution')
+                             .format(_email=email, _id=id_val))
+                q.submitted(count)
+
+                await slots.acquire()
+                if limiter is not None:
+                    await limiter.acquire_async()
+                submit_time = time.time()
+                scheduler.QUEUE_WAIT_SECONDS.observe(
+                    max(submit_time - priority, 0.0))
+                if attempts:
+                    trace.span(count, 'backoff', attempts[-1].time, priority,
+                               len(attempts))
+                trace.span(count, 'queue', priority, submit_time,
+                           len(attempts))
+                task = asyncio.ensure_future(
+                    process_one_email_async(q, count, id_val, dt, email,
+                                            attempts, client, api_key,
+                                            limiter))
+                in_flight.add(task)
+                task.add_done_callback(done)
+                last_submit = time.time()
+    finally:
+        if in_flight:
+            await asyncio.gather(*in_flight, return_exceptions=True)
+        await client.close()
+
+
+def run_queue_async(q, max_in_flight=1000, max_connections=100,
+                    limiter=None, url=None, api_key=None, timeout=30.0,
+                    forever=False):
+    """ Run process_queue_async to completion on a new event loop
+
+    Parameters
+    ----------
+    q : an instance of a priority queue
+
+    max_in_flight : maximum number of concurrent lookups
+
+    max_connections : maximum number of open connections to the API
+
+    limiter : a ratelimit.RateLimiter
+
+    url : Person API endpoint, defaults to PERSON_API_URL
+
+    api_key : Full Contact API key, defaults to the contents of ~/.fc_key
+
+    timeout : seconds to wait for a connection or a response
+
+    forever : if True, run until q.close() is called
+
+    Returns
+    -------
+    null
+    """
+    asyncio.run(process_queue_async(q, max_in_flight, max_connections,
+                                    limiter, url, api_key, timeout, forever))
@@ -0,0 +1,234 @@
+# standard lib
+from array import array
+import datetime
+import hashlib
+import json
+import logging
+import math
+import os
+import struct
+import sys
+
+logger = logging.getLogger()
+
+# number of days held, one bit each of a 16 bit mask
+MAX_DAYS = 16
+
+# bits, hash count, capacity, generation and length of the json day map
+#   that follows
+_HEADER = struct.Struct('<QIQQI')
+
+def bloom_key(id_val, email):
+    """ Encode an id and email as the bytes hashed by a Bloom filter """
+    return '{}\x1f{}'.format(id_val, email).encode('utf-8')
+
+
+def key_hashes(key):
+    """ Hash a bytes key once into the two values the bit positions are
+    derived from (double hashing)
+    """
+    h = int.from_bytes(hashlib.blake2b(key, digest_size=16).digest(),
+                       'little')
+    return h & 0xFFFFFFFFFFFFFFFF, (h >> 64) | 1
+
+
+def _day(dt):
+    if isinstance(dt, (datetime.datetime, datetime.date)):
+        return dt.strftime('%Y-%m-%d')
+    return dt[:10]
+
+
+class DailyBloomFilter(object):
+    """ Bloom filter partitioned by the day a key was seen
+
+    Each day is its own Bloom filter, sized for capacity keys at a false
+    positive rate of fp_rate, so a day that falls out of the window can be
+    dropped whole with expire, which a single Bloom filter cannot do.  A
+    key might be in the set if any day might contain it, so checking n
+    days has a false positive rate of up to n * fp_rate.
+
+    The days share one array of bit positions, each holding a 16 bit mask
+    with a bit per day.  Adding a key sets its day's bit at each of the
+    key's positions, and checking a key ANDs the masks at its positions,
+    stopping as soon as no day is left.  A check is one hash and a few
+    array reads however many days are held.
+
+    Up to MAX_DAYS days are held.  Adding to yet another day shares the bit
+    of the most recent day, which is then kept until the later day expires.
+
+    Parameters
+    ----------
+    path : full path to the file the filter is saved to
+        loaded if it exists and was built with the same capacity and
+        fp_rate
+
+    capacity : number of keys each day is sized for
+
+    fp_rate : false positive rate of each day once capacity keys are added
+
+    Attributes
+    ----------
+    generation : set by the owner of the filter and saved with it, such as
+        the state of the index the filter was built from, so that a stale
+        file can be told apart; 0 for an empty filter
+    """
+    def __init__(self, path, capacity=250000, fp_rate=0.001):
+        self.path = path
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.num_bits = max(8, int(math.ceil(-capacity * math.log(fp_rate) /
+                                             math.log(2) ** 2)))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity *
+                                           math.log(2))))
+        self.clear()
+        if os.path.isfile(path):
+            self.load()
+
+    def __len__(self):
+        return sum(count for _, count in self.days.values())
+
+    def _positions(self, key):
+        h1, h2 = key_hashes(key)
+        num_bits = self.num_bits
+        h1 %= num_bits
+        h2 %= num_bits
+        return ((h1 + i * h2) % num_bits for i in range(self.num_hashes))
+
+    def __contains__(self, key):
+        # _positions inlined, this is called for every email
+        h1, h2 = key_hashes(key)
+        num_bits = self.num_bits
+        h1 %= num_bits
+        h2 %= num_bits
+        masks = self.masks
+        found = 0xFFFF
+        for i in range(self.num_hashes):
+            found &= masks[(h1 + i * h2) % num_bits]
+            if not found:
+                return False
+        return True
+
+    def add(self, key, dt):
+        """ Add a bytes key seen on the day of dt
+
+        Parameters
+        ----------
+        key : bytes, see bloom_key
+
+        dt : datetime or 'YYYY-MM-DD HH:MM:SS' string
+
+        Returns
+        -------
+        null
+        """
+        day = _day(dt)
+        entry = self.days.get(day)
+        if entry is None:
+            entry = self._add_day(day)
+        entry[1] += 1
+        if entry[1] == self.capacity + 1:
+            logger.info('Bloom | more than {_n} keys on {_day}, the false'
+                        ' positive rate will rise'
+                        .format(_n=self.capacity, _day=day))
+
+        masks = self.masks
+        bit = 1 << entry[0]
+        for pos in self._positions(key):
+            masks[pos] |= bit
+
+    def _add_day(self, day):
+        used = {bit for bit, _ in self.days.values()}
+        free = [bit for bit in range(MAX_DAYS) if bit not in used]
+        if free:
+            entry = self.days[day] = [free[0], 0]
+            return entry
+
+        # every bit is taken, share the bit of the most recent day
+        latest = max(self.days)
+        if day < latest:
+            return self.days[latest]
+        entry = self.days[day] = self.days.pop(latest)
+        return entry
+
+    def expire(self, cutoff):
+        """ Drop every day before the day of the cutoff
+
+        Parameters
+        ----------
+        cutoff : datetime or 'YYYY-MM-DD HH:MM:SS' string
+
+        Returns
+        -------
+        num_dropped : number of days dropped
+        """
+        cutoff_day = _day(cutoff)
+        dropped = [day for day in self.days if day < cutoff_day]
+        if not dropped:
+            return 0
+
+        keep = 0xFFFF
+        for day in dropped:
+            keep &= ~(1 << self.days.pop(day)[0])
+        # clear the dropped bits from every mask a byte at a time, the low
+        #   and high bytes of the masks alternate in memory
+        data = bytearray(self.masks.tobytes())
+        low, high = (0, 1) if sys.byteorder == 'little' else (1, 0)
+        for start, byte_keep in ((low, keep & 0xFF), (high, keep >> 8)):
+            if byte_keep != 0xFF:
+                table = bytes(b & byte_keep for b in range(256))
+                data[start::2] = data[start::2].translate(table)
+        self.masks = array('H', bytes(data))
+        return len(dropped)
+
+    def clear(self):
+        """ Drop every day """
+        # day -> [mask bit, number of keys added]
+        self.days = {}
+        self.masks = array('H', bytes(2 * self.num_bits))
+        self.generation = 0
+
+    def save(self):
+        """ Write the filter to path """
+        day_map = json.dumps(self.days, sort_keys=True).encode('utf-8')
+        masks = self.masks
+        if sys.byteorder != 'little':
+            masks = array('H', masks)
+            masks.byteswap()
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(self.num_bits, self.num_hashes,
+                                 self.capacity, self.generation,
+                                 len(day_map)))
+            f.write(day_map)
+            f.write(masks.tobytes())
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        """ Read the filter from path
+
+        A file built with another capacity or fp_rate, or that is damaged,
+        is ignored and the filter is left empty.
+        """
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        try:
+            num_bits, num_hashes, _, generation, map_size = \
+                _HEADER.unpack_from(data)
+            if (num_bits, num_hashes) != (self.num_bits, self.num_hashes):
+                raise ValueError('built with another capacity or fp_rate')
+            offset = _HEADER.size + map_size
+            days = json.loads(data[_HEADER.size:offset].decode('utf-8'))
+            if len(data) - offset != 2 * num_bits:
+                raise ValueError('truncated')
+        except (struct.error, ValueError) as e:
+            logger.info('Bloom | ignoring {_path}: {_err}'
+                        .format(_path=self.path, _err=e))
+            self.clear()
+            return
+
+        masks = array('H', data[offset:])
+        if sys.byteorder != 'little':
+            masks.byteswap()
+        self.masks = masks
+        self.days = days
+        self.generation = generation
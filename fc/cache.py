@@ -0,0 +1,192 @@
+# standard library
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger()
+
+def normalize_email(email):
+    """ Normalize an email address for use as a cache key
+
+    Parameters
+    ----------
+    email : email address
+
+    Returns
+    -------
+    key : the email address stripped of surrounding whitespace and lower
+        cased
+    """
+    return email.strip().lower()
+
+
+class CachedResponse(object):
+    """ A response read back from the cache
+
+    Parameters
+    ----------
+    status_code : HTTP status code of the original response
+
+    content : response body as bytes
+
+    fetched_at : time (as from time.time()) of the original response
+    """
+    __slots__ = ('status_code', 'content', 'fetched_at')
+
+    def __init__(self, status_code, content, fetched_at):
+        self.status_code = status_code
+        self.content = content
+        self.fetched_at = fetched_at
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
+
+class ResponseCache(object):
+    """ On-disk cache of Person API responses keyed by normalized email
+
+    Only final responses are stored, by default 200s and 404s.  Each status
+    code has its own time to live so that a 404 can be retried sooner than
+    a 200 is refreshed.  The cache is safe to share between threads.
+
+    Parameters
+    ----------
+    db_path : full path to the sqlite database file
+        created if it does not already exist
+
+    ttl : dict mapping the status codes to cache to a time to live in
+        seconds
+
+    max_entries : when set, evict keeps at most this many of the most
+        recently fetched entries
+    """
+    def __init__(self, db_path, ttl=None, max_entries=None):
+        if ttl is None:
+            ttl = {200: 30 * 24 * 60 * 60, 404: 24 * 60 * 60}
+        self.db_path = db_path
+        self.ttl = dict(ttl)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.cnxn = sqlite3.connect(db_path, check_same_thread=False)
+        self.cnxn.executescript('''
+            pragma journal_mode = wal;
+            pragma synchronous = normal;
+            create table if not exists responses (
+                email text primary key,
+                status_code integer not null,
+                body blob not null,
+                fetched_at real not null
+            ) without rowid;
+            create index if not exists responses_fetched_at
+                on responses (fetched_at);
+        ''')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """ Close the underlying sqlite connection """
+        with self.lock:
+            self.cnxn.close()
+
+    def get(self, email, now=None):
+        """ Look up a response that has not outlived its time to live
+
+        Parameters
+        ----------
+        email : email address, normalized before lookup
+
+        now : current time as from time.time(), defaults to time.time()
+
+        Returns
+        -------
+        r : a CachedResponse, or None on a miss
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            row = self.cnxn.execute('select status_code, body, fetched_at'
+                                    ' from responses where email = ?',
+                                    (normalize_email(email),)).fetchone()
+            if (row is None or
+                    now - row[2] > self.ttl.get(row[0], 0)):
+                self.misses += 1
+                return None
+            self.hits += 1
+        return CachedResponse(row[0], bytes(row[1]), row[2])
+
+    def put(self, email, status_code, content, fetched_at=None):
+        """ Store a response if its status code is cacheable
+
+        Parameters
+        ----------
+        email : email address, normalized before storing
+
+        status_code : HTTP status code
+
+        content : response body as bytes
+
+        fetched_at : time of the response, defaults to time.time()
+
+        Returns
+        -------
+        stored : True if the response was stored
+        """
+        if status_code not in self.ttl:
+            return False
+        if fetched_at is None:
+            fetched_at = time.time()
+        with self.lock, self.cnxn:
+            self.cnxn.execute('insert or replace into responses'
+                              ' (email, status_code, body, fetched_at)'
+                              ' values (?, ?, ?, ?)',
+                              (normalize_email(email), status_code,
+                               content, fetched_at))
+        return True
+
+    def evict(self, now=None):
+        """ Remove expired entries and trim to max_entries
+
+        Parameters
+        ----------
+        now : current time as from time.time(), defaults to time.time()
+
+        Returns
+        -------
+        num_evicted : number of entries removed
+        """
+        if now is None:
+            now = time.time()
+        num_evicted = 0
+        with self.lock, self.cnxn:
+            for status_code, ttl in self.ttl.items():
+                crsr = self.cnxn.execute('delete from responses'
+                                         ' where status_code = ?'
+                                         ' and fetched_at < ?',
+                                         (status_code, now - ttl))
+                num_evicted += crsr.rowcount
+            if self.max_entries is not None:
+                crsr = self.cnxn.execute('''
+                    delete from responses where fetched_at < (
+                        select fetched_at from responses
+                        order by fetched_at desc
+                        limit 1 offset ?)
+                ''', (self.max_entries - 1,))
+                num_evicted += crsr.rowcount
+        return num_evicted
+
+    def summary(self):
+        """ Return a one line summary of the hit and miss counters """
+        with self.lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return ('hits: {_hits} | misses: {_misses} | hit rate: {_rate:.1%}'
+                .format(_hits=hits, _misses=misses,
+                        _rate=hits / lookups if lookups else 0.0))
@@ -0,0 +1,189 @@
+# standard library
+import datetime
+import logging
+import signal
+import threading
+import time
+
+# local modules
+import fc.dedupe as dedupe
+import fc.emails as emails
+import fc.utils as utils
+
+logger = logging.getLogger()
+
+class Daemon(object):
+    """ Long running lookup service fed by polling the database
+
+    Rather than extracting the previous hour from cron, the daemon polls
+    schema.dbtable every poll_interval seconds for rows with a dt above a
+    high-water mark kept in the seen index.  Emails that have not been seen
+    within the window are put straight on the live queue, which a
+    lookup thread works through for as long as the daemon runs.  The
+    seen index, the database connection, the HTTP connection pool and the
+    response cache are opened once and stay warm between polls.
+
+    Each poll starts overlap seconds before the high-water mark so that
+    rows committed late with an earlier dt are still picked up; the seen
+    index drops the rows that were already polled.
+
+    Parameters
+    ----------
+    seen_index : a seen.SeenIndex, only used from the thread calling run
+
+    q : a scheduler.TimerQueue, usually with a journal
+
+    lookup : function taking the queue and working through it until
+        q.close() is called, such as person.run_lookups with forever=True
+
+    poll_interval : seconds between polls of the database
+
+    overlap : seconds before the high-water mark each poll starts from
+
+    window_days : number of days an email is not looked up again for
+
+    fetch : function(time_start, time_end) returning Email named tuples
+        with time_start <= dt < time_end
+        defaults to querying the database over a connection kept open
+        between polls
+    """
+    def __init__(self, seen_index, q, lookup, poll_interval=60.0,
+                 overlap=300.0, window_days=10, fetch=None):
+        self.seen_index = seen_index
+        self.q = q
+        self.lookup = lookup
+        self.poll_interval = poll_interval
+        self.overlap = datetime.timedelta(seconds=overlap)
+        self.window = datetime.timedelta(days=window_days)
+        self.fetch = fetch if fetch is not None else self._fetch_from_db
+        self.cnxn = None
+        self.stopping = threading.Event()
+        # carry on counting after anything rebuilt from the journal
+        self.count = q.next_count()
+
+    def _fetch_from_db(self, time_start, time_end):
+        if self.cnxn is None:
+            self.cnxn = emails.connect()
+        # a poll only covers a minute or so of rows, not worth handing to
+        #   a process pool
+        return emails.iter_emails(time_start, time_end, end_inclusive=False,
+                                  cnxn=self.cnxn, xml_workers=0)
+
+    def start_mark(self, now):
+        """ Return the dt the first poll should start from
+
+        Continues from the high-water mark of an earlier daemon, or from
+        where the hourly runs left off.  On a fresh install the history is
+        loaded first, without looking it up, as the first hourly run would.
+
+        Parameters
+        ----------
+        now : the current datetime
+
+        Returns
+        -------
+        high_water_mark : a datetime
+        """
+        high_water_mark = self.seen_index.get_high_water_mark()
+        if high_water_mark is None:
+            high_water_mark = self.seen_index.get_loaded_through()
+        if high_water_mark is None:
+            start_prev_hr = utils.hour_floor(now) - datetime.timedelta(hours=1)
+            self.seen_index.add(emails.get_unique_emails(now - self.window,
+                                                         start_prev_hr))
+            high_water_mark = start_prev_hr
+        # rows older than the window would be looked up again anyway
+        return max(high_water_mark, now - self.window)
+
+    def poll(self, now=None):
+        """ Queue the unseen emails added since the high-water mark
+
+        Parameters
+        ----------
+        now : the current datetime, defaults to datetime.datetime.now()
+
+        Returns
+        -------
+        num_queued : number of emails put on the queue
+        """
+        if now is None:
+            now = datetime.datetime.now()
+        # whole seconds, as dt is compared as a string
+        now = now.replace(microsecond=0)
+
+        high_water_mark = self.seen_index.get_high_water_mark()
+        if high_water_mark is None:
+            high_water_mark = self.start_mark(now)
+
+        self.seen_index.expire(now - self.window)
+        emails_unique = dedupe.earliest_per_key(
+            self.fetch(high_water_mark - self.overlap, now),
+            ('id', 'email'), 'dt')
+        emails_to_process = list(self.seen_index.filter_unseen(emails_unique))
+        self.seen_index.add(emails_unique)
+        self.seen_index.set_high_water_mark(now)
+        # an hourly run started later only looks at hours after this one
+        self.seen_index.set_loaded_through(utils.hour_floor(now))
+
+        execute_time = time.time()
+        for email in emails_to_process:
+            logger.info(('Queue | email: {_email}  id: {_id}'
+                         ' | add {_email} to the queue')
+                    .format(_email=email.email, _id=email.id))
+            self.q.put((execute_time, self.count, email.id, email.dt,
+                        email.email, ()))
+            self.count += 1
+
+        logger.info('Daemon | polled {_start} to {_end} | queued {_n} emails'
+                    .format(_start=high_water_mark - self.overlap, _end=now,
+                            _n=len(emails_to_process)))
+        return len(emails_to_process)
+
+    def stop(self, *args):
+        """ Ask run to return after the current poll
+
+        Usable as a signal handler.
+        """
+        self.stopping.set()
+
+    def run(self):
+        """ Poll and look up emails until stop is called or on SIGTERM
+
+        Lookups in flight are finished before returning.  Lookups that are
+        queued but not yet due, such as 202s waiting to be polled again,
+        are left in the journal for the next start.
+
+        Returns
+        -------
+        null
+        """
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+
+        worker = threading.Thread(target=self.lookup, args=(self.q,),
+                                  name='fc-lookups')
+        worker.start()
+        try:
+            while not self.stopping.is_set():
+                try:
+                    self.poll()
+                except Exception:
+                    logger.exception('Daemon | poll failed, reconnecting'
+                                     ' at the next poll')
+                    self._close_cnxn()
+                self.stopping.wait(self.poll_interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            logger.info('Daemon | stopping')
+            self.q.close()
+            worker.join()
+        self._close_cnxn()
+
+    def _close_cnxn(self):
+        if self.cnxn is not None:
+            try:
+                self.cnxn.close()
+            except Exception:
+                pass
+            self.cnxn = None
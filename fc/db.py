@@ -0,0 +1,319 @@
+# standard lib
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import datetime
+import logging
+import queue
+import sqlite3
+import threading
+
+# third party
+import pymssql
+
+# local modules
+import fc.utils as utils
+
+logger = logging.getLogger()
+
+def _dt_str(dt):
+    """ Format a datetime the same way as the dt element of an Email """
+    if isinstance(dt, datetime.datetime):
+        return dt.strftime('%Y-%m-%d %H:%M:%S')
+    return dt
+
+
+class SqlServerSource(object):
+    """ schema.dbtable on SQL Server, queried with pymssql """
+    placeholder = '%s'
+    table = 'schema.dbtable (nolock)'
+
+    def connect(self):
+        """ Open a connection to the SQL server database
+
+        Returns
+        -------
+        cnxn : a pymssql connection
+        """
+        # get password for SQL connection
+        my_pw = utils.get_api_key('mypw')
+
+        # establish connection
+        # 'server' must match the bracketed entry name within
+        #   /etc/freetds.conf
+        return pymssql.connect(server='myservername:1433',
+                               database='mydatabase',
+                               user=r'DOMAIN\username',
+                               password=my_pw)
+
+
+class SqliteSource(object):
+    """ A local sqlite stand-in for schema.dbtable
+
+    Lets extraction be tested and benchmarked without SQL Server.  The
+    table is named dbtable and has the same dt, id and XML columns, with dt
+    stored as 'YYYY-MM-DD HH:MM:SS' text.  See create_sqlite_table.
+
+    Parameters
+    ----------
+    db_path : full path to the sqlite database file
+    """
+    placeholder = '?'
+    table = 'dbtable'
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def connect(self):
+        """ Open a connection to the sqlite database
+
+        Returns
+        -------
+        cnxn : a sqlite3 connection usable from any one thread at a time
+        """
+        return sqlite3.connect(self.db_path, check_same_thread=False)
+
+
+def create_sqlite_table(db_path, rows):
+    """ Create and fill the dbtable of a sqlite stand-in
+
+    Parameters
+    ----------
+    db_path : full path to the sqlite database file
+
+    rows : iterable of tuples (dt, id, XML)
+        dt may be a datetime or a 'YYYY-MM-DD HH:MM:SS' string
+
+    Returns
+    -------
+    source : a SqliteSource for the database
+    """
+    with contextlib.closing(sqlite3.connect(db_path)) as cnxn, cnxn:
+        cnxn.executescript('''
+            create table if not exists dbtable (
+                dt text not null,
+                id text not null,
+                XML text
+            );
+            create index if not exists dbtable_dt on dbtable (dt);
+        ''')
+        cnxn.executemany('insert into dbtable (dt, id, XML) values (?, ?, ?)',
+                         ((_dt_str(dt), id_val, xml)
+                          for dt, id_val, xml in rows))
+    return SqliteSource(db_path)
+
+
+class ConnectionPool(object):
+    """ A small pool of open database connections
+
+    Connections are opened as they are first needed, up to size, and are
+    handed to one thread at a time.  A connection that raised an error is
+    closed rather than returned to the pool.
+
+    Parameters
+    ----------
+    source : a SqlServerSource or SqliteSource
+
+    size : maximum number of open connections
+    """
+    def __init__(self, source, size=4):
+        self.source = source
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.num_open = 0
+
+    @contextlib.contextmanager
+    def connection(self):
+        """ Borrow a connection, waiting for one if all are in use """
+        try:
+            cnxn = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                can_open = self.num_open < self.size
+                if can_open:
+                    self.num_open += 1
+            if can_open:
+                try:
+                    cnxn = self.source.connect()
+                except Exception:
+                    with self.lock:
+                        self.num_open -= 1
+                    raise
+            else:
+                cnxn = self.idle.get()
+
+        try:
+            yield cnxn
+        except Exception:
+            with self.lock:
+                self.num_open -= 1
+            try:
+                cnxn.close()
+            except Exception:
+                pass
+            raise
+        self.idle.put(cnxn)
+
+    def close(self):
+        """ Close every idle connection """
+        while True:
+            try:
+                cnxn = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            with self.lock:
+                self.num_open -= 1
+            cnxn.close()
+
+
+def fetch_batches(cnxn, source, time_start, time_end, end_inclusive=False,
+                  arraysize=5000):
+    """ Query a range of schema.dbtable in dt order
+
+    The time bounds are passed as query parameters rather than formatted
+    into the SQL.
+
+    Parameters
+    ----------
+    cnxn : an open connection for the source
+
+    source : a SqlServerSource or SqliteSource
+
+    time_start : start datetime, inclusive
+
+    time_end : end datetime
+
+    end_inclusive : if True, include rows at exactly time_end
+
+    arraysize : number of rows to fetch at any one time
+
+    Returns
+    -------
+    rows : yields lists of tuples (id, dt, XML) with dt as a string
+    """
+    sql_string = '''
+    select  id
+           ,dt
+           ,XML
+    from {_table}
+    where dt >= {_p} and dt {_op} {_p}
+    order by dt
+    '''.format(_table=source.table, _p=source.placeholder,
+               _op='<=' if end_inclusive else '<')
+
+    crsr = cnxn.cursor()
+    try:
+        crsr.execute(sql_string, (_dt_str(time_start), _dt_str(time_end)))
+        while True:
+            rows = crsr.fetchmany(arraysize)
+            if not rows:
+                break
+            yield [(id_val, _dt_str(dt), xml) for id_val, dt, xml in rows]
+    finally:
+        crsr.close()
+
+
+def split_range(time_start, time_end, parts):
+    """ Split [time_start, time_end) into consecutive sub-ranges
+
+    Each boundary is rounded down to the second, as dt has no fractional
+    seconds.
+
+    Parameters
+    ----------
+    time_start : a datetime
+
+    time_end : a datetime
+
+    parts : number of sub-ranges
+
+    Returns
+    -------
+    ranges : list of tuples (start, end), earliest first
+    """
+    step = (time_end - time_start) / max(parts, 1)
+    bounds = [time_start]
+    for i in range(1, parts):
+        bound = (time_start + step * i).replace(microsecond=0)
+        if bound > bounds[-1]:
+            bounds.append(bound)
+    bounds.append(time_end)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+# put on a sub-range's queue once all of its rows have been fetched
+_DONE = object()
+
+def iter_batches_split(pool, time_start, time_end, end_inclusive=False,
+                       parts=4, arraysize=5000, max_buffered=4):
+    """ Fetch a range as concurrent sub-ranges and yield rows in dt order
+
+    The range is split with split_range and every sub-range is queried on
+    its own pooled connection.  Each sub-range is returned in dt order and
+    the sub-ranges do not overlap, so yielding them one after another
+    merges the results in order.  Later sub-ranges are fetched while the
+    earlier ones are being consumed, holding at most max_buffered batches
+    each.
+
+    Parameters
+    ----------
+    pool : a ConnectionPool
+
+    time_start : start datetime, inclusive
+
+    time_end : end datetime
+
+    end_inclusive : if True, include rows at exactly time_end
+
+    parts : number of sub-ranges
+
+    arraysize : number of rows to fetch at any one time
+
+    max_buffered : number of fetched batches held per sub-range
+
+    Returns
+    -------
+    rows : yields lists of tuples (id, dt, XML) with dt as a string
+    """
+    ranges = split_range(time_start, time_end, parts)
+    buffers = [queue.Queue(max_buffered) for _ in ranges]
+    abandoned = threading.Event()
+
+    def put(buffer, item):
+        # give up if the consumer stops reading
+        while not abandoned.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def fetch(i):
+        sub_start, sub_end = ranges[i]
+        inclusive = end_inclusive and i == len(ranges) - 1
+        try:
+            with pool.connection() as cnxn:
+                for rows in fetch_batches(cnxn, pool.source, sub_start,
+                                          sub_end, inclusive, arraysize):
+                    if not put(buffers[i], rows):
+                        return
+        except Exception as e:
+            put(buffers[i], e)
+            return
+        put(buffers[i], _DONE)
+
+    with ThreadPoolExecutor(max_workers=pool.size) as executor:
+        for i in range(len(ranges)):
+            executor.submit(fetch, i)
+        try:
+            for buffer in buffers:
+                while True:
+                    rows = buffer.get()
+                    if rows is _DONE:
+                        break
+                    if isinstance(rows, Exception):
+                        raise rows
+                    yield rows
+        finally:
+            abandoned.set()
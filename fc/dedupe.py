@@ -0,0 +1,174 @@
+# standard lib
+from operator import attrgetter
+
+# local modules
+import fc.metrics as metrics
+
+# shared by every stage that drops emails, see fc.emails, fc.seen and
+#   fc.utils
+EMAILS_DEDUPED = metrics.counter(
+    'fc_emails_deduped_total', 'Emails dropped as duplicates', ['stage'])
+
+def counted(items, counts):
+    """ Pass items through, counting them into counts[0]
+
+    Counts an iterator for the dedupe metrics without materializing it.
+
+    Parameters
+    ----------
+    items : iterable
+
+    counts : a list whose first element is incremented for each item
+
+    Returns
+    -------
+    item : yields each item unchanged
+    """
+    for item in items:
+        counts[0] += 1
+        yield item
+
+
+def key_getter(dedupe):
+    """ Compile a key extractor for a subset of named tuple elements
+
+    Replaces the exec and metaprogramming hacks that were previously used to
+    build the comparison tuples on every row.  The extractor is built once
+    and then called for each item.
+
+    Parameters
+    ----------
+    dedupe : tuple containing the named tuple elements to dedupe on
+        akin to the 'by' statement in a sort procedure
+
+    Returns
+    -------
+    getter : a callable that returns a tuple of the dedupe elements
+        a single element still returns a 1-tuple so that keys are
+        consistent regardless of the size of dedupe
+    """
+    dedupe = tuple(dedupe)
+    if not dedupe:
+        raise ValueError('dedupe should contain at least one element')
+
+    getter = attrgetter(*dedupe)
+    if len(dedupe) == 1:
+        return lambda item: (getter(item),)
+    return getter
+
+
+def build_key_set(items, dedupe):
+    """ Build a hashed set of keys from an iterable of named tuples
+
+    Parameters
+    ----------
+    items : iterable containing named tuples
+
+    dedupe : tuple containing the named tuple elements to dedupe on
+
+    Returns
+    -------
+    keys : a set of tuples with just the elements of dedupe
+    """
+    return set(map(key_getter(dedupe), items))
+
+
+def anti_join(items_base, items_compare, dedupe, keys=False):
+    """ Stream named tuples in a base iterable that are not in a comparison
+    iterable
+
+    Comparison is based on elements of the parameter dedupe.  The comparison
+    items are consumed once into a hashed set of keys, after which each base
+    item is checked in O(1).  The base items are never materialized, so
+    items_base may be any iterator.
+
+    Parameters
+    ----------
+    items_base : iterable containing named tuples that is to be deduped
+
+    items_compare : iterable containing named tuples to be compared against
+        or, with keys=True, a set of key tuples already built with
+        build_key_set
+
+    dedupe : tuple containing the named tuple elements to dedupe on
+
+    keys : if True, items_compare is used as the key set as is rather than
+        hashed; a set of named tuples is otherwise treated as any other
+        iterable of named tuples
+
+    Returns
+    -------
+    item : yields the named tuples from items_base whose key is not found
+        within items_compare
+    """
+    get_key = key_getter(dedupe)
+    if keys:
+        key_set = items_compare
+    else:
+        key_set = set(map(get_key, items_compare))
+
+    for item in items_base:
+        if get_key(item) not in key_set:
+            yield item
+
+
+def unique(items, dedupe):
+    """ Stream the first named tuple seen for each combination of the
+    dedupe elements
+
+    Parameters
+    ----------
+    items : iterable containing named tuples
+
+    dedupe : tuple containing the named tuple elements to dedupe on
+
+    Returns
+    -------
+    item : yields named tuples whose key has not been seen before
+    """
+    get_key = key_getter(dedupe)
+    seen = set()
+    for item in items:
+        key = get_key(item)
+        if key not in seen:
+            seen.add(key)
+            yield item
+
+
+def earliest_per_key(items, dedupe=('id', 'email'), order_by='dt',
+                     ordered=False):
+    """ Keep the named tuple with the smallest order_by value per key
+
+    A single pass hash aggregation that replaces sorting the full input by
+    (key, order_by) and then keeping the first item per key.  Only one item
+    per key is ever held in memory.  On ties the first item seen is kept.
+
+    Parameters
+    ----------
+    items : iterable containing named tuples
+
+    dedupe : tuple containing the named tuple elements to dedupe on
+
+    order_by : named tuple element to minimize within each key
+        for the dt element the string format '%Y-%m-%d %H:%M:%S' sorts
+        the same as the underlying datetime
+
+    ordered : if True, return the output sorted by the dedupe elements
+        which matches the order produced by sorting before deduping
+
+    Returns
+    -------
+    output : a list of named tuples, one per key
+    """
+    get_key = key_getter(dedupe)
+    get_order = attrgetter(order_by)
+    earliest = {}
+    for item in items:
+        key = get_key(item)
+        current = earliest.get(key)
+        if current is None or get_order(item) < get_order(current):
+            earliest[key] = item
+
+    if ordered:
+        return [earliest[key] for key in sorted(earliest)]
+    return list(earliest.values())
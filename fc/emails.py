@@ -1,14 +1,34 @@
 # standard lib
-from operator import attrgetter
+import logging
 from os.path import expanduser
-from collections import namedtuple
-
-# third party
-from lxml import etree as et
-import pymssql
+import threading
+import time
 
 # local modules
-import fc.utils as utils
+import fc.db as db
+import fc.dedupe as dedupe
+from fc.dedupe import EMAILS_DEDUPED
+import fc.extract as extract
+import fc.metrics as metrics
+import fc.partitions as partitions
+import fc.records as records
+from fc.records import Email
+
+logger = logging.getLogger()
+
+ROWS_FETCHED = metrics.counter(
+    'fc_rows_fetched_total', 'Rows fetched from schema.dbtable')
+XML_EMAIL_MISSING = metrics.counter(
+    'fc_xml_email_missing_total',
+    'Rows whose XML did not contain an email address')
+XML_PARSE_FAILURES = metrics.counter(
+    'fc_xml_parse_failures_total',
+    'Rows skipped as their XML could not be parsed')
+DB_FETCH_SECONDS = metrics.histogram(
+    'fc_db_fetch_seconds', 'Seconds waiting on the database for a batch')
+XML_PARSE_SECONDS = metrics.histogram(
+    'fc_xml_parse_seconds', 'Seconds parsing the XML of a batch')
+
 
 def db_row_iter(crsr, arraysize=1000):
     """ Return an iterator that uses fetchmany
@@ -36,6 +56,218 @@ def db_row_iter(crsr, arraysize=1000):
             yield row
 
 
+def db_batch_iter(crsr, arraysize=1000):
+    """ Return an iterator over batches of rows that uses fetchmany
+
+    Parameters
+    ----------
+    crsr : a database cursor
+
+    arraysize: number of records to fetch at any one time
+
+    Returns
+    -------
+    rows : yields one list of rows at a time
+    """
+    while True:
+        rows = crsr.fetchmany(arraysize)
+        if not rows:
+            break
+        yield rows
+
+
+def _timed_batches(batches, counts):
+    # time spent waiting on each batch, counting the rows into counts[0]
+    batches = iter(batches)
+    while True:
+        start = time.perf_counter()
+        rows = next(batches, None)
+        if rows is None:
+            return
+        DB_FETCH_SECONDS.observe(time.perf_counter() - start)
+        ROWS_FETCHED.inc(len(rows))
+        counts[0] += len(rows)
+        yield rows
+
+
+def get_source():
+    """ Return the database holding schema.dbtable
+
+    Returns
+    -------
+    source : a db.SqliteSource when DB_SQLITE_FILE is set, otherwise a
+        db.SqlServerSource
+    """
+    # import global
+    from fc import DB_SQLITE_FILE
+
+    if DB_SQLITE_FILE:
+        return db.SqliteSource(DB_SQLITE_FILE)
+    return db.SqlServerSource()
+
+
+def connect():
+    """ Open a connection to the database holding schema.dbtable
+
+    Returns
+    -------
+    cnxn : a pymssql connection, or sqlite3 with DB_SQLITE_FILE
+    """
+    return get_source().connect()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """ Return the connection pool shared by the process
+
+    Returns
+    -------
+    pool : a db.ConnectionPool of up to DB_POOL_SIZE connections
+    """
+    # import global
+    from fc import DB_POOL_SIZE
+
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = db.ConnectionPool(get_source(), DB_POOL_SIZE)
+        return _pool
+
+
+_xml_pool = None
+_xml_pool_key = None
+
+def get_xml_pool(workers):
+    """ Return the XML extraction process pool shared by the process
+
+    The pool is started on first use and reused by every later query, such
+    as each hour extracted for the partition cache, rather than started
+    and shut down per query.  It is replaced if the number of workers or
+    the extraction settings change.
+
+    Parameters
+    ----------
+    workers : number of worker processes
+
+    Returns
+    -------
+    pool : a ProcessPoolExecutor from extract.make_pool
+    """
+    # import global
+    from fc import (EMAIL_NSMAP,
+                    EMAIL_XPATH,
+                    XML_EARLY_EXIT)
+
+    global _xml_pool, _xml_pool_key
+    key = (workers, EMAIL_XPATH, sorted(EMAIL_NSMAP.items()), XML_EARLY_EXIT)
+    with _pool_lock:
+        if _xml_pool is None or _xml_pool_key != key:
+            if _xml_pool is not None:
+                _xml_pool.shutdown()
+            _xml_pool = extract.make_pool(EMAIL_XPATH, EMAIL_NSMAP,
+                                          XML_EARLY_EXIT, workers)
+            _xml_pool_key = key
+        return _xml_pool
+
+
+def iter_emails(time_start, time_end, end_inclusive=True, cnxn=None,
+                xml_workers=None, pool=None, parts=None):
+    """ Query a SQL server database and stream email addresses
+
+    The range is split into parts sub-ranges that are fetched concurrently
+    over pooled connections, and the rows are returned in dt order.
+
+    Parameters
+    ----------
+    time_start : start time for querying email addresses
+        used as a query parameter when executing SQL
+
+    time_end : end time for querying email addresses
+        used as a query parameter when executing SQL
+
+    end_inclusive : if True, use time_start <= dt <= time_end
+        otherwise use time_start <= dt < time_end
+
+    cnxn : an open connection from connect() to use for the whole range
+        rather than the pool
+
+    xml_workers : number of processes parsing XML, defaults to XML_WORKERS
+        0 parses within this process, which suits small queries
+        the processes are shared across queries, see get_xml_pool
+
+    pool : a db.ConnectionPool, defaults to get_pool()
+
+    parts : number of sub-ranges, defaults to DB_SPLIT_PARTS
+
+    Returns
+    -------
+    email : yields one Email named tuple (id, dt, email) at a time
+        duplicates are not removed
+    """
+    # import global
+    from fc import (DB_ARRAYSIZE,
+                    DB_SPLIT_PARTS,
+                    EMAIL_NSMAP,
+                    EMAIL_XPATH,
+                    XML_EARLY_EXIT,
+                    XML_WORKERS)
+
+    if xml_workers is None:
+        xml_workers = XML_WORKERS
+
+    if cnxn is not None:
+        batches = db.fetch_batches(cnxn, get_source(), time_start, time_end,
+                                   end_inclusive, DB_ARRAYSIZE)
+    else:
+        if pool is None:
+            pool = get_pool()
+        if parts is None:
+            parts = DB_SPLIT_PARTS
+        batches = db.iter_batches_split(pool, time_start, time_end,
+                                        end_inclusive, parts, DB_ARRAYSIZE)
+    num_rows = [0]
+    batches = _timed_batches(batches, num_rows)
+
+    num_failed = [0]
+
+    def parsed(parse_seconds, batch_failed):
+        XML_PARSE_SECONDS.observe(parse_seconds)
+        if batch_failed:
+            logger.info('Extract | skipped {_n} rows with malformed XML'
+                        .format(_n=batch_failed))
+            XML_PARSE_FAILURES.inc(batch_failed)
+            num_failed[0] += batch_failed
+
+    if xml_workers:
+        # pipeline: keep fetching batches while a process pool parses the
+        #   XML of earlier batches
+        num_emails = 0
+        for e in extract.parallel_extract(batches, EMAIL_XPATH, EMAIL_NSMAP,
+                                          early_exit=XML_EARLY_EXIT,
+                                          workers=xml_workers, ordered=True,
+                                          pool=get_xml_pool(xml_workers),
+                                          on_batch=parsed):
+            num_emails += 1
+            yield Email._make(e)
+        # the workers only return the rows an email was found in
+        XML_EMAIL_MISSING.inc(num_rows[0] - num_failed[0] - num_emails)
+        return
+
+    # xpath is compiled and the parser is created once for all rows
+    extract_email = extract.make_email_extractor(EMAIL_XPATH, EMAIL_NSMAP,
+                                                 early_exit=XML_EARLY_EXIT)
+
+    for rows in batches:
+        start = time.perf_counter()
+        found, batch_failed = extract.extract_rows(extract_email, rows)
+        parsed(time.perf_counter() - start, batch_failed)
+        XML_EMAIL_MISSING.inc(len(rows) - batch_failed - len(found))
+        for e in found:
+            yield Email._make(e)
+
+
 def get_emails(time_start, time_end):
     """ Query a SQL server database to get a list of email addresses
 
@@ -49,59 +281,25 @@ def get_emails(time_start, time_end):
 
     Returns
     -------
-    email_addresses : list of tuples (id, dt, email)
+    email_addresses : a records.EmailTable of rows (id, dt, email)
     """
-    # Microsoft SQL Server syntax
-    sql_string = '''
-    select  dt
-           ,id
-           ,XML
-    from schema.dbtable (nolock)
-    where dt between '{_time_start}' and '{_time_end}'
-    '''.format(_time_start=time_start, _time_end=time_end)
-
-    # get password for SQL connection
-    my_pw = utils.get_api_key('mypw')
-
-    # establish connection
-    # 'server' must match the bracketed entry name within /etc/freetds.conf
-    cnxn = pymssql.connect(server='myservername:1433',
-                           database='mydatabase',
-                           user='DOMAIN\username',
-                           password=my_pw)
-
-    crsr = cnxn.cursor(as_dict=True)  # get a cursor
-    crsr.execute(sql_string)  # execute the SQL
-
-    Email = namedtuple('Email', ['id', 'dt', 'email'])
-    email_addresses = set()  # want a set in order to remove duplicates 
-    for row in db_row_iter(crsr):
-        # setup xpath and namespace
-            nsmap = {'ns0': 'http://custom-ns0',
-                     'ns1': 'http://custom-ns1',
-                     'ns2': 'http://custom-ns2'}
-            email_xpath = '/ns0:some/ns1:long/ns2:xpath/ns2:email/text()'
-        else:
-            break
+    # remove duplicates as the rows stream in, the first is kept
+    num_emails = [0]
+    email_addresses = records.EmailTable(
+        dedupe.unique(dedupe.counted(iter_emails(time_start, time_end),
+                                     num_emails),
+                      Email._fields))
+    EMAILS_DEDUPED.labels(stage='extract').inc(
+        num_emails[0] - len(email_addresses))
 
-        tree = et.fromstring(row['XML'])
-        try:
-            # email is a list, so extract the string from the first element
-            email = tree.xpath(email_xpath, namespaces=nsmap)[0]  # execute xpath query
-            id_val = row['id']
-            dt = row['dt'].strftime('%Y-%m-%d %H:%M:%S')
-            e = Email(id_val, dt, str(email))
-            email_addresses.add(e)
-        except IndexError:
-            pass
+    return email_addresses
 
-    return list(email_addresses)
 
-
-def get_unique_emails(time_start, time_end):
+def get_unique_emails(time_start, time_end, ordered=False):
     """ Get a unique list of email addresses
 
-    Uniqueness is determined by the combination of id and email
+    Uniqueness is determined by the combination of id and email.  The
+    earliest dt is kept for each id and email.
 
     Parameters
     ----------
@@ -111,21 +309,45 @@ def get_unique_emails(time_start, time_end):
     time_end : end time for querying email addresses
         passed on and used as part of where clause when executing SQL
 
+    ordered : if True, sort the output by id and email
+
+    Notes
+    -----
+    When PARTITION_CACHE is set the range is half open, see
+    fc.partitions.iter_emails_cached
+
     Returns
     -------
-    email_unique : list of tuples (id, dt, email) without dupes
-        based on id and email
+    email_unique : a records.EmailTable of rows (id, dt, email) without
+        dupes based on id and email
     """
-    emails_dups = get_emails(time_start, time_end)
+    # import global
+    from fc import (EMAIL_NSMAP,
+                    EMAIL_XPATH,
+                    PARTITION_CACHE,
+                    PARTITION_DIR,
+                    PARTITION_GRACE)
 
-    # sort before passing off to unique_namedtuples
-    #   that way the ids with the later datetimes are removed
-    #   and the ids with the earliest datetime is preserved
-    emails_dups = sorted(emails_dups,
-                         key=attrgetter('id', 'email', 'dt'))
+    if PARTITION_CACHE:
+        # complete hours are read from local partition files and only
+        #   the missing hours are queried
+        emails_iter = partitions.iter_emails_cached(
+            time_start, time_end, PARTITION_DIR,
+            lambda hr_start, hr_end: iter_emails(hr_start, hr_end,
+                                                 end_inclusive=False),
+            grace=PARTITION_GRACE,
+            key=partitions.settings_key(EMAIL_XPATH, EMAIL_NSMAP))
+    else:
+        emails_iter = iter_emails(time_start, time_end)
 
-    # only want unique email addresses
-    emails_unique = utils.unique_namedtuples(emails_dups,
-                                             ('id', 'email'))
+    # single pass aggregation over the stream of rows
+    #   the full result is never materialized or sorted
+    num_emails = [0]
+    emails_unique = dedupe.earliest_per_key(
+        dedupe.counted(emails_iter, num_emails), ('id', 'email'), 'dt',
+        ordered=ordered)
 
+    emails_unique = records.EmailTable(emails_unique)
+    EMAILS_DEDUPED.labels(stage='extract').inc(
+        num_emails[0] - len(emails_unique))
     return emails_unique
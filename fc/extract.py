@@ -0,0 +1,339 @@
+# standard lib
+from collections import deque
+from concurrent.futures import (FIRST_COMPLETED,
+                                ProcessPoolExecutor,
+                                as_completed,
+                                wait)
+import multiprocessing
+import os
+import re
+import time
+
+# third party
+from lxml import etree as et
+
+# a single location step such as ns2:email
+STEP_RE = re.compile(r'^(?:(?P<prefix>[A-Za-z_][\w.-]*):)?'
+                     r'(?P<name>[A-Za-z_][\w.-]*)$')
+
+def make_parser():
+    """ Create an XML parser configured for speed
+
+    The parser never touches the network, does not resolve entities and
+    does not collect ids, none of which are needed to pull a single text
+    node out of a document.
+
+    Returns
+    -------
+    parser : an lxml XMLParser
+        a parser may be reused across documents but not across threads
+    """
+    return et.XMLParser(resolve_entities=False,
+                        no_network=True,
+                        collect_ids=False,
+                        huge_tree=False)
+
+
+def xpath_steps(email_xpath, nsmap):
+    """ Convert a simple absolute xpath into a list of qualified tag names
+
+    For instance '/ns0:some/ns2:email/text()' with nsmap
+    {'ns0': 'http://custom-ns0', 'ns2': 'http://custom-ns2'} becomes
+    ['{http://custom-ns0}some', '{http://custom-ns2}email']
+
+    Parameters
+    ----------
+    email_xpath : an absolute xpath made up of element steps and
+        optionally ending with text()
+
+    nsmap : dict mapping namespace prefixes to namespace uris
+
+    Returns
+    -------
+    steps : list of tag names in Clark notation from the root down
+    """
+    path = email_xpath
+    if path.endswith('/text()'):
+        path = path[:-len('/text()')]
+    if not path.startswith('/') or path.startswith('//'):
+        raise ValueError('early exit requires an absolute xpath'
+                         ' such as /ns0:a/ns1:b/text()')
+
+    steps = []
+    for step in path[1:].split('/'):
+        m = STEP_RE.match(step)
+        if m is None:
+            raise ValueError('unsupported xpath step for early exit: {}'
+                             .format(step))
+        if m.group('prefix') is None:
+            steps.append(m.group('name'))
+        else:
+            steps.append('{{{}}}{}'.format(nsmap[m.group('prefix')],
+                                           m.group('name')))
+    return steps
+
+
+def make_email_extractor(email_xpath, nsmap, early_exit=False,
+                         chunk_size=1024):
+    """ Build a function that extracts the email address from an XML payload
+
+    The xpath is compiled once with etree.XPath and a parser from
+    make_parser is reused, so nothing is recompiled per row.
+
+    With early_exit the document is instead fed to a pull parser in chunks
+    and parsing stops as soon as the first element matching the xpath has
+    been closed.  The remainder of the payload is never parsed, which helps
+    when the email is near the top of a large document.  A pull parser that
+    stopped early cannot be reused, so one is created per document and no
+    other parser is built.  Only simple absolute xpaths are supported in
+    this mode.
+
+    Parameters
+    ----------
+    email_xpath : xpath to the email address text
+
+    nsmap : dict mapping namespace prefixes used in email_xpath to uris
+
+    early_exit : if True, stop parsing once the email node is found
+
+    chunk_size : number of bytes fed to the pull parser at a time
+        only used with early_exit
+
+    Returns
+    -------
+    extract : function taking an XML string or bytes and returning the email
+        as a str, or None if the xpath does not match
+        the function is not thread safe as the parser is shared
+    """
+    if not early_exit:
+        parser = make_parser()
+        find_email = et.XPath(email_xpath, namespaces=nsmap,
+                              smart_strings=False)
+
+        def extract(xml):
+            tree = et.fromstring(xml, parser)
+            # email is a list, so extract the string from the first element
+            emails = find_email(tree)
+            if not emails:
+                return None
+            return str(emails[0])
+
+        return extract
+
+    steps = xpath_steps(email_xpath, nsmap)
+    email_tag = steps[-1]
+    ancestors = steps[-2::-1]  # parent first, root last
+
+    def extract(xml):
+        if isinstance(xml, str):
+            xml = xml.encode('utf-8')
+        pull_parser = et.XMLPullParser(events=('end',), tag=email_tag,
+                                       resolve_entities=False,
+                                       no_network=True, collect_ids=False)
+        # feed the document a chunk at a time and stop as soon as the
+        #   email node has been closed
+        for i in range(0, len(xml), chunk_size):
+            pull_parser.feed(xml[i:i + chunk_size])
+            for _, elem in pull_parser.read_events():
+                parent = elem.getparent()
+                for tag in ancestors:
+                    if parent is None or parent.tag != tag:
+                        break
+                    parent = parent.getparent()
+                else:
+                    # the full path matched, the root has no parent and
+                    #   like text() an empty element is skipped
+                    if parent is None and elem.text is not None:
+                        return elem.text
+        return None
+
+    return extract
+
+
+# extractor used by each worker process, set by init_worker
+_worker_extract = None
+
+def init_worker(email_xpath, nsmap, early_exit=False):
+    """ Build the email extractor once within a worker process
+
+    Parameters
+    ----------
+    email_xpath : xpath to the email address text
+
+    nsmap : dict mapping namespace prefixes used in email_xpath to uris
+
+    early_exit : if True, stop parsing once the email node is found
+
+    Returns
+    -------
+    null
+    """
+    global _worker_extract
+    _worker_extract = make_email_extractor(email_xpath, nsmap,
+                                           early_exit=early_exit)
+
+
+def extract_rows(extract_email, rows):
+    """ Extract email addresses from a batch of rows
+
+    A row whose XML cannot be parsed is skipped rather than failing the
+    batch.
+
+    Parameters
+    ----------
+    extract_email : function from make_email_extractor
+
+    rows : list of tuples (id, dt, xml)
+
+    Returns
+    -------
+    results : list of tuples (id, dt, email) for rows where the xpath matched
+
+    num_failed : number of rows whose XML could not be parsed
+    """
+    results = []
+    num_failed = 0
+    for id_val, dt, xml in rows:
+        try:
+            email = extract_email(xml)
+        except et.XMLSyntaxError:
+            num_failed += 1
+            continue
+        if email is not None:
+            results.append((id_val, dt, email))
+    return results, num_failed
+
+
+def extract_batch(rows):
+    """ Extract email addresses from a batch of rows within a worker process
+
+    Parameters
+    ----------
+    rows : list of tuples (id, dt, xml)
+
+    Returns
+    -------
+    results : list of tuples (id, dt, email) for rows where the xpath matched
+
+    parse_seconds : seconds spent parsing the batch
+
+    num_failed : number of rows whose XML could not be parsed
+    """
+    start = time.perf_counter()
+    results, num_failed = extract_rows(_worker_extract, rows)
+    return results, time.perf_counter() - start, num_failed
+
+
+def make_pool(email_xpath, nsmap, early_exit=False, workers=None):
+    """ Start a process pool of XML extraction workers
+
+    Workers are started from a fork server (or spawned where there is no
+    fork server) rather than forked, as the process already runs the
+    threads fetching from the database by the time the pool is started and
+    forking a process with threads can leave locks held in the children.
+
+    Parameters
+    ----------
+    email_xpath : xpath to the email address text
+
+    nsmap : dict mapping namespace prefixes used in email_xpath to uris
+
+    early_exit : if True, stop parsing once the email node is found
+
+    workers : number of worker processes, defaults to the number of cpus
+
+    Returns
+    -------
+    pool : a ProcessPoolExecutor, to be passed to parallel_extract
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+    else:
+        context = multiprocessing.get_context('spawn')
+    return ProcessPoolExecutor(max_workers=workers,
+                               mp_context=context,
+                               initializer=init_worker,
+                               initargs=(email_xpath, nsmap, early_exit))
+
+
+def parallel_extract(batches, email_xpath, nsmap, early_exit=False,
+                     workers=None, ordered=False, pool=None, on_batch=None):
+    """ Fan batches of XML rows out to a process pool for extraction
+
+    Batches are pulled from the iterable while earlier batches are being
+    parsed, so fetching from the database overlaps with parsing.  At most
+    twice as many batches as workers are in flight, which bounds memory.
+    Unless ordered is set, results are yielded as each batch completes and
+    so are not in the order of the input.
+
+    Parameters
+    ----------
+    batches : iterable of lists of tuples (id, dt, xml)
+
+    email_xpath : xpath to the email address text
+
+    nsmap : dict mapping namespace prefixes used in email_xpath to uris
+
+    early_exit : if True, stop parsing once the email node is found
+
+    workers : number of worker processes, defaults to the number of cpus
+
+    ordered : if True, yield results in the order of the input batches
+
+    pool : a pool from make_pool with the same xpath, namespaces and
+        workers to reuse across calls, otherwise a pool is started and
+        shut down within the call
+
+    on_batch : function called in this process with the parse seconds and
+        the number of rows whose XML could not be parsed for each batch,
+        as the workers cannot update the metrics of this process
+
+    Returns
+    -------
+    result : yields tuples (id, dt, email)
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    own_pool = pool is None
+    if own_pool:
+        pool = make_pool(email_xpath, nsmap, early_exit, workers)
+    try:
+        yield from _extract_in_pool(pool, batches, 2 * workers, ordered,
+                                    on_batch)
+    finally:
+        if own_pool:
+            pool.shutdown()
+
+
+def _batch_results(future, on_batch):
+    results, parse_seconds, num_failed = future.result()
+    if on_batch is not None:
+        on_batch(parse_seconds, num_failed)
+    return results
+
+
+def _extract_in_pool(pool, batches, max_in_flight, ordered, on_batch):
+    if ordered:
+        in_flight = deque()
+        for batch in batches:
+            in_flight.append(pool.submit(extract_batch, batch))
+            if len(in_flight) >= max_in_flight:
+                yield from _batch_results(in_flight.popleft(), on_batch)
+        while in_flight:
+            yield from _batch_results(in_flight.popleft(), on_batch)
+        return
+
+    in_flight = set()
+    for batch in batches:
+        in_flight.add(pool.submit(extract_batch, batch))
+        if len(in_flight) < max_in_flight:
+            continue
+        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield from _batch_results(future, on_batch)
+
+    for future in as_completed(in_flight):
+        yield from _batch_results(future, on_batch)
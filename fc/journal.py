@@ -0,0 +1,166 @@
+# standard library
+import json
+import logging
+import os
+import threading
+
+# local modules
+import fc.retry as retry
+
+logger = logging.getLogger()
+
+class Journal(object):
+    """ Write-ahead journal of lookup queue events
+
+    Every change to the lookup queue is appended as one line of JSON before
+    it takes effect, so the queue can be rebuilt after a crash:
+
+        enqueued : an email was put on the queue for the first time
+        requeued : an email was put back on the queue, such as after a 202
+        submitted : an email was handed to a worker
+        completed : the final response for an email was written
+
+    Each event is keyed by the count from the original placement in the
+    queue.  Replaying the events leaves every email that has not completed,
+    with its latest execute time and attempt history.  An email that was
+    submitted but never completed is treated as pending.
+
+    The live state is kept in memory so that every compact_every events the
+    journal is rewritten with just an enqueued event per pending email.
+
+    Parameters
+    ----------
+    path : full path to the journal file
+
+    compact_every : rewrite the journal after this many appended events
+
+    fsync : if True, fsync after every event
+    """
+    def __init__(self, path, compact_every=10000, fsync=False):
+        self.path = path
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        self.pending = replay(path)
+        self.num_events = 0
+        self.f = None
+        # start from the replayed state, so that a partially written last
+        #   line left by a crash is not glued to the next event
+        self._compact()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _append(self, event):
+        self.f.write(json.dumps(event, separators=(',', ':')))
+        self.f.write('\n')
+        self.f.flush()
+        if self.fsync:
+            os.fsync(self.f.fileno())
+        self.num_events += 1
+        if self.num_events >= self.compact_every:
+            self._compact()
+
+    def put(self, item):
+        """ Record an item being put on the queue
+
+        Parameters
+        ----------
+        item : queue tuple (execute_time, count, id, dt, email, attempts)
+
+        Returns
+        -------
+        null
+        """
+        execute_time, count, id_val, dt, email, attempts = item
+        with self.lock:
+            event = 'requeued' if count in self.pending else 'enqueued'
+            self.pending[count] = item
+            self._append({'e': event, 'c': count, 't': execute_time,
+                          'id': id_val, 'dt': dt, 'email': email,
+                          'a': [list(a) for a in attempts]})
+
+    def submitted(self, count):
+        """ Record an item being handed to a worker """
+        with self.lock:
+            self._append({'e': 'submitted', 'c': count})
+
+    def completed(self, count, status_code=None):
+        """ Record a final response for an item """
+        with self.lock:
+            self.pending.pop(count, None)
+            self._append({'e': 'completed', 'c': count, 's': status_code})
+
+    def _compact(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for execute_time, count, id_val, dt, email, attempts in \
+                    self.pending.values():
+                f.write(json.dumps({'e': 'enqueued', 'c': count,
+                                    't': execute_time, 'id': id_val,
+                                    'dt': dt, 'email': email,
+                                    'a': [list(a) for a in attempts]},
+                                   separators=(',', ':')))
+                f.write('\n')
+            f.flush()
+            os.fsync(f.fileno())
+        if self.f is not None:
+            self.f.close()
+        os.replace(tmp_path, self.path)
+        self.f = open(self.path, 'a')
+        self.num_events = 0
+
+    def compact(self):
+        """ Rewrite the journal with only the pending items """
+        with self.lock:
+            self._compact()
+
+    def reset(self):
+        """ Discard every event, starting an empty journal """
+        with self.lock:
+            self.pending = {}
+            self._compact()
+
+    def close(self):
+        """ Compact and close the journal """
+        with self.lock:
+            self._compact()
+            self.f.close()
+
+
+def replay(path):
+    """ Rebuild the pending queue items from a journal file
+
+    A partially written last line, as left by a crash, is ignored.
+
+    Parameters
+    ----------
+    path : full path to the journal file
+
+    Returns
+    -------
+    pending : dict mapping count to the queue tuple
+        (execute_time, count, id, dt, email, attempts)
+    """
+    pending = {}
+    if not os.path.isfile(path):
+        return pending
+
+    with open(path) as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                logger.info('Journal | skipping a partially written event')
+                continue
+            count = event['c']
+            if event['e'] in ('enqueued', 'requeued'):
+                attempts = tuple(retry.Attempt(*a) for a in event['a'])
+                pending[count] = (event['t'], count, event['id'],
+                                  event['dt'], event['email'], attempts)
+            elif event['e'] == 'completed':
+                pending.pop(count, None)
+    return pending
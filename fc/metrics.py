@@ -0,0 +1,428 @@
+# standard library
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import bisect
+import contextlib
+import logging
+import math
+import os
+import threading
+import time
+
+logger = logging.getLogger()
+
+# seconds, from a fast sqlite probe up to a slow API call
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value)
+
+
+def _escape(value):
+    return (str(value).replace('\\', r'\\').replace('\n', r'\n')
+            .replace('"', r'\"'))
+
+
+def _label_string(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value))
+                          for name, value in pairs) + '}'
+
+
+class _Metric(object):
+    """ Base of Counter, Gauge and Histogram
+
+    A metric without labelnames records values directly.  With labelnames,
+    labels returns the child that records values for one combination of
+    label values, such as lookups by status code.
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.children = {}
+        if not self.labelnames:
+            self.children[()] = self._new_child()
+
+    def labels(self, *labelvalues, **labelkwargs):
+        """ Return the child for one combination of label values
+
+        Label values are given in the order of labelnames or by name.
+        """
+        if labelkwargs:
+            labelvalues = tuple(labelkwargs[name] for name in self.labelnames)
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError('{} expects labels {}'
+                             .format(self.name, self.labelnames))
+        labelvalues = tuple(str(value) for value in labelvalues)
+        child = self.children.get(labelvalues)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(labelvalues,
+                                                 self._new_child())
+        return child
+
+    def _unlabelled(self):
+        if self.labelnames:
+            raise ValueError('{} has labels, use labels() first'
+                             .format(self.name))
+        return self.children[()]
+
+    def samples(self):
+        """ Return (suffix, label string, value) for every sample """
+        raise NotImplementedError
+
+    def clear(self):
+        """ Reset every value """
+        with self.lock:
+            self.children = {}
+            if not self.labelnames:
+                self.children[()] = self._new_child()
+
+
+class _CounterChild(object):
+    __slots__ = ('lock', 'value')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount=1.0):
+        if amount < 0:
+            raise ValueError('counters only go up')
+        with self.lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    """ A total that only goes up, such as the number of rows fetched
+
+    Parameters
+    ----------
+    name : metric name, by convention ending in _total
+
+    documentation : one line description
+
+    labelnames : names of the labels values are recorded by
+    """
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1.0):
+        self._unlabelled().inc(amount)
+
+    @property
+    def value(self):
+        return self._unlabelled().value
+
+    def samples(self):
+        return [('', _label_string(self.labelnames, labelvalues), child.value)
+                for labelvalues, child in sorted(self.children.items())]
+
+
+class _GaugeChild(object):
+    __slots__ = ('lock', 'value', 'function')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0.0
+        self.function = None
+
+    def set(self, value):
+        with self.lock:
+            self.value = float(value)
+
+    def inc(self, amount=1.0):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1.0):
+        with self.lock:
+            self.value -= amount
+
+    def set_function(self, function):
+        self.function = function
+
+    def get(self):
+        if self.function is not None:
+            return float(self.function())
+        return self.value
+
+
+class Gauge(_Metric):
+    """ A value that goes up and down, such as the queue depth
+
+    Either set as things change or read when the metrics are exposed from
+    a function given to set_function.
+
+    Parameters
+    ----------
+    name : metric name
+
+    documentation : one line description
+
+    labelnames : names of the labels values are recorded by
+    """
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._unlabelled().set(value)
+
+    def inc(self, amount=1.0):
+        self._unlabelled().inc(amount)
+
+    def dec(self, amount=1.0):
+        self._unlabelled().dec(amount)
+
+    def set_function(self, function):
+        """ Read the value from function() whenever it is exposed """
+        self._unlabelled().set_function(function)
+
+    @property
+    def value(self):
+        return self._unlabelled().get()
+
+    def samples(self):
+        samples = []
+        for labelvalues, child in sorted(self.children.items()):
+            try:
+                value = child.get()
+            except Exception:
+                logger.exception('Metrics | could not read {_name}'
+                                 .format(_name=self.name))
+                continue
+            samples.append(('', _label_string(self.labelnames, labelvalues),
+                            value))
+        return samples
+
+
+class _HistogramChild(object):
+    __slots__ = ('lock', 'upper_bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, upper_bounds):
+        self.lock = threading.Lock()
+        self.upper_bounds = upper_bounds
+        self.counts = [0] * len(upper_bounds)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.upper_bounds, value)
+        with self.lock:
+            if i < len(self.counts):
+                self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextlib.contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    """ Distribution of observed values, such as HTTP latency in seconds
+
+    Each observation is counted in the first bucket whose upper bound it
+    does not exceed.  Buckets are exposed cumulatively as Prometheus
+    expects, along with the sum and count of all observations.
+
+    Parameters
+    ----------
+    name : metric name, by convention ending in the unit such as _seconds
+
+    documentation : one line description
+
+    labelnames : names of the labels values are recorded by
+
+    buckets : increasing upper bounds of the buckets
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        self.upper_bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.upper_bounds)
+
+    def observe(self, value):
+        self._unlabelled().observe(value)
+
+    def time(self):
+        """ Context manager observing the seconds its block takes """
+        return self._unlabelled().time()
+
+    def samples(self):
+        samples = []
+        for labelvalues, child in sorted(self.children.items()):
+            with child.lock:
+                counts = list(child.counts)
+                total, count = child.sum, child.count
+            cumulative = 0
+            for upper_bound, n in zip(self.upper_bounds, counts):
+                cumulative += n
+                samples.append(('_bucket', _label_string(
+                    self.labelnames, labelvalues,
+                    [('le', _format_value(float(upper_bound)))]), cumulative))
+            samples.append(('_bucket', _label_string(
+                self.labelnames, labelvalues, [('le', '+Inf')]), count))
+            labels = _label_string(self.labelnames, labelvalues)
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, count))
+        return samples
+
+
+class Registry(object):
+    """ Every metric of the process, by name
+
+    Registering a name again returns the existing metric, so modules can
+    declare their metrics at import time.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def register(self, metric):
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric):
+                    raise ValueError('{} is already registered as a {}'
+                                     .format(metric.name, existing.kind))
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(),
+                  buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames,
+                                       buckets))
+
+    def clear(self):
+        """ Reset every metric, keeping the registrations """
+        for metric in list(self.metrics.values()):
+            metric.clear()
+
+    def exposition(self):
+        """ Render every metric in the Prometheus text format
+
+        Returns
+        -------
+        text : str
+        """
+        lines = []
+        for name in sorted(self.metrics):
+            metric = self.metrics[name]
+            lines.append('# HELP {} {}'.format(
+                name, metric.documentation.replace('\\', r'\\')
+                .replace('\n', r'\n')))
+            lines.append('# TYPE {} {}'.format(name, metric.kind))
+            for suffix, labels, value in metric.samples():
+                lines.append('{}{}{} {}'.format(name, suffix, labels,
+                                                _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """ Write the exposition to a file, such as for the node exporter
+        textfile collector
+
+        The file is replaced atomically so a scrape never sees half of it.
+
+        Parameters
+        ----------
+        path : full path to the .prom file
+
+        Returns
+        -------
+        null
+        """
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.exposition())
+        os.replace(tmp_path, path)
+
+    def serve(self, port, host='127.0.0.1'):
+        """ Serve the exposition over HTTP from a background thread
+
+        Parameters
+        ----------
+        port : port to listen on, 0 picks a free port
+
+        host : address to listen on, local only by default
+
+        Returns
+        -------
+        server : the http.server, call shutdown() to stop it
+            server.server_address holds the address actually bound
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.exposition().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name='fc-metrics',
+                         daemon=True).start()
+        logger.info('Metrics | serving on http://{_host}:{_port}/metrics'
+                    .format(_host=server.server_address[0],
+                            _port=server.server_address[1]))
+        return server
+
+
+# the registry every module records to
+REGISTRY = Registry()
+
+def counter(name, documentation, labelnames=()):
+    """ Register a Counter with the process registry """
+    return REGISTRY.counter(name, documentation, labelnames)
+
+
+def gauge(name, documentation, labelnames=()):
+    """ Register a Gauge with the process registry """
+    return REGISTRY.gauge(name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    """ Register a Histogram with the process registry """
+    return REGISTRY.histogram(name, documentation, labelnames, buckets)
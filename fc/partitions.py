@@ -0,0 +1,254 @@
+# standard lib
+import datetime
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+# local modules
+import fc.records as records
+import fc.utils as utils
+
+logger = logging.getLogger()
+
+ONE_HOUR = datetime.timedelta(hours=1)
+
+def settings_key(email_xpath, nsmap):
+    """ Return a short key for the extraction settings of a partition
+
+    Partitions extracted with another xpath or namespaces hold other
+    emails, so the key is part of the partition path.
+
+    Parameters
+    ----------
+    email_xpath : xpath to the email address text
+
+    nsmap : dict mapping namespace prefixes used in email_xpath to uris
+
+    Returns
+    -------
+    key : 8 hex digits
+    """
+    settings = json.dumps([email_xpath, sorted(nsmap.items())])
+    return hashlib.sha1(settings.encode('utf-8')).hexdigest()[:8]
+
+
+def partition_path(partition_dir, hour, key=None):
+    """ Return the path of the partition file for an hour
+
+    Parameters
+    ----------
+    partition_dir : directory containing the partition files
+
+    hour : a datetime at the start of the hour
+
+    key : extraction settings key from settings_key, if any
+
+    Returns
+    -------
+    path : full path such as partition_dir/2016-06-03/19.ndjson.gz
+        or partition_dir/2016-06-03/19.<key>.ndjson.gz
+    """
+    name = hour.strftime('%H')
+    if key is not None:
+        name += '.' + key
+    return os.path.join(partition_dir,
+                        hour.strftime('%Y-%m-%d'),
+                        name + '.ndjson.gz')
+
+
+def read_partition(path):
+    """ Read the Email named tuples stored in a partition file
+
+    Parameters
+    ----------
+    path : full path to the partition file
+
+    Returns
+    -------
+    email : yields one Email named tuple at a time
+    """
+    with gzip.open(path, 'rt') as f:
+        for line in f:
+            yield records.Email(*json.loads(line))
+
+
+def write_partition(path, emails):
+    """ Write Email named tuples to a partition file
+
+    The file is written to a temporary name unique to this writer and then
+    renamed so that a partially written partition is never read back, even
+    with a cron run and the daemon writing the same hour.
+
+    Parameters
+    ----------
+    path : full path to the partition file
+
+    emails : iterable of Email named tuples
+
+    Returns
+    -------
+    emails : a records.EmailTable of the rows that were written
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    emails = records.EmailTable(emails)
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.',
+                                    suffix='.tmp',
+                                    dir=os.path.dirname(path))
+    try:
+        # each row is a compact json array [id, dt, email]
+        with open(fd, 'wb') as raw, \
+                gzip.open(raw, 'wt', compresslevel=1) as f:
+            for e in emails:
+                f.write(json.dumps(tuple(e), separators=(',', ':')))
+                f.write('\n')
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return emails
+
+
+def expire_partitions(partition_dir, time_start):
+    """ Delete the partitions of every day before time_start
+
+    Parameters
+    ----------
+    partition_dir : directory containing the partition files
+
+    time_start : a datetime, days before its date are deleted
+
+    Returns
+    -------
+    days : list of the day directories that were deleted
+    """
+    if not os.path.isdir(partition_dir):
+        return []
+    oldest = time_start.strftime('%Y-%m-%d')
+    days = []
+    for name in sorted(os.listdir(partition_dir)):
+        try:
+            datetime.datetime.strptime(name, '%Y-%m-%d')
+        except ValueError:
+            # not a day directory
+            continue
+        if name < oldest:
+            shutil.rmtree(os.path.join(partition_dir, name))
+            days.append(name)
+    if days:
+        logger.info('Partition | deleted {_n} days before {_oldest}'
+                    .format(_n=len(days), _oldest=oldest))
+    return days
+
+
+def delete_partitions(partition_dir, time_start, time_end):
+    """ Delete the partitions of every hour that overlaps
+    [time_start, time_end), whatever their extraction settings
+
+    Parameters
+    ----------
+    partition_dir : directory containing the partition files
+
+    time_start : a datetime
+
+    time_end : a datetime
+
+    Returns
+    -------
+    num_deleted : number of partition files deleted
+    """
+    num_deleted = 0
+    for hour in iter_hours(time_start, time_end):
+        pattern = os.path.join(partition_dir, hour.strftime('%Y-%m-%d'),
+                               hour.strftime('%H.*ndjson.gz'))
+        for path in glob.glob(pattern):
+            os.remove(path)
+            num_deleted += 1
+    if num_deleted:
+        logger.info('Partition | deleted {_n} hours from {_start} to {_end}'
+                    .format(_n=num_deleted, _start=time_start,
+                            _end=time_end))
+    return num_deleted
+
+
+def iter_hours(time_start, time_end):
+    """ Return the start of every hour that overlaps [time_start, time_end)
+
+    Parameters
+    ----------
+    time_start : a datetime
+
+    time_end : a datetime
+
+    Returns
+    -------
+    hour : yields a datetime at the start of each hour
+    """
+    hour = utils.hour_floor(time_start)
+    while hour < time_end:
+        yield hour
+        hour += ONE_HOUR
+
+
+def iter_emails_cached(time_start, time_end, partition_dir, fetch,
+                       now=None, grace=0.0, key=None):
+    """ Stream email addresses, extracting each hour from the database once
+
+    Every complete hour within the range is stored locally as a partition
+    file.  Hours that already have a partition are read from disk and only
+    the missing hours are queried.  The current (incomplete) hour, and an
+    hour that ended less than grace seconds ago and so may still have rows
+    committed late, is always queried and never cached.
+
+    Unlike the SQL between clause the range is half open, so rows at exactly
+    time_end are left for the next range.
+
+    Parameters
+    ----------
+    time_start : start datetime for querying email addresses
+
+    time_end : end datetime for querying email addresses
+
+    partition_dir : directory containing the partition files
+
+    fetch : function taking (hour_start, hour_end) that returns an iterable
+        of Email named tuples with hour_start <= dt < hour_end
+
+    now : the current datetime, defaults to datetime.datetime.now()
+
+    grace : seconds after the end of an hour before it is cached
+
+    key : extraction settings key from settings_key, if any
+
+    Returns
+    -------
+    email : yields one Email named tuple (id, dt, email) at a time
+    """
+    if now is None:
+        now = datetime.datetime.now()
+    # hours ending before this are complete
+    cutoff = now - datetime.timedelta(seconds=grace)
+
+    dt_start = time_start.strftime('%Y-%m-%d %H:%M:%S')
+    dt_end = time_end.strftime('%Y-%m-%d %H:%M:%S')
+
+    for hour in iter_hours(time_start, time_end):
+        path = partition_path(partition_dir, hour, key)
+        if os.path.isfile(path):
+            rows = read_partition(path)
+        elif hour + ONE_HOUR <= cutoff:
+            logger.info('Partition | extract {_hour} from the database'
+                        .format(_hour=hour))
+            rows = write_partition(path, fetch(hour, hour + ONE_HOUR))
+        else:
+            rows = fetch(hour, hour + ONE_HOUR)
+
+        # only the first and last hours can be partially within the range
+        if hour < time_start or hour + ONE_HOUR > time_end:
+            rows = (e for e in rows if dt_start <= e.dt < dt_end)
+
+        yield from rows
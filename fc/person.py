@@ -1,14 +1,26 @@
 # standard library
-from os.path import join
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import datetime
+import json
 import logging
+import threading
 import time
 
 # third party
 import requests
+import requests.adapters
+import urllib3
 
 # local modules
+import fc.cache as cache
+import fc.metrics as metrics
+import fc.retry as retry
+import fc.scheduler as scheduler
+import fc.store as store
+import fc.trace as trace
 import fc.utils as utils
+import fc.writer as writer
 
 
 logger = logging.getLogger()
@@ -16,7 +28,16 @@ logger = logging.getLogger()
 # WARNING level and worse for requests
 logging.getLogger('requests').setLevel(logging.WARNING)
 
-def process_one_email(q, count, id_val, dt, email):
+LOOKUPS = metrics.counter(
+    'fc_lookups_total',
+    'Person API lookups by status code, cached for cache hits and error'
+    ' for requests that failed without a response', ['status'])
+HTTP_SECONDS = metrics.histogram(
+    'fc_http_seconds', 'Seconds until a Person API response was read')
+IN_FLIGHT = metrics.gauge(
+    'fc_requests_in_flight', 'Person API requests waiting on a response')
+
+def process_one_email(q, count, id_val, dt, email, attempts=(), client=None):
     """ Submit an email address to the Full Contact Person API and process
     the responses
 
@@ -24,7 +45,7 @@ def process_one_email(q, count, id_val, dt, email):
 
     Parameters
     ----------
-    q : an instance of a Priority Queue
+    q : an instance of scheduler.TimerQueue
 
     count : the count from the original placement in the queue
 
@@ -34,22 +55,136 @@ def process_one_email(q, count, id_val, dt, email):
 
     email : email address
 
+    attempts : tuple of retry.Attempt for earlier responses for this email
+
+    client : a PersonClient, defaults to a client shared by the process
+
     Returns
     -------
     null
     """
-    # import global
-    from fc import (OUT_DIR,
-                    RETRY_TIME)
-
     dt = dt.split()[0]
 
+    # a cached response is written without calling the API
+    # a retry (such as a 202 poll) was a miss when it was first submitted
+    if not attempts and check_cache(count, id_val, dt, email):
+        # the token taken for this lookup was not used
+        if client is not None and client.limiter is not None:
+            client.limiter.release()
+        complete(q, count)
+        return
+
     logger.info(('Post | email: {_email}  id: {_id}'
                  ' | {_email} posted to the Full Contact Person API')
             .format(_email=email, _id=id_val))
     # blocking operation - not to worry as each request is
     # its own thread
-    r = query_person('email', email)
+    try:
+        with trace.timed(count, 'http', len(attempts)):
+            r = query_person('email', email, client)
+    except requests.RequestException as e:
+        # a timeout or reset connection, the client has already counted
+        #   it and handed back its rate limit token
+        logger.info(('Error | email: {_email}  id: {_id}'
+                     ' | request failed: {_err!r}')
+                .format(_email=email, _id=id_val, _err=e))
+        return
+
+    logger.info(('Timing | email: {_email}  id: {_id}'
+                 ' | connect: {_t.connect:.3f}s'
+                 ' | ttfb: {_t.ttfb:.3f}s'
+                 ' | total: {_t.total:.3f}s')
+            .format(_email=email, _id=id_val, _t=r.timing))
+
+    with trace.timed(count, 'write', len(attempts)):
+        handle_response(q, count, id_val, dt, email, r, attempts)
+
+
+def run_lookups(q, limiter=None, url=None, api_key=None, forever=False):
+    """ Work through the lookup queue until it has been drained
+
+    The queue path of main.py and its daemon: with ASYNC_ENGINE every
+    lookup is made from a single thread with asyncio, otherwise a pool of
+    MAX_WORKERS threads shares one PersonClient with a keep-alive
+    connection per thread.  With TEST_FLAG the emails are only printed.
+
+    Parameters
+    ----------
+    q : an instance of scheduler.TimerQueue
+
+    limiter : a ratelimit.RateLimiter shared by every lookup
+
+    url : Person API endpoint, defaults to PERSON_API_URL
+
+    api_key : Full Contact API key, defaults to the contents of ~/.fc_key
+
+    forever : if True, keep waiting for new items however long the queue
+        is empty, until q.close() is called
+
+    Returns
+    -------
+    null
+    """
+    # import global
+    from fc import (ASYNC_ENGINE,
+                    ASYNC_MAX_CONNECTIONS,
+                    ASYNC_MAX_IN_FLIGHT,
+                    MAX_WORKERS,
+                    TEST_FLAG)
+
+    if TEST_FLAG:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+            scheduler.process_queue(q, pool, utils.print_email,
+                                    forever=forever)
+        return
+
+    if ASYNC_ENGINE:
+        # imported here as fc.aperson builds on this module
+        import fc.aperson as aperson
+        aperson.run_queue_async(q, ASYNC_MAX_IN_FLIGHT, ASYNC_MAX_CONNECTIONS,
+                                limiter, url, api_key, forever=forever)
+        return
+
+    client = PersonClient(url, api_key, pool_maxsize=MAX_WORKERS,
+                          limiter=limiter)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        scheduler.process_queue(q, pool, process_one_email, client, limiter,
+                                forever=forever)
+    # the thread pool has drained so the connections can be closed
+    client.close()
+
+
+def handle_response(q, count, id_val, dt, email, r, attempts=()):
+    """ Process a response from the Full Contact Person API
+
+    Shared by the thread pool (process_one_email) and asyncio
+    (fc.aperson.process_one_email_async) engines.
+
+    Parameters
+    ----------
+    q : an instance of scheduler.TimerQueue
+
+    count : the count from the original placement in the queue
+
+    id_val : id associated with email address
+
+    dt : date when the id was created
+
+    email : email address
+
+    r : response object
+        a requests object or anything with status_code, headers and json()
+
+    attempts : tuple of retry.Attempt for earlier responses for this email
+
+    Returns
+    -------
+    null
+    """
+    # import global
+    from fc import RETRY_POLICY
+
+    LOOKUPS.labels(status=r.status_code).inc()
 
     # log results
     # if status code is not in 200, 202, 404 then the
@@ -75,9 +210,9 @@ def process_one_email(q, count, id_val, dt, email):
                                    _id=id_val,
                                    _status=r.status_code)
     logger.info(post_msg)
-    out_file = join(OUT_DIR,
-            '{_dt}_{_id}.json'.format(_dt=dt,
-                                       _id=id_val))
+    out_store = get_store()
+    # the response body is written as is rather than parsed and re-serialized
+    payload = response_payload(r.status_code, r.content)
     logging_desc = ('Results | email: {_email}  id: {_id}'
                     ' | status {_status}')
     logging_desc = logging_desc.format(_email=email,
@@ -87,98 +222,229 @@ def process_one_email(q, count, id_val, dt, email):
     if r.status_code == 200:
         logging_desc += ' | success | writing to {_dt}_{_id}.json'
         logging_desc = \
-                logging_desc.format(_dt=dt, _id=id)
+                logging_desc.format(_dt=dt, _id=id_val)
         logger.info(logging_desc)
 
-        utils.write_json(r.json(), out_file)
+        out_store.put(dt, id_val, payload)
     elif r.status_code == 202:
-        logging_desc += (' | request is being processed'
-                         ' | adding email: {_email}  id: {_id}'
-                         ' back to the queue and waiting {_retry}'
-                         ' seconds before resubmitting')
-        logging_desc = logging_desc.format(_email=email,
-                                           _id=id_val,
-                                           _retry=RETRY_TIME)
+        logging_desc += ' | request is being processed'
         logger.info(logging_desc)
 
-        utils.write_json(r.json(), out_file)
-
-        # adding back to the queue
-        execute_time = time.time() + RETRY_TIME
-        q.put((execute_time, count, id_val, dt, email))
+        out_store.put(dt, id_val, payload)
     elif r.status_code == 400:
         logging_desc += ' | bad / malformed request'
         logger.info(logging_desc)
 
-        utils.write_json(r.json(), out_file)
+        out_store.put(dt, id_val, payload)
     elif r.status_code == 403:
         logging_desc += (' | forbidden'
                          ' | api key is invalid, missing, or exceeded quota')
         logger.info(logging_desc)
 
-        utils.write_json(r.json(), out_file)
+        out_store.put(dt, id_val, payload)
     elif r.status_code == 404:
         logging_desc += (' | not found'
                          ' | person searched in the past 24 hours'
                          ' and nothing was found')
         logger.info(logging_desc)
 
-        utils.write_json(r.json(), out_file)
+        out_store.put(dt, id_val, payload)
     elif r.status_code == 405:
         logging_desc += (' | method not allowed'
                          ' | queried the API with an unsupported HTTP method')
         logger.info(logging_desc)
 
-        utils.write_json(r.json(), out_file)
+        out_store.put(dt, id_val, payload)
     elif r.status_code == 410:
         logging_desc += ' | gone | the resource cannot be found'
         logger.info(logging_desc)
 
-        utils.write_json(r.json(), out_file)
+        out_store.put(dt, id_val, payload)
     elif r.status_code == 422:
         logging_desc += ' | invalid ==> invalid or missing API query parameter'
         logger.info(logging_desc)
 
-        utils.write_json(r.json(), out_file)
+        out_store.put(dt, id_val, payload)
     elif r.status_code == 500:
         logging_desc += (' | internal server error'
                          ' | an unexpected error at Full Contact; please contact'
                          'support@fullcontact.com')
         logger.info(logging_desc)
 
-        utils.write_json(r.json(), out_file)
+        out_store.put(dt, id_val, payload)
     elif r.status_code == 503:
         logging_desc += (' | service temporarily down'
                          ' | check the Retry-After header')
         logger.info(logging_desc)
 
-        utils.write_json(r.json(), out_file)
+        out_store.put(dt, id_val, payload)
+
+    # remember final responses so the email is not looked up again
+    response_cache = get_response_cache()
+    if (response_cache is not None and
+            response_cache.put(email, r.status_code, r.content)):
+        logger.info(('Cache | email: {_email}  id: {_id}'
+                     ' | stored status {_status}')
+                .format(_email=email, _id=id_val, _status=r.status_code))
+
+    # retry based on the policy for the status code
+    # 202s are polled with exponential backoff and 503s honor Retry-After
+    attempts = attempts + (retry.Attempt(time.time(), r.status_code),)
+    delay = RETRY_POLICY.next_delay(r.status_code, attempts, r.headers)
+    if delay is not None:
+        logger.info(('Retry | email: {_email}  id: {_id}'
+                     ' | status {_status} | attempt {_n}'
+                     ' | adding back to the queue and waiting {_delay:.1f}'
+                     ' seconds before resubmitting')
+                .format(_email=email, _id=id_val, _status=r.status_code,
+                        _n=len(attempts), _delay=delay))
+        # adding back to the queue
+        execute_time = time.time() + delay
+        q.put((execute_time, count, id_val, dt, email, attempts))
+    else:
+        if r.status_code in RETRY_POLICY.rules:
+            logger.info(('Retry | email: {_email}  id: {_id}'
+                         ' | status {_status} | giving up after {_n} attempts')
+                    .format(_email=email, _id=id_val, _status=r.status_code,
+                            _n=len(attempts)))
+        # the lookup is finished once its final response is written
+        complete(q, count, r.status_code)
 
 
-def query_person(lookup, lookup_value):
-    """ Query the Full Contact Person API
+def complete(q, count, status_code=None):
+    """ Record a lookup as completed once its output has been written
+
+    With the background writer the completion waits until the batch
+    holding the output is on disk, so a crash or a failed write leaves the
+    lookup pending in the journal.
 
     Parameters
     ----------
-    lookup : lookup type
-        possible values include email, phone, or twitter handle
+    q : an instance of scheduler.TimerQueue
 
-    lookup_value : lookup value associated with lookup
-        for instance, if the type of lookup is email then provide the
-        email string
+    count : the count from the original placement in the queue
+
+    status_code : status code of the final response, None for a cache hit
 
     Returns
     -------
-    r : requests object
+    null
+    """
+    writer.after_written(get_store(), q.completed, count, status_code)
+
+
+def response_payload(status_code, content):
+    """ Prepare a response body for the output store without a full parse
+
+    The compact JSON body from the API is passed through as bytes.  Only a
+    cheap check is made that it looks like a JSON object; anything else
+    (such as an HTML error page) is wrapped in a small JSON object.  When
+    OUT_FIELDS is set the body is parsed and only those top level fields
+    are kept.
+
+    Parameters
+    ----------
+    status_code : HTTP status code
+
+    content : response body as bytes
+
+    Returns
+    -------
+    payload : bytes of a JSON object, or a dict
     """
+    # import global
+    from fc import OUT_FIELDS
+
+    body = content.strip()
+    if not (body.startswith(b'{') and body.endswith(b'}')):
+        return {'status': status_code,
+                'body': content.decode('utf-8', 'replace')}
 
-    API_KEY = utils.get_api_key('fc_key')
-    URL = 'https://api.fullcontact.com/v2/person.json'
+    if OUT_FIELDS:
+        try:
+            data = json.loads(body.decode('utf-8'))
+        except ValueError:
+            return {'status': status_code,
+                    'body': content.decode('utf-8', 'replace')}
+        return {k: data[k] for k in OUT_FIELDS if k in data}
 
-    headers = {'X-FullContact-APIKey': API_KEY}
+    return body
 
-    # parameters
-    parameters = {'prettyPrint': 'true'}
+
+def check_cache(count, id_val, dt, email):
+    """ Write the output for a first lookup from the response cache if it
+    holds a response, recording the cache span and lookup metric
+
+    Parameters
+    ----------
+    count : the count from the original placement in the queue
+
+    id_val : id associated with email address
+
+    dt : date when the id was created
+
+    email : email address
+
+    Returns
+    -------
+    hit : True if a cached response was written
+    """
+    with trace.timed(count, 'cache'):
+        hit = respond_from_cache(id_val, dt, email)
+    if hit:
+        LOOKUPS.labels(status='cached').inc()
+    return hit
+
+
+def respond_from_cache(id_val, dt, email):
+    """ Write the output file for an email from the response cache
+
+    Parameters
+    ----------
+    id_val : id associated with email address
+
+    dt : date when the id was created
+
+    email : email address
+
+    Returns
+    -------
+    hit : True if a cached response was found and written
+    """
+    response_cache = get_response_cache()
+    if response_cache is None:
+        return False
+
+    r = response_cache.get(email)
+    if r is None:
+        return False
+
+    logger.info(('Cache | email: {_email}  id: {_id}'
+                 ' | hit with status {_status} fetched {_fetched}'
+                 ' | writing to {_dt}_{_id}.json')
+            .format(_email=email, _id=id_val, _status=r.status_code,
+                    _fetched=datetime.datetime.fromtimestamp(r.fetched_at),
+                    _dt=dt))
+    get_store().put(dt, id_val, response_payload(r.status_code, r.content))
+    return True
+
+
+def query_parameters(lookup, lookup_value):
+    """ Build the query string parameters for the Full Contact Person API
+
+    Parameters
+    ----------
+    lookup : lookup type
+        possible values include email, phone, or twitter handle
+
+    lookup_value : lookup value associated with lookup
+
+    Returns
+    -------
+    parameters : dict of query string parameters
+    """
+    # compact responses, the body is written out as is
+    parameters = {}
     if lookup == 'email':
         parameters['email'] = lookup_value
     elif lookup == 'phone':
@@ -189,7 +455,248 @@ def query_person(lookup, lookup_value):
     else:
         raise ValueError('lookup should be one of email, phone, or twitter')
 
-    # post request
-    r = requests.post(URL, headers=headers, params=parameters)
+    return parameters
+
+
+def query_person(lookup, lookup_value, client=None):
+    """ Query the Full Contact Person API
+
+    Parameters
+    ----------
+    lookup : lookup type
+        possible values include email, phone, or twitter handle
+
+    lookup_value : lookup value associated with lookup
+        for instance, if the type of lookup is email then provide the
+        email string
+
+    client : a PersonClient, defaults to a client shared by the process
+
+    Returns
+    -------
+    r : requests object
+    """
+    if client is None:
+        client = get_default_client()
+
+    return client.query(lookup, lookup_value)
+
+
+# per thread connect time, written by the timed connection classes below
+_timing = threading.local()
+
+class TimedHTTPConnection(urllib3.connection.HTTPConnection):
+    """ HTTP connection that records how long connecting took """
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _timing.connect = time.perf_counter() - start
+
+
+class TimedHTTPSConnection(urllib3.connection.HTTPSConnection):
+    """ HTTPS connection that records how long connecting took
+    (TCP and TLS handshakes) """
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _timing.connect = time.perf_counter() - start
 
-    return r
+
+class TimedHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(requests.adapters.HTTPAdapter):
+    """ Transport adapter whose connection pools record connect times """
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool}
+
+
+RequestTiming = namedtuple('RequestTiming', ['connect', 'ttfb', 'total'])
+
+class PersonClient(object):
+    """ Reusable client for the Full Contact Person API
+
+    The API key is read once and a single requests Session holds a pool of
+    keep-alive connections, so lookups after the first to a given
+    connection skip the TCP and TLS handshakes.  A client is safe to share
+    between the worker threads of a thread pool.
+
+    Every response returned by query has a timing attribute, a
+    RequestTiming with values in seconds:
+
+        connect : time spent opening a connection, 0.0 when one was reused
+        ttfb : time from sending the request until the headers were read,
+            includes connect
+        total : time until the full body was read
+
+    Parameters
+    ----------
+    url : Person API endpoint, defaults to PERSON_API_URL
+
+    api_key : Full Contact API key, defaults to the contents of ~/.fc_key
+
+    pool_maxsize : number of connections kept alive
+        should be at least the number of threads sharing the client
+
+    timeout : seconds to wait for the server before giving up
+
+    limiter : a ratelimit.RateLimiter re-synced from every response
+        taking tokens is left to the caller (see scheduler.process_queue)
+    """
+    def __init__(self, url=None, api_key=None, pool_maxsize=100,
+                 timeout=30.0, limiter=None):
+        if url is None:
+            # import global
+            from fc import PERSON_API_URL
+            url = PERSON_API_URL
+        if api_key is None:
+            api_key = utils.get_api_key('fc_key')
+        self.url = url
+        self.timeout = timeout
+        self.limiter = limiter
+        self.session = requests.Session()
+        self.session.headers['X-FullContact-APIKey'] = api_key
+        adapter = TimedHTTPAdapter(pool_connections=1,
+                                   pool_maxsize=pool_maxsize,
+                                   pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """ Close all pooled connections """
+        self.session.close()
+
+    def query(self, lookup, lookup_value):
+        """ Query the Full Contact Person API
+
+        Parameters
+        ----------
+        lookup : lookup type
+            possible values include email, phone, or twitter handle
+
+        lookup_value : lookup value associated with lookup
+
+        Returns
+        -------
+        r : requests object with an added timing attribute
+        """
+        parameters = query_parameters(lookup, lookup_value)
+
+        _timing.connect = 0.0
+        IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            r = self.session.post(self.url, params=parameters,
+                                  timeout=self.timeout)
+        except requests.RequestException:
+            LOOKUPS.labels(status='error').inc()
+            if self.limiter is not None:
+                self.limiter.update()
+            raise
+        finally:
+            IN_FLIGHT.dec()
+        total = time.perf_counter() - start
+        HTTP_SECONDS.observe(total)
+
+        if self.limiter is not None:
+            self.limiter.update(r.status_code, r.headers)
+
+        r.timing = RequestTiming(_timing.connect,
+                                 r.elapsed.total_seconds(),
+                                 total)
+        return r
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+def get_default_client():
+    """ Return the PersonClient shared by the process, creating it if needed
+
+    Returns
+    -------
+    client : a PersonClient
+    """
+    # import global
+    from fc import MAX_WORKERS
+
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = PersonClient(pool_maxsize=MAX_WORKERS)
+    return _default_client
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+def get_response_cache():
+    """ Return the ResponseCache shared by the process, opening it if needed
+
+    Returns
+    -------
+    cache : a cache.ResponseCache, or None if RESPONSE_CACHE is off
+    """
+    # import global
+    from fc import (RESPONSE_CACHE,
+                    RESPONSE_CACHE_FILE,
+                    RESPONSE_CACHE_MAX_ENTRIES,
+                    RESPONSE_CACHE_TTL)
+
+    global _response_cache
+    if not RESPONSE_CACHE:
+        return None
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = cache.ResponseCache(
+                RESPONSE_CACHE_FILE, RESPONSE_CACHE_TTL,
+                RESPONSE_CACHE_MAX_ENTRIES)
+    return _response_cache
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """ Return the output store shared by the process, opening it if needed
+
+    Returns
+    -------
+    store : a store.FileStore or store.SegmentStore depending on OUT_FORMAT
+        wrapped in a writer.BatchWriter when WRITER_BACKGROUND is set
+    """
+    # import global
+    from fc import (OUT_COMPRESSION,
+                    OUT_DIR,
+                    OUT_FORMAT,
+                    WRITER_BACKGROUND,
+                    WRITER_BATCH_SIZE,
+                    WRITER_FLUSH_INTERVAL,
+                    WRITER_FSYNC,
+                    WRITER_QUEUE_SIZE)
+
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = store.open_store(OUT_DIR, OUT_FORMAT, OUT_COMPRESSION)
+            if WRITER_BACKGROUND:
+                # workers hand results to a background writer thread
+                _store = writer.BatchWriter(_store, WRITER_QUEUE_SIZE,
+                                            WRITER_BATCH_SIZE,
+                                            WRITER_FLUSH_INTERVAL,
+                                            WRITER_FSYNC)
+    return _store
@@ -0,0 +1,179 @@
+# standard library
+import asyncio
+import logging
+import threading
+import time
+
+# local modules
+import fc.metrics as metrics
+
+logger = logging.getLogger()
+
+RATE_BUDGET = metrics.gauge(
+    'fc_rate_limit_remaining',
+    'Person API calls left in the rate limit window as of the last response')
+
+def _header_float(headers, name):
+    """ Return a header value as a float or None if missing or malformed """
+    try:
+        return float(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class RateLimiter(object):
+    """ Token bucket shared by everything that calls the Person API
+
+    The bucket holds up to limit tokens and refills at limit / period tokens
+    per second.  Each lookup takes a token before it is sent, so bursts go
+    through as long as there is budget and lookups are paced once the
+    budget runs out.
+
+    Every response re-syncs the bucket from its X-Rate-Limit-* headers:
+
+        X-Rate-Limit-Limit : calls allowed per period, sets the bucket size
+            and refill rate, so a raised or lowered quota is picked up
+            immediately
+        X-Rate-Limit-Remaining : calls left in the current window, less
+            the lookups still in flight, becomes the number of tokens
+        X-Rate-Limit-Reset : seconds until the window resets, used to
+            pause once nothing remains
+
+    A 403 or 429 (quota exceeded) empties the bucket, pauses until the
+    window resets (Retry-After, X-Rate-Limit-Reset or a full period) and
+    halves the refill rate until the next response with rate limit headers.
+
+    The bucket starts with a single token so that the first response syncs
+    the budget before a burst is sent.
+
+    Parameters
+    ----------
+    limit : calls allowed per period before any headers are seen
+
+    period : length of the rate limit window in seconds
+    """
+    def __init__(self, limit=300, period=60.0):
+        self.period = period
+        self.limit = limit
+        self.rate = limit / period
+        self.tokens = 1.0
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.limit,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        """ Take a token if one is available
+
+        Returns
+        -------
+        wait : 0.0 if a token was taken, otherwise the number of seconds
+            to wait before trying again
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self.paused_until:
+                return self.paused_until - now
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                self.in_flight += 1
+                return 0.0
+            return (1.0 - self.tokens) / self.rate
+
+    def acquire(self):
+        """ Block until a token has been taken
+
+        Returns
+        -------
+        waited : number of seconds spent waiting
+        """
+        start = time.monotonic()
+        while True:
+            wait = self.reserve()
+            if wait <= 0:
+                return time.monotonic() - start
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """ Wait without blocking the event loop until a token has been taken
+
+        Returns
+        -------
+        waited : number of seconds spent waiting
+        """
+        start = time.monotonic()
+        while True:
+            wait = self.reserve()
+            if wait <= 0:
+                return time.monotonic() - start
+            await asyncio.sleep(wait)
+
+    def release(self):
+        """ Give back a token that was taken but never used for a request,
+        such as for a lookup answered from the response cache
+
+        Returns
+        -------
+        null
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.in_flight = max(self.in_flight - 1, 0)
+            self.tokens = min(self.tokens + 1.0, self.limit)
+
+    def update(self, status_code=None, headers=None):
+        """ Re-sync the bucket from a response
+
+        Must be called once for every token taken, with status_code None
+        if the request failed without a response, unless the token is given
+        back with release.
+
+        Parameters
+        ----------
+        status_code : HTTP status code of the response
+
+        headers : response headers
+
+        Returns
+        -------
+        null
+        """
+        headers = headers if headers is not None else {}
+        limit = _header_float(headers, 'X-Rate-Limit-Limit')
+        remaining = _header_float(headers, 'X-Rate-Limit-Remaining')
+        reset = _header_float(headers, 'X-Rate-Limit-Reset')
+
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.in_flight = max(self.in_flight - 1, 0)
+
+            if status_code in (403, 429):
+                retry_after = _header_float(headers, 'Retry-After')
+                pause = retry_after or reset or self.period
+                self.tokens = 0.0
+                self.paused_until = max(self.paused_until, now + pause)
+                self.rate = max(self.rate / 2.0, 1.0 / self.period)
+                RATE_BUDGET.set(0)
+                logger.info(('RateLimit | status code: {_status}'
+                             ' | pausing for {_pause} seconds'
+                             ' | refill rate: {_rate:.2f} calls / second')
+                            .format(_status=status_code, _pause=pause,
+                                    _rate=self.rate))
+                return
+
+            if limit:
+                self.limit = limit
+                self.rate = limit / self.period
+            if remaining is not None:
+                RATE_BUDGET.set(remaining)
+                self.tokens = min(remaining - self.in_flight, self.limit)
+                if self.tokens <= 0 and reset:
+                    self.paused_until = max(self.paused_until, now + reset)
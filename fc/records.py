@@ -0,0 +1,365 @@
+# standard lib
+from array import array
+from collections import namedtuple
+from functools import total_ordering
+from json.encoder import encode_basestring_ascii
+import calendar
+import json
+import marshal
+import os
+import time
+
+Email = namedtuple('Email', ['id', 'dt', 'email'])
+
+
+def dt_to_seconds(dt):
+    """ Encode a 'YYYY-MM-DD HH:MM:SS' string as seconds since 1970
+
+    The string is treated as UTC so that every dt maps to exactly one
+    integer and back, regardless of daylight saving time.
+    """
+    if len(dt) != 19:
+        raise ValueError('dt should be formatted as YYYY-MM-DD HH:MM:SS')
+    return calendar.timegm((int(dt[0:4]), int(dt[5:7]), int(dt[8:10]),
+                            int(dt[11:13]), int(dt[14:16]), int(dt[17:19])))
+
+
+def seconds_to_dt(seconds):
+    """ Decode the output of dt_to_seconds back to a dt string """
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(seconds))
+
+
+@total_ordering
+class EmailView(object):
+    """ A read-only view of one row of an EmailTable
+
+    Has the id, dt and email attributes of an Email named tuple and
+    compares, hashes, unpacks and serializes (_asdict) the same way, so it
+    can be used wherever an Email is, but holds no strings of its own.
+    Views compare on the integer columns, and dt strings are formatted once
+    per distinct second by the table.
+
+    Parameters
+    ----------
+    table : the EmailTable
+
+    index : position of the row within the table
+    """
+    __slots__ = ('table', 'index')
+
+    _fields = Email._fields
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    @property
+    def id(self):
+        return self.table.ids[self.index]
+
+    @property
+    def dt(self):
+        return self.table.dt_string(self.table.dts[self.index])
+
+    @property
+    def email(self):
+        table = self.table
+        return table.email_values[table.emails[self.index]]
+
+    def _key(self):
+        # dt as seconds orders the same as the dt string
+        table = self.table
+        i = self.index
+        return (table.ids[i], table.dts[i],
+                table.email_values[table.emails[i]])
+
+    def __iter__(self):
+        return iter((self.id, self.dt, self.email))
+
+    def __len__(self):
+        return 3
+
+    def __getitem__(self, i):
+        return (self.id, self.dt, self.email)[i]
+
+    def __eq__(self, other):
+        if isinstance(other, EmailView):
+            table = self.table
+            if other.table is not table:
+                return self._key() == other._key()
+            i, j = self.index, other.index
+            return (table.dts[i] == table.dts[j] and
+                    table.emails[i] == table.emails[j] and
+                    table.ids[i] == table.ids[j])
+        if isinstance(other, tuple):
+            return tuple(self) == other
+        return NotImplemented
+
+    def __lt__(self, other):
+        if isinstance(other, EmailView):
+            return self._key() < other._key()
+        if isinstance(other, tuple):
+            return tuple(self) < other
+        return NotImplemented
+
+    def __hash__(self):
+        # the same as the hash of the Email named tuple, as they compare
+        #   equal
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return 'Email(id={!r}, dt={!r}, email={!r})'.format(*self)
+
+    def _asdict(self):
+        return dict(zip(self._fields, self))
+
+
+class EmailTable(object):
+    """ Compact columnar container of (id, dt, email) rows
+
+    Holding millions of Email named tuples costs a tuple and three string
+    objects per row.  Here each column is an array instead:
+
+        ids : integer ids in an array of 64 bit integers, falling back to
+            a list if an id is not an integer
+        dts : dt encoded as an integer number of seconds (see
+            dt_to_seconds), which also orders the same as the dt string
+        emails : a code per row into email_values, each distinct email
+            address stored once
+
+    Iterating or indexing yields EmailView objects that read a row from the
+    columns on demand.  Use row to get an Email named tuple instead.  The
+    dt string of each distinct second is formatted once and kept.
+
+    Parameters
+    ----------
+    emails : iterable of Email named tuples (or anything with id, dt and
+        email attributes) to add
+    """
+    def __init__(self, emails=()):
+        self.ids = array('q')
+        self.dts = array('q')
+        self.emails = array('I')
+        self.email_values = []
+        self._email_codes = {}
+        self._dt_strings = {}
+        self.extend(emails)
+
+    def __len__(self):
+        return len(self.dts)
+
+    def __iter__(self):
+        for i in range(len(self.dts)):
+            yield EmailView(self, i)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [EmailView(self, j) for j in range(len(self.dts))[i]]
+        if i < 0:
+            i += len(self.dts)
+        if not 0 <= i < len(self.dts):
+            raise IndexError('EmailTable index out of range')
+        return EmailView(self, i)
+
+    def __repr__(self):
+        return 'EmailTable({} rows)'.format(len(self))
+
+    def append(self, id_val, dt, email):
+        """ Add one row
+
+        Parameters
+        ----------
+        id_val : id associated with email address
+
+        dt : datetime string when the id was created
+
+        email : email address
+
+        Returns
+        -------
+        null
+        """
+        if isinstance(self.ids, array):
+            try:
+                self.ids.append(id_val)
+            except (TypeError, OverflowError):
+                # an id that is not an integer, keep the ids as a list
+                self.ids = self.ids.tolist()
+                self.ids.append(id_val)
+        else:
+            self.ids.append(id_val)
+        self.dts.append(dt_to_seconds(dt))
+        code = self._email_codes.get(email)
+        if code is None:
+            code = self._email_codes[email] = len(self.email_values)
+            self.email_values.append(email)
+        self.emails.append(code)
+
+    def extend(self, emails):
+        """ Add every Email named tuple (or view) in an iterable """
+        append = self.append
+        for e in emails:
+            append(e.id, e.dt, e.email)
+
+    def dt_string(self, seconds):
+        """ Decode a dt from the dts column to a dt string """
+        dt = self._dt_strings.get(seconds)
+        if dt is None:
+            dt = self._dt_strings[seconds] = seconds_to_dt(seconds)
+        return dt
+
+    def row(self, i):
+        """ Return row i as an Email named tuple """
+        return Email(self.ids[i], self.dt_string(self.dts[i]),
+                     self.email_values[self.emails[i]])
+
+
+class EmailFile(object):
+    """ Newline delimited json file of Email rows, such as the history file
+    data/emails_to_process.json
+
+    Bound to the Email schema: each line is {"id": ..., "dt": ...,
+    "email": ...} as written by utils.write_namedtuple_as_json, so lines
+    map straight onto Email without building a class per line.
+
+    Alongside the json file a binary sidecar (the same path plus .bin)
+    holds the columns of an EmailTable packed with marshal, which loads
+    many times faster than parsing the json.  The sidecar records the size
+    and modification time of the json file it was built from and is
+    rebuilt whenever the json file has changed since.
+
+    Parameters
+    ----------
+    path : full path to the json file
+    """
+    # bump when the layout of the sidecar changes
+    SIDECAR_VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.sidecar_path = path + '.bin'
+
+    def __iter__(self):
+        """ Stream the rows of the json file as Email named tuples """
+        loads = json.loads
+        with open(self.path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    d = loads(line)
+                    yield Email(d['id'], d['dt'], d['email'])
+
+    def _stamp(self):
+        st = os.stat(self.path)
+        return (st.st_size, st.st_mtime_ns)
+
+    def read(self):
+        """ Read every row into an EmailTable, from the sidecar if it is
+        current
+
+        Returns
+        -------
+        table : an EmailTable
+        """
+        table = self.read_sidecar()
+        if table is None:
+            table = EmailTable(self)
+            self.write_sidecar(table)
+        return table
+
+    def read_sidecar(self):
+        """ Load the sidecar
+
+        Returns
+        -------
+        table : an EmailTable, or None if the sidecar is missing or out of
+            date
+        """
+        try:
+            with open(self.sidecar_path, 'rb') as f:
+                header, columns = marshal.loads(f.read())
+            if header != (self.SIDECAR_VERSION, self._stamp()):
+                return None
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        ids, dts, emails, email_values = columns
+
+        table = EmailTable()
+        if isinstance(ids, bytes):
+            table.ids.frombytes(ids)
+        else:
+            table.ids = ids
+        table.dts.frombytes(dts)
+        table.emails.frombytes(emails)
+        table.email_values = email_values
+        table._email_codes = {e: i for i, e in enumerate(email_values)}
+        return table
+
+    def write_sidecar(self, table):
+        """ Write the columns of a table, which must hold every row of the
+        json file, to the sidecar
+
+        Parameters
+        ----------
+        table : an EmailTable
+
+        Returns
+        -------
+        null
+        """
+        ids = table.ids
+        if isinstance(ids, array):
+            ids = ids.tobytes()
+        tmp_path = self.sidecar_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            marshal.dump(((self.SIDECAR_VERSION, self._stamp()),
+                          (ids, table.dts.tobytes(), table.emails.tobytes(),
+                           table.email_values)), f)
+        os.replace(tmp_path, self.sidecar_path)
+
+    def write(self, emails, file_mode='w'):
+        """ Write Email rows as newline delimited json
+
+        Produces the same lines as utils.write_namedtuple_as_json.  The
+        sidecar is kept current, unless it was already out of date before
+        appending, in which case it is rebuilt by the next read.
+
+        Parameters
+        ----------
+        emails : an EmailTable or an iterable of Email named tuples (or
+            views)
+
+        file_mode : 'w' to overwrite or 'a' to append
+
+        Returns
+        -------
+        null
+        """
+        if not isinstance(emails, EmailTable):
+            emails = EmailTable(emails)
+
+        if file_mode == 'w':
+            table = emails
+        elif os.path.isfile(self.path):
+            table = self.read_sidecar()
+            if table is not None:
+                table.extend(emails)
+        else:
+            table = emails
+
+        def encode(value):
+            if isinstance(value, str):
+                return encode_basestring_ascii(value)
+            if type(value) is int:
+                return str(value)
+            return json.dumps(value)
+
+        line = '{{"id": {}, "dt": "{}", "email": {}}}\n'.format
+        with open(self.path, file_mode) as f:
+            values = [encode_basestring_ascii(e) for e in emails.email_values]
+            dt_string = emails.dt_string
+            f.writelines(line(encode(id_val), dt_string(dt), values[code])
+                         for id_val, dt, code in zip(emails.ids, emails.dts,
+                                                     emails.emails))
+
+        if table is not None:
+            self.write_sidecar(table)
@@ -0,0 +1,106 @@
+# standard library
+from collections import namedtuple
+from email.utils import parsedate_to_datetime
+import datetime
+import random
+import time
+
+# one entry per response in the attempt history carried in the queue tuple
+Attempt = namedtuple('Attempt', ['time', 'status_code'])
+
+# base : delay in seconds before the first retry
+# factor : multiplier applied to the delay for every further retry
+# max_delay : upper bound on the delay in seconds
+# max_attempts : give up once this many responses with the status code
+#   have been received
+# jitter : fraction of the delay that is randomized, between 0 and 1
+# retry_after : honor the Retry-After header when present
+RetryRule = namedtuple('RetryRule', ['base', 'factor', 'max_delay',
+                                     'max_attempts', 'jitter',
+                                     'retry_after'])
+
+def retry_after_seconds(value, now=None):
+    """ Parse a Retry-After header value
+
+    Parameters
+    ----------
+    value : either a number of seconds or an HTTP date
+
+    now : current time as from time.time(), defaults to time.time()
+
+    Returns
+    -------
+    seconds : number of seconds to wait, or None if value is not valid
+    """
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    if now is None:
+        now = time.time()
+    return max(when.timestamp() - now, 0.0)
+
+
+class RetryPolicy(object):
+    """ Decide when, and whether, to retry a lookup based on its status code
+
+    Each status code has a RetryRule.  The delay before retry n (counting
+    from 1) is base * factor ** (n - 1), capped at max_delay, with the
+    jitter fraction of it randomized so that emails queued together do not
+    retry in lockstep.  When the rule allows it, a Retry-After header
+    takes precedence over the computed delay.  Status codes without a rule
+    are never retried.
+
+    Parameters
+    ----------
+    rules : dict mapping status codes to RetryRule
+    """
+    def __init__(self, rules):
+        self.rules = dict(rules)
+
+    def next_delay(self, status_code, attempts, headers=None):
+        """ Return how long to wait before retrying
+
+        Parameters
+        ----------
+        status_code : status code of the latest response
+
+        attempts : tuple of Attempt, including the latest response
+
+        headers : headers of the latest response
+
+        Returns
+        -------
+        delay : seconds to wait, or None to stop retrying
+        """
+        rule = self.rules.get(status_code)
+        if rule is None:
+            return None
+        # only responses with this status code count towards its cap
+        num_attempts = sum(1 for attempt in attempts
+                           if attempt.status_code == status_code)
+        if num_attempts >= rule.max_attempts:
+            return None
+
+        if rule.retry_after and headers is not None:
+            delay = retry_after_seconds(headers.get('Retry-After'))
+            if delay is not None:
+                return min(delay, rule.max_delay)
+
+        # only count the consecutive attempts with this status code
+        n = 0
+        for attempt in reversed(attempts):
+            if attempt.status_code != status_code:
+                break
+            n += 1
+
+        delay = min(rule.base * rule.factor ** max(n - 1, 0), rule.max_delay)
+        return delay * (1.0 - rule.jitter * random.random())
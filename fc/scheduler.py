@@ -1,27 +1,197 @@
 # standard library
+import heapq
 import logging
 import queue
+import threading
 import time
 
+# local modules
+import fc.metrics as metrics
+import fc.trace as trace
+
 logger = logging.getLogger()
 
-def process_queue(q, pool, func):
+QUEUE_DEPTH = metrics.gauge(
+    'fc_queue_depth', 'Lookups waiting on the queue, due or not')
+QUEUE_WAIT_SECONDS = metrics.histogram(
+    'fc_queue_wait_seconds',
+    'Seconds from when a lookup was due until it was submitted')
+
+class TimerQueue(object):
+    """ Priority queue of timed items that wakes exactly when items are due
+
+    Items are tuples whose first element is the time (as from time.time())
+    at which the item may execute, the same tuples that were put on a
+    queue.PriorityQueue.  A heap keeps the earliest item on top and a
+    condition variable lets get_due sleep until that item is due.  Putting
+    an item that is due earlier than the current head wakes the waiting
+    thread immediately, so a retry can jump ahead of a later item.
+
+    put, get_nowait and qsize match queue.PriorityQueue so existing
+    producers such as person.handle_response do not change.
+
+    Parameters
+    ----------
+    journal : a journal.Journal
+        if given, every put, submission and completion is recorded before
+        it takes effect so that the queue can be rebuilt after a crash
+    """
+    def __init__(self, journal=None):
+        self.heap = []
+        self.cond = threading.Condition(threading.Lock())
+        self.journal = journal
+        self.closed = False
+
+    def put(self, item):
+        """ Add an item to the queue
+
+        Parameters
+        ----------
+        item : tuple whose first element is the time the item is due
+
+        Returns
+        -------
+        null
+        """
+        if self.journal is not None:
+            self.journal.put(item)
+        with self.cond:
+            heapq.heappush(self.heap, item)
+            QUEUE_DEPTH.set(len(self.heap))
+            # only wake the waiter if the new item is now at the top
+            if self.heap[0] is item:
+                self.cond.notify()
+
+    def get_nowait(self):
+        """ Pop the earliest item regardless of whether it is due
+
+        Returns
+        -------
+        item : the earliest item
+            raises queue.Empty if there are no items
+        """
+        with self.cond:
+            if not self.heap:
+                raise queue.Empty
+            item = heapq.heappop(self.heap)
+            QUEUE_DEPTH.set(len(self.heap))
+            return item
+
+    def submitted(self, count):
+        """ Record that the item with this count was handed to a worker """
+        if self.journal is not None:
+            self.journal.submitted(count)
+
+    def completed(self, count, status_code=None):
+        """ Record that the item with this count will not be retried """
+        if self.journal is not None:
+            self.journal.completed(count, status_code)
+
+    def close(self):
+        """ Wake any thread waiting in get_due and make it return nothing
+
+        Items still on the queue are kept (and stay in the journal).
+        """
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def qsize(self):
+        with self.cond:
+            return len(self.heap)
+
+    def next_count(self):
+        """ Return the count to give the next new item, one more than the
+        highest count on the queue or 0 if it is empty
+        """
+        with self.cond:
+            return max([item[1] + 1 for item in self.heap], default=0)
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def get_due(self, timeout=None):
+        """ Wait for the next item to come due and return every due item
+
+        Parameters
+        ----------
+        timeout : give up after the queue has been empty for __ seconds
+            None waits forever; time spent waiting for a queued item to
+            come due does not count against the timeout
+
+        Returns
+        -------
+        items : list of every item that is due, earliest first
+            an empty list if the timeout expired or the queue was closed
+        """
+        with self.cond:
+            deadline = None
+            while True:
+                if self.closed:
+                    return []
+                now = time.time()
+                if not self.heap:
+                    if timeout is None:
+                        self.cond.wait()
+                        continue
+                    if deadline is None:
+                        deadline = now + timeout
+                    elif now >= deadline:
+                        return []
+                    self.cond.wait(deadline - now)
+                    continue
+
+                deadline = None
+                diff = self.heap[0][0] - now
+                if diff > 0:
+                    self.cond.wait(diff)
+                    continue
+
+                items = []
+                while self.heap and self.heap[0][0] <= now:
+                    items.append(heapq.heappop(self.heap))
+                QUEUE_DEPTH.set(len(self.heap))
+                return items
+
+
+def _log_failure(future):
+    e = future.exception()
+    if e is not None:
+        logger.error('Error | lookup failed: {_err!r}'.format(_err=e),
+                     exc_info=e)
+
+
+def process_queue(q, pool, func, client=None, limiter=None, timeout=None,
+                  forever=False):
     """ Process a priority queue based on time
 
     The priority within the queue is the time at which the item can execute.
 
-    Continually poll the queue, popping an item only when the current time
-    is greater than the time at which the item is permitted to execute.  The
-    queue is designed in this manner in order to deal with API rate limiting.
+    Sleep until the earliest item in the queue is due and then submit every
+    item that is due.  The queue is designed in this manner in order to
+    deal with API rate limiting.
 
     Parameters
     ----------
-    q : an instance of a priority queue
+    q : an instance of TimerQueue
 
     pool : a thread pool
 
     func : the function to be executed by a thread in the threadpool
 
+    client : a person.PersonClient shared by every call to func
+        if None, func falls back to its own default
+
+    limiter : a ratelimit.RateLimiter
+        a token is taken before each submission so that submissions are
+        paced by the rate limit budget reported by the API
+
+    timeout : stop once the queue has been empty for __ seconds
+        defaults to QUEUE_TIMEOUT
+
+    forever : if True, keep waiting for new items however long the queue
+        is empty, until q.close() is called
+
     Returns
     -------
     null
@@ -30,39 +200,39 @@ def process_queue(q, pool, func):
     from fc import (QUEUE_TIMEOUT,
                     TEST_FLAG)
 
-    # get first item in the queue
-    priority, count, id_val, dt, email = q.get()
+    if timeout is None:
+        timeout = QUEUE_TIMEOUT
 
     # loop through until the queue is empty for __ seconds
     while True:
-        diff = priority - time.time()
-        # if we have crossed the timing threshold
-        if diff <= 0:
+        items = q.get_due(timeout=None if forever else timeout)
+        if not items:
+            break
+
+        # dispatch every item that is due in one batch
+        for priority, count, id_val, dt, email, attempts in items:
+            if limiter is not None:
+                limiter.acquire()
+            # includes waiting on the rate limiter
+            submit_time = time.time()
+            QUEUE_WAIT_SECONDS.observe(max(submit_time - priority, 0.0))
+            if attempts:
+                trace.span(count, 'backoff', attempts[-1].time, priority,
+                           len(attempts))
+            trace.span(count, 'queue', priority, submit_time, len(attempts))
+
             logger.info(('Submit | email: {_email}  id: {_id}'
                          ' | submit {_email} for execution')
                          .format(_email=email, _id=id_val))
+            q.submitted(count)
 
             if TEST_FLAG:
                 # submit to print_email - useful for testing
                 a = pool.submit(func, email)
             else:
                 # submit to process_one_email
-                a = pool.submit(func, q, count, id_val, dt, email)
-
-            try:
-                priority, count, id_val, dt, \
-                        email = q.get(timeout=QUEUE_TIMEOUT)
-            except queue.Empty:
-                break
-
-        # sliding scale for sleeping
-        # based on an idea from the pause package
-        # https://pypi.python.org/pypi/pause
-        if diff <= 0.1:
-            time.sleep(0.001)
-        elif diff <= 0.5:
-            time.sleep(0.01)
-        elif diff <= 1.5:
-            time.sleep(0.1)
-        else:
-            time.sleep(1)
+                a = pool.submit(trace.run_traced, submit_time, count,
+                                len(attempts), func, q, count, id_val, dt,
+                                email, attempts, client)
+            # nothing waits on the future, so an error would go unseen
+            a.add_done_callback(_log_failure)
@@ -0,0 +1,293 @@
+# standard lib
+import datetime
+import logging
+import sqlite3
+import time
+
+# local modules
+import fc.bloom as bloom
+from fc.dedupe import EMAILS_DEDUPED
+
+logger = logging.getLogger()
+
+def _dt_str(dt):
+    """ Format a datetime the same way as the dt element of an Email """
+    if isinstance(dt, datetime.datetime):
+        return dt.strftime('%Y-%m-%d %H:%M:%S')
+    return dt
+
+
+class SeenIndex(object):
+    """ On-disk index of (id, email) pairs that have already been seen
+
+    Replaces rewriting and reloading data/emails_10_days.json every hour.
+    Backed by a sqlite table whose primary key is (id, email), so a lookup
+    is a single index probe and an hourly insert only touches the new rows.
+    The first and last time a pair was seen are stored alongside the key.
+    Pairs whose last sighting falls outside the window are expired.
+
+    The index also records the datetime through which rows have been
+    loaded so that missed hours can be backfilled.
+
+    An optional Bloom filter sits in front of the index.  Every pair added
+    to the index is added to the filter, so a pair the filter rules out is
+    known to be new without probing the index; only possible hits are
+    checked exactly.
+
+    Every change to the index bumps a generation number kept in the index,
+    and the filter is saved with the generation it matches.  A filter that
+    does not match, such as one that missed a crash before it was saved or
+    runs made without a filter, is rebuilt from the index rather than
+    trusted, as a stale filter would let seen emails through.
+
+    Parameters
+    ----------
+    db_path : full path to the sqlite database file
+        created if it does not already exist
+
+    bloom_filter : a bloom.DailyBloomFilter
+        rebuilt from the index if it does not match the index
+
+    save_interval : save the filter at most every __ seconds, and on close
+    """
+    def __init__(self, db_path, bloom_filter=None, save_interval=300.0):
+        self.db_path = db_path
+        self.bloom_filter = bloom_filter
+        self.save_interval = save_interval
+        self.last_save = time.monotonic()
+        self.unsaved = False
+        self.cnxn = sqlite3.connect(db_path)
+        self.cnxn.executescript('''
+            pragma journal_mode = wal;
+            pragma synchronous = normal;
+            create table if not exists seen (
+                id text not null,
+                email text not null,
+                first_seen text not null,
+                last_seen text not null,
+                primary key (id, email)
+            ) without rowid;
+            create index if not exists seen_last_seen on seen (last_seen);
+            create table if not exists meta (
+                name text primary key,
+                value text
+            );
+        ''')
+        if bloom_filter is not None:
+            self._sync_bloom_filter()
+
+    def _sync_bloom_filter(self):
+        generation = self._get_generation()
+        if self.bloom_filter.generation == generation:
+            return
+        logger.info('Seen | building the Bloom filter from {_n} emails'
+                    .format(_n=len(self)))
+        self.bloom_filter.clear()
+        for id_val, email, last_seen in self.cnxn.execute(
+                'select id, email, last_seen from seen'):
+            self.bloom_filter.add(bloom.bloom_key(id_val, email), last_seen)
+        self.bloom_filter.generation = generation
+        self._save_bloom_filter()
+
+    def _get_generation(self):
+        row = self.cnxn.execute("select value from meta"
+                                " where name = 'generation'").fetchone()
+        return 0 if row is None else int(row[0])
+
+    def _bump_generation(self):
+        # within the transaction that changes the index
+        self.cnxn.execute("insert into meta (name, value)"
+                          " values ('generation', '1')"
+                          " on conflict (name) do update set"
+                          " value = cast(value as integer) + 1")
+        return self._get_generation()
+
+    def _changed(self, generation):
+        # the filter now matches the index, save it if it is time to
+        if self.bloom_filter is None:
+            return
+        self.bloom_filter.generation = generation
+        self.unsaved = True
+        if time.monotonic() - self.last_save >= self.save_interval:
+            self._save_bloom_filter()
+
+    def _save_bloom_filter(self):
+        self.bloom_filter.save()
+        self.last_save = time.monotonic()
+        self.unsaved = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.cnxn.execute('select count(*) from seen').fetchone()[0]
+
+    def __contains__(self, key):
+        return self.contains(*key)
+
+    def close(self):
+        """ Save the Bloom filter and close the underlying sqlite
+        connection """
+        if self.bloom_filter is not None and self.unsaved:
+            self._save_bloom_filter()
+        self.cnxn.close()
+
+    def contains(self, id_val, email):
+        """ Check whether an id and email have been seen within the window
+
+        Parameters
+        ----------
+        id_val : id associated with email address
+
+        email : email address
+
+        Returns
+        -------
+        seen : True if the pair is in the index
+        """
+        row = self.cnxn.execute('select 1 from seen where id = ? and email = ?',
+                                (str(id_val), email)).fetchone()
+        return row is not None
+
+    def add(self, emails):
+        """ Insert Email named tuples into the index
+
+        Existing pairs keep their earliest first_seen and latest last_seen.
+
+        Parameters
+        ----------
+        emails : iterable of named tuples with id, dt and email elements
+
+        Returns
+        -------
+        null
+        """
+        with self.cnxn:
+            self.cnxn.executemany('''
+                insert into seen (id, email, first_seen, last_seen)
+                values (?, ?, ?, ?)
+                on conflict (id, email) do update set
+                    first_seen = min(first_seen, excluded.first_seen),
+                    last_seen = max(last_seen, excluded.last_seen)
+            ''', self._rows(emails))
+            generation = self._bump_generation()
+        self._changed(generation)
+
+    def _rows(self, emails):
+        for e in emails:
+            if self.bloom_filter is not None:
+                self.bloom_filter.add(bloom.bloom_key(e.id, e.email), e.dt)
+            yield (str(e.id), e.email, e.dt, e.dt)
+
+    def filter_unseen(self, emails):
+        """ Stream the Email named tuples that are not in the index
+
+        Same semantics as compare_namedtuples(emails, history, ('id', 'email'))
+        without loading the history into memory.
+
+        Parameters
+        ----------
+        emails : iterable of named tuples with id and email elements
+
+        Returns
+        -------
+        email : yields the named tuples that have not been seen
+        """
+        bloom_filter = self.bloom_filter
+        num_seen = 0
+        try:
+            for e in emails:
+                # ruled out by the Bloom filter, so definitely new
+                if (bloom_filter is not None and
+                        bloom.bloom_key(e.id, e.email) not in bloom_filter):
+                    yield e
+                elif not self.contains(e.id, e.email):
+                    yield e
+                else:
+                    num_seen += 1
+        finally:
+            EMAILS_DEDUPED.labels(stage='seen').inc(num_seen)
+
+    def expire(self, cutoff):
+        """ Remove pairs that have not been seen since the cutoff
+
+        Parameters
+        ----------
+        cutoff : datetime or dt string
+            pairs whose last sighting is before this are deleted
+
+        Returns
+        -------
+        num_expired : number of pairs removed
+        """
+        with self.cnxn:
+            crsr = self.cnxn.execute('delete from seen where last_seen < ?',
+                                     (_dt_str(cutoff),))
+            generation = self._bump_generation()
+        if self.bloom_filter is not None:
+            # whole days before the cutoff, any later sighting of a pair is
+            #   also in a later day
+            self.bloom_filter.expire(cutoff)
+        self._changed(generation)
+        logger.info('Seen | expired {_n} emails last seen before {_cutoff}'
+                    .format(_n=crsr.rowcount, _cutoff=cutoff))
+        return crsr.rowcount
+
+    def _get_meta(self, name):
+        row = self.cnxn.execute('select value from meta where name = ?',
+                                (name,)).fetchone()
+        if row is None:
+            return None
+        return datetime.datetime.strptime(row[0], '%Y-%m-%d %H:%M:%S')
+
+    def _set_meta(self, name, dt):
+        with self.cnxn:
+            self.cnxn.execute('insert or replace into meta (name, value)'
+                              ' values (?, ?)', (name, _dt_str(dt)))
+
+    def get_loaded_through(self):
+        """ Return the datetime through which rows have been loaded
+
+        Returns
+        -------
+        loaded_through : a datetime or None if nothing has been loaded
+        """
+        return self._get_meta('loaded_through')
+
+    def set_loaded_through(self, dt):
+        """ Record the datetime through which rows have been loaded
+
+        Parameters
+        ----------
+        dt : a datetime
+
+        Returns
+        -------
+        null
+        """
+        self._set_meta('loaded_through', dt)
+
+    def get_high_water_mark(self):
+        """ Return the dt through which the daemon has polled for rows
+
+        Returns
+        -------
+        high_water_mark : a datetime or None if the daemon has never polled
+        """
+        return self._get_meta('high_water_mark')
+
+    def set_high_water_mark(self, dt):
+        """ Record the dt through which the daemon has polled for rows
+
+        Parameters
+        ----------
+        dt : a datetime
+
+        Returns
+        -------
+        null
+        """
+        self._set_meta('high_water_mark', dt)
@@ -0,0 +1,349 @@
+# standard library
+from os.path import join
+import datetime
+import fcntl
+import glob
+import gzip
+import json
+import lzma
+import os
+import threading
+import zlib
+
+# local modules
+import fc.utils as utils
+
+# file extension for each supported segment compression
+EXTENSIONS = {None: '.ndjson',
+              'gzip': '.ndjson.gz',
+              'lzma': '.ndjson.xz'}
+
+class FileStore(object):
+    """ Write each result to its own '{dt}_{id}.json' file
+
+    The original output layout, kept as a compatibility mode.
+
+    Parameters
+    ----------
+    out_dir : directory containing the JSON files
+    """
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+
+    def put(self, dt, id_val, data, fsync=False):
+        """ Write one result, replacing any earlier result for (dt, id)
+
+        Parameters
+        ----------
+        dt : date when the id was created
+
+        id_val : id associated with email address
+
+        data : JSON serializable result or bytes of a JSON document
+            bytes are written as is
+
+        fsync : if True, wait for the file to reach the disk
+
+        Returns
+        -------
+        null
+        """
+        out_file = join(self.out_dir,
+                        '{_dt}_{_id}.json'.format(_dt=dt, _id=id_val))
+        if not isinstance(data, bytes):
+            utils.write_json(data, out_file, fsync)
+            return
+
+        with open(out_file, 'wb') as j:
+            j.write(data)
+            j.write(b'\n')
+            if fsync:
+                j.flush()
+                os.fsync(j.fileno())
+
+    def put_many(self, records, fsync=False):
+        """ Write a batch of (dt, id, data) results """
+        for dt, id_val, data in records:
+            self.put(dt, id_val, data, fsync)
+
+    def close(self):
+        pass
+
+
+def _compress(payload, compression):
+    if compression == 'gzip':
+        return gzip.compress(payload, compresslevel=6)
+    if compression == 'lzma':
+        return lzma.compress(payload)
+    return payload
+
+
+class SegmentStore(object):
+    """ Append results to hourly NDJSON segment files
+
+    Rather than one small file per lookup, every result is appended as one
+    line to a segment file named after the hour it was written in, such as
+    2016-06-03_19.ndjson.gz.  Each line is {"dt": ..., "id": ..., "data":
+    ...}.  A later result for the same (dt, id), for instance a 200 after a
+    202, is appended and supersedes the earlier one.
+
+    Each segment has a sidecar 2016-06-03_19.idx with one tab separated
+    line per result: dt, id, offset and line.  For an uncompressed segment
+    offset is the byte offset of the result and line is 0.  A compressed
+    segment is a series of independently compressed members, one per batch
+    written, so offset is where the member starts and line is the position
+    of the result within the member.  Concatenated members are still a valid
+    gzip or xz file, so segments can be read with standard tools.
+
+    Several processes can append to the same segment, such as --daemon
+    while --resume runs.  Each batch is written under an exclusive lock on
+    the segment file and its offset is taken from the end of the file once
+    the lock is held, so the offsets in the index stay correct.
+
+    Parameters
+    ----------
+    out_dir : directory containing the segment files
+
+    compression : None, 'gzip' or 'lzma'
+    """
+    def __init__(self, out_dir, compression=None):
+        if compression not in EXTENSIONS:
+            raise ValueError('compression should be one of None, gzip,'
+                             ' or lzma')
+        self.out_dir = out_dir
+        self.compression = compression
+        self.lock = threading.Lock()
+        self.hour = None
+        self.segment = None
+        self.index = None
+
+    def _roll(self):
+        hour = datetime.datetime.now().strftime('%Y-%m-%d_%H')
+        if hour == self.hour:
+            return
+        self.close()
+        self.hour = hour
+        self.segment = open(join(self.out_dir,
+                                 hour + EXTENSIONS[self.compression]), 'ab')
+        self.index = open(join(self.out_dir, hour + '.idx'), 'a')
+
+    def put(self, dt, id_val, data, fsync=False):
+        """ Append one result
+
+        Parameters
+        ----------
+        dt : date when the id was created
+
+        id_val : id associated with email address
+
+        data : JSON serializable result or bytes of a JSON document
+
+        fsync : if True, wait for the result to reach the disk
+
+        Returns
+        -------
+        null
+        """
+        self.put_many([(dt, id_val, data)], fsync)
+
+    def put_many(self, records, fsync=False):
+        """ Append a batch of (dt, id, data) results
+
+        The batch is written with a single write (and compressed as a
+        single member) to the current segment.
+
+        Parameters
+        ----------
+        records : iterable of tuples (dt, id, data)
+
+        fsync : if True, wait for the batch to reach the disk
+
+        Returns
+        -------
+        null
+        """
+        lines = []
+        keys = []
+        for dt, id_val, data in records:
+            if isinstance(data, bytes):
+                # splice the raw document in without parsing it
+                # outside of strings a newline in JSON is only whitespace
+                #   and within strings it must already be escaped
+                prefix = json.dumps({'dt': dt, 'id': id_val},
+                                    separators=(',', ':'))[:-1]
+                line = (prefix.encode('utf-8') + b',"data":' +
+                        data.replace(b'\r', b' ').replace(b'\n', b' ') +
+                        b'}\n')
+            else:
+                record = {'dt': dt, 'id': id_val, 'data': data}
+                line = (json.dumps(record, separators=(',', ':'))
+                        .encode('utf-8') + b'\n')
+            lines.append(line)
+            keys.append((dt, id_val))
+        if not lines:
+            return
+
+        with self.lock:
+            self._roll()
+            # other processes may append to the segment too
+            fcntl.flock(self.segment.fileno(), fcntl.LOCK_EX)
+            try:
+                self._append(keys, lines, fsync)
+            finally:
+                fcntl.flock(self.segment.fileno(), fcntl.LOCK_UN)
+
+    def _append(self, keys, lines, fsync):
+        # the segment lock is held, so nothing is appended meanwhile
+        offset = self.segment.seek(0, os.SEEK_END)
+        index_lines = []
+        if self.compression is None:
+            for (dt, id_val), line in zip(keys, lines):
+                index_lines.append('{}\t{}\t{}\t0\n'.format(dt, id_val,
+                                                            offset))
+                offset += len(line)
+        else:
+            for i, (dt, id_val) in enumerate(keys):
+                index_lines.append('{}\t{}\t{}\t{}\n'.format(dt, id_val,
+                                                             offset, i))
+        self.segment.write(_compress(b''.join(lines), self.compression))
+        self.segment.flush()
+        self.index.writelines(index_lines)
+        self.index.flush()
+        if fsync:
+            os.fsync(self.segment.fileno())
+            os.fsync(self.index.fileno())
+
+    def close(self):
+        """ Close the current segment and index files """
+        if self.segment is not None:
+            self.segment.close()
+            self.index.close()
+        self.hour = self.segment = self.index = None
+
+
+def _read_member(f, compression):
+    """ Decompress a single member starting at the current file position """
+    if compression == 'gzip':
+        decompressor = zlib.decompressobj(wbits=31)
+    else:
+        decompressor = lzma.LZMADecompressor()
+    chunks = []
+    while not decompressor.eof:
+        data = f.read(64 * 1024)
+        if not data:
+            break
+        chunks.append(decompressor.decompress(data))
+    return b''.join(chunks)
+
+
+class SegmentReader(object):
+    """ Read results written by a SegmentStore
+
+    Parameters
+    ----------
+    out_dir : directory containing the segment files
+    """
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        self._index = None
+
+    def segments(self):
+        """ Return (hour, path, compression) for every segment, oldest first
+        """
+        found = []
+        for compression, ext in EXTENSIONS.items():
+            for path in glob.glob(join(self.out_dir, '*' + ext)):
+                name = os.path.basename(path)
+                found.append((name[:-len(ext)], path, compression))
+        return sorted(found)
+
+    def load_index(self):
+        """ Read every sidecar index into memory
+
+        Returns
+        -------
+        index : dict mapping (dt, id) as strings to
+            (path, compression, offset, line) of the latest result
+        """
+        index = {}
+        for hour, path, compression in self.segments():
+            idx_path = join(self.out_dir, hour + '.idx')
+            if not os.path.isfile(idx_path):
+                continue
+            with open(idx_path) as f:
+                for line in f:
+                    dt, id_val, offset, num = line.rstrip('\n').split('\t')
+                    index[(dt, id_val)] = (path, compression,
+                                           int(offset), int(num))
+        self._index = index
+        return index
+
+    def get(self, dt, id_val):
+        """ Point lookup of the latest result for a dt and id
+
+        Parameters
+        ----------
+        dt : date when the id was created
+
+        id_val : id associated with email address
+
+        Returns
+        -------
+        data : the result, or None if there is none
+        """
+        if self._index is None:
+            self.load_index()
+        entry = self._index.get((str(dt), str(id_val)))
+        if entry is None:
+            return None
+        path, compression, offset, num = entry
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            if compression is None:
+                line = f.readline()
+            else:
+                line = _read_member(f, compression).splitlines()[num]
+        return json.loads(line.decode('utf-8'))['data']
+
+    def scan(self):
+        """ Stream every result in the order written
+
+        Superseded results (such as a 202 followed by a 200) are included.
+
+        Returns
+        -------
+        record : yields tuples (dt, id, data)
+        """
+        for hour, path, compression in self.segments():
+            if compression == 'gzip':
+                f = gzip.open(path, 'rb')
+            elif compression == 'lzma':
+                f = lzma.open(path, 'rb')
+            else:
+                f = open(path, 'rb')
+            with f:
+                for line in f:
+                    record = json.loads(line.decode('utf-8'))
+                    yield record['dt'], record['id'], record['data']
+
+
+def open_store(out_dir, out_format='files', compression=None):
+    """ Create the output store for a format
+
+    Parameters
+    ----------
+    out_dir : directory to write results to
+
+    out_format : 'files' for one file per result or 'segments'
+
+    compression : segment compression, None, 'gzip' or 'lzma'
+
+    Returns
+    -------
+    store : a FileStore or SegmentStore
+    """
+    if out_format == 'files':
+        return FileStore(out_dir)
+    if out_format == 'segments':
+        return SegmentStore(out_dir, compression)
+    raise ValueError('out_format should be one of files or segments')
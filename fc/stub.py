@@ -0,0 +1,273 @@
+# standard library
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import hashlib
+import json
+import logging
+import math
+import random
+import threading
+import time
+
+logger = logging.getLogger()
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # many workers connect at once
+    request_queue_size = 1024
+
+
+def parse_latency(spec):
+    """ Parse a latency distribution
+
+    Parameters
+    ----------
+    spec : one of
+        'fixed:SECONDS'
+        'uniform:LOW:HIGH'
+        'exponential:MEAN'
+        'lognormal:MEDIAN:SIGMA'
+        a bare number is the same as fixed
+
+    Returns
+    -------
+    sample : function(rng) returning a latency in seconds
+    """
+    parts = str(spec).split(':')
+    kind, args = parts[0], [float(a) for a in parts[1:]]
+    if not args:
+        kind, args = 'fixed', [float(kind)]
+    if kind == 'fixed' and len(args) == 1:
+        return lambda rng: args[0]
+    if kind == 'uniform' and len(args) == 2:
+        return lambda rng: rng.uniform(args[0], args[1])
+    if kind == 'exponential' and len(args) == 1:
+        return lambda rng: rng.expovariate(1.0 / args[0]) if args[0] else 0.0
+    if kind == 'lognormal' and len(args) == 2:
+        return lambda rng: rng.lognormvariate(math.log(args[0]), args[1])
+    raise ValueError('latency should be fixed:S, uniform:LOW:HIGH,'
+                     ' exponential:MEAN or lognormal:MEDIAN:SIGMA')
+
+
+class StubPersonAPI(object):
+    """ Local stand-in for the Full Contact Person API (/v2/person.json)
+
+    Answers lookups the way the API does, so the scheduler, thread pool,
+    rate limiter and retry policy can be load tested without spending
+    quota:
+
+        * every response waits for a latency drawn from latency
+        * an email is answered with pending_polls 202s before its final
+          200 (or 404 for not_found_rate of emails), counted per email
+        * error_503_rate of responses are a 503 with a Retry-After header
+        * error_403_rate of responses are a 403, as for an exceeded quota
+        * calls are counted in a fixed window of period seconds and once
+          more than rate_limit are made the rest of the window is answered
+          with 403s; every response carries X-Rate-Limit-Limit,
+          X-Rate-Limit-Remaining and X-Rate-Limit-Reset for the window
+        * a request without an X-FullContact-APIKey header is a 403
+
+    Whether an email is not found and how many 202s it gets depend only on
+    the email and seed, so repeated runs see the same sequences.
+
+    Parameters
+    ----------
+    rate_limit : calls allowed per period
+
+    period : length of the rate limit window in seconds
+
+    latency : latency distribution, see parse_latency
+
+    pending_polls : number of 202s before the final response, or a tuple
+        (min, max) to draw it per email
+
+    not_found_rate : fraction of emails answered with a 404
+
+    error_503_rate : fraction of responses that are a 503
+
+    error_403_rate : fraction of responses that are a 403
+
+    retry_after : Retry-After seconds sent with a 503
+
+    seed : random seed
+    """
+    def __init__(self, rate_limit=300, period=60.0, latency=0.0,
+                 pending_polls=0, not_found_rate=0.0, error_503_rate=0.0,
+                 error_403_rate=0.0, retry_after=1, seed=0):
+        self.rate_limit = rate_limit
+        self.period = period
+        self.sample_latency = parse_latency(latency)
+        if isinstance(pending_polls, int):
+            pending_polls = (pending_polls, pending_polls)
+        self.pending_polls = pending_polls
+        self.not_found_rate = not_found_rate
+        self.error_503_rate = error_503_rate
+        self.error_403_rate = error_403_rate
+        self.retry_after = retry_after
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.polls = {}
+        self.window_start = time.monotonic()
+        self.window_calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.status_counts = {}
+        self.server = None
+
+    def _email_random(self, email):
+        # the same number for an email on every run with the same seed
+        digest = hashlib.blake2b('{}\x1f{}'.format(self.seed, email)
+                                 .encode('utf-8'), digest_size=8).digest()
+        return random.Random(int.from_bytes(digest, 'little'))
+
+    def respond(self, email, api_key):
+        """ Decide the response to one lookup
+
+        Parameters
+        ----------
+        email : the email query parameter
+
+        api_key : the X-FullContact-APIKey header, or None
+
+        Returns
+        -------
+        status_code, headers, body : body as a dict
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= self.period:
+                self.window_start = now
+                self.window_calls = 0
+            self.window_calls += 1
+            over_limit = self.window_calls > self.rate_limit
+            remaining = max(self.rate_limit - self.window_calls, 0)
+            reset = max(int(math.ceil(self.window_start + self.period - now)),
+                        0)
+            draw = self.rng.random()
+
+            if not api_key:
+                status = 403
+            elif over_limit:
+                status = 403
+            elif draw < self.error_403_rate:
+                status = 403
+            elif draw < self.error_403_rate + self.error_503_rate:
+                status = 503
+            else:
+                email_rng = self._email_random(email)
+                not_found = email_rng.random() < self.not_found_rate
+                polls = email_rng.randint(*self.pending_polls)
+                seen = self.polls.get(email, 0)
+                self.polls[email] = seen + 1
+                if seen < polls:
+                    status = 202
+                else:
+                    status = 404 if not_found else 200
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+        headers = {'X-Rate-Limit-Limit': str(self.rate_limit),
+                   'X-Rate-Limit-Remaining': str(remaining),
+                   'X-Rate-Limit-Reset': str(reset)}
+        if status == 200:
+            body = {'status': 200, 'likelihood': 0.9,
+                    'requestId': hashlib.md5(email.encode('utf-8'))
+                    .hexdigest(),
+                    'contactInfo': {'fullName': email.split('@')[0]},
+                    'emailAddresses': [{'value': email}]}
+        elif status == 202:
+            body = {'status': 202,
+                    'message': 'Queued for search. Please retry your query'
+                               ' within the next few minutes.'}
+        elif status == 404:
+            body = {'status': 404,
+                    'message': 'Searched within the past 24 hours and'
+                               ' nothing was found.'}
+        elif status == 503:
+            headers['Retry-After'] = str(self.retry_after)
+            body = {'status': 503,
+                    'message': 'Service temporarily unavailable.'}
+        else:
+            body = {'status': 403,
+                    'message': 'API Key is invalid or you have exceeded'
+                               ' your quota.'}
+        return status, headers, body
+
+    def serve(self, port=0, host='127.0.0.1'):
+        """ Serve from a background thread
+
+        Parameters
+        ----------
+        port : port to listen on, 0 picks a free port
+
+        host : address to listen on
+
+        Returns
+        -------
+        url : the Person API url to use, for PERSON_API_URL
+        """
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep-alive, as the real API
+            protocol_version = 'HTTP/1.1'
+
+            def _lookup(self):
+                parts = urlsplit(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    self.rfile.read(length)
+                if parts.path != '/v2/person.json':
+                    self.send_error(404)
+                    return
+                email = parse_qs(parts.query).get('email', [''])[0]
+
+                with stub.lock:
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight,
+                                             stub.in_flight)
+                try:
+                    time.sleep(max(stub.sample_latency(stub.rng), 0.0))
+                    status, headers, body = stub.respond(
+                        email, self.headers.get('X-FullContact-APIKey'))
+                finally:
+                    with stub.lock:
+                        stub.in_flight -= 1
+
+                content = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type',
+                                 'application/json; charset=UTF-8')
+                self.send_header('Content-Length', str(len(content)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(content)
+
+            do_GET = _lookup
+            do_POST = _lookup
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _Server((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever,
+                         name='fc-stub', daemon=True).start()
+        host, port = self.server.server_address[:2]
+        return 'http://{}:{}/v2/person.json'.format(host, port)
+
+    def shutdown(self):
+        """ Stop serving """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def stats(self):
+        """ Return the number of responses by status code and the most
+        requests in flight at once
+        """
+        with self.lock:
+            return {'status_counts': dict(self.status_counts),
+                    'requests': sum(self.status_counts.values()),
+                    'max_in_flight': self.max_in_flight}
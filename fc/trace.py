@@ -0,0 +1,260 @@
+# standard library
+from collections import defaultdict
+import contextlib
+import json
+import logging
+import math
+import sys
+import threading
+import time
+
+logger = logging.getLogger()
+
+STAGES = ('scheduled', 'backoff', 'queue', 'pool', 'http', 'write', 'cache')
+
+class Tracer(object):
+    """ Append the spans of each lookup's lifecycle to a trace file
+
+    Each lookup is followed through the pipeline by the count it was given
+    when first queued, with a span for each stage:
+
+        scheduled : put on the queue by main.py until it was first due
+        backoff : a response such as a 202 until the retry was due
+        queue : due until submitted, including waiting on the rate limiter
+        pool : submitted until a worker thread picked it up
+        http : the Person API request
+        write : handling the response, writing it and requeueing any retry
+        cache : writing a response found in the response cache
+
+    Spans are written as newline delimited json, see report.  Safe to
+    share between threads.  Spans are buffered by the file object
+    and flushed on close.
+
+    Parameters
+    ----------
+    path : full path to the trace file
+
+    file_mode : 'w' to start a new trace or 'a' to add to one
+    """
+    def __init__(self, path, file_mode='w'):
+        self.path = path
+        self.lock = threading.Lock()
+        self.f = open(path, file_mode)
+        self.encode = json.JSONEncoder(separators=(',', ':')).encode
+
+    def span(self, count, stage, start, end, attempt=0):
+        """ Record one span
+
+        Parameters
+        ----------
+        count : the count from the original placement in the queue
+
+        stage : one of STAGES
+
+        start, end : times as from time.time()
+
+        attempt : number of earlier responses for the email
+
+        Returns
+        -------
+        null
+        """
+        line = self.encode({'c': count, 's': stage, 'a': attempt,
+                            't0': round(start, 6), 't1': round(end, 6)})
+        with self.lock:
+            self.f.write(line + '\n')
+
+    def close(self):
+        with self.lock:
+            self.f.close()
+
+
+_tracer = None
+
+def start_tracing(path, file_mode='w'):
+    """ Record spans to path for the rest of the process, see Tracer """
+    global _tracer
+    _tracer = Tracer(path, file_mode)
+    return _tracer
+
+
+def stop_tracing():
+    """ Stop recording spans and close the trace file """
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        tracer.close()
+
+
+def span(count, stage, start, end, attempt=0):
+    """ Record a span if tracing has been started """
+    tracer = _tracer
+    if tracer is not None:
+        tracer.span(count, stage, start, end, attempt)
+
+
+@contextlib.contextmanager
+def timed(count, stage, attempt=0):
+    """ Record the span of a block if tracing has been started """
+    if _tracer is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        span(count, stage, start, time.time(), attempt)
+
+
+def run_traced(submit_time, count, attempt, func, *args):
+    """ Call func(*args) from a pool worker, recording how long the item
+    waited for the worker as the pool span
+    """
+    span(count, 'pool', submit_time, time.time(), attempt)
+    return func(*args)
+
+
+def tracing():
+    """ Return True if spans are being recorded """
+    return _tracer is not None
+
+
+def read_spans(path):
+    """ Group the spans of a trace file by email
+
+    Parameters
+    ----------
+    path : full path to the trace file
+
+    Returns
+    -------
+    spans : dict mapping count to a list of (stage, start, end, attempt)
+    """
+    spans = defaultdict(list)
+    with open(path) as f:
+        for line in f:
+            try:
+                s = json.loads(line)
+            except ValueError:
+                continue
+            spans[s['c']].append((s['s'], s['t0'], s['t1'], s['a']))
+    return spans
+
+
+def percentile(values, p):
+    """ Nearest rank percentile of a sorted list """
+    if not values:
+        return float('nan')
+    rank = max(int(math.ceil(p / 100.0 * len(values))), 1)
+    return values[min(rank, len(values)) - 1]
+
+
+def summarize(spans):
+    """ End-to-end latency and time per stage over every traced email
+
+    Parameters
+    ----------
+    spans : the output of read_spans
+
+    Returns
+    -------
+    summary : dict with
+        latency : sorted end-to-end seconds per email, first span start to
+            last span end
+        stages : dict mapping stage to sorted total seconds per email that
+            went through the stage
+        share : dict mapping stage to its fraction of all time spent
+        tail_share : share over the emails at or above the p95 latency
+    """
+    latency = []
+    per_email = []
+    for email_spans in spans.values():
+        start = min(s[1] for s in email_spans)
+        end = max(s[2] for s in email_spans)
+        latency.append(end - start)
+        totals = defaultdict(float)
+        for stage, t0, t1, _ in email_spans:
+            totals[stage] += max(t1 - t0, 0.0)
+        per_email.append((end - start, totals))
+
+    def share_of(emails):
+        totals = defaultdict(float)
+        for _, email_totals in emails:
+            for stage, seconds in email_totals.items():
+                totals[stage] += seconds
+        overall = sum(totals.values()) or 1.0
+        return {stage: seconds / overall for stage, seconds in totals.items()}
+
+    stages = defaultdict(list)
+    for _, totals in per_email:
+        for stage, seconds in totals.items():
+            stages[stage].append(seconds)
+
+    latency.sort()
+    p95 = percentile(latency, 95)
+    return {'latency': latency,
+            'stages': {stage: sorted(v) for stage, v in stages.items()},
+            'share': share_of(per_email),
+            'tail_share': share_of([e for e in per_email if e[0] >= p95])}
+
+
+def report(path, out=None):
+    """ Print the critical path report for a trace file
+
+    Prints p50, p95 and p99 end-to-end latency, the same for the time each
+    email spent in each stage, and each stage's share of all time spent,
+    overall and for the slowest 5% of emails, and the stage taking the
+    most time other than the scheduled start delay.  Run it with
+
+        python -m fc.trace data/trace.jsonl
+
+    Parameters
+    ----------
+    path : full path to the trace file
+
+    out : file to print to, defaults to stdout
+
+    Returns
+    -------
+    summary : the output of summarize
+    """
+    out = out if out is not None else sys.stdout
+    summary = summarize(read_spans(path))
+    latency = summary['latency']
+    if not latency:
+        print('no spans in {}'.format(path), file=out)
+        return summary
+
+    print('{} emails traced'.format(len(latency)), file=out)
+    print('end-to-end  p50 {:9.3f}s  p95 {:9.3f}s  p99 {:9.3f}s'.format(
+        percentile(latency, 50), percentile(latency, 95),
+        percentile(latency, 99)), file=out)
+    print('', file=out)
+    print('{:<10} {:>8} {:>10} {:>10} {:>10} {:>7} {:>7}'.format(
+        'stage', 'emails', 'p50', 'p95', 'p99', 'share', 'p95+'), file=out)
+    order = [s for s in STAGES if s in summary['stages']] + \
+            sorted(set(summary['stages']) - set(STAGES))
+    for stage in order:
+        values = summary['stages'][stage]
+        print('{:<10} {:>8} {:>9.3f}s {:>9.3f}s {:>9.3f}s {:>6.1%} {:>6.1%}'
+              .format(stage, len(values), percentile(values, 50),
+                      percentile(values, 95), percentile(values, 99),
+                      summary['share'].get(stage, 0.0),
+                      summary['tail_share'].get(stage, 0.0)), file=out)
+    print('', file=out)
+    # the delay main.py puts before the first lookup is not a bottleneck
+    def dominant(share):
+        stages = [s for s in share if s != 'scheduled'] or list(share)
+        return max(stages, key=share.get)
+    overall = dominant(summary['share'])
+    tail = dominant(summary['tail_share'])
+    print('dominant stage: {} ({:.1%} of time), slowest 5%: {} ({:.1%})'
+          .format(overall, summary['share'][overall], tail,
+                  summary['tail_share'][tail]), file=out)
+    return summary
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.exit('usage: python -m fc.trace data/trace.jsonl')
+    report(sys.argv[1])
@@ -6,19 +6,31 @@ import os
 import random
 import time
 
+# local modules
+from fc.dedupe import (EMAILS_DEDUPED,
+                       anti_join,
+                       counted,
+                       unique)
+import fc.metrics as metrics
+
 logger = logging.getLogger()
 
+WRITE_SECONDS = metrics.histogram(
+    'fc_write_seconds', 'Seconds writing output', ['stage'])
+
 def compare_namedtuples(items_base, items_compare, dedupe):
     """ Return named tuples in a base list against a comparison list
 
     Comparison is based on elements of the parameter dedupe
 
-    This function is too clever >:-(
+    The comparison list is hashed once into a set of keys so that each item
+    in the base list is checked in constant time (see fc.dedupe.anti_join).
 
     Parameters
     ----------
-    items_base : list containing named tuples that is to be deduped
+    items_base : iterable containing named tuples that is to be deduped
         assumes items_base has already been deduped
+        may be any iterator, as with fc.dedupe.anti_join
 
     items_compare: list containing named tuples to be compared against
 
@@ -29,54 +41,10 @@ def compare_namedtuples(items_base, items_compare, dedupe):
     -------
     output : a filtered list of named tuples
     """
-    # exec and metaprogramming hacks to dynamically create code
-    # assuming the parameter dedupe is the tuple ('a', 'b', 'c')
-    #   then the resulting strings would become
-    #       dedupe_code ==> (item.a, item.b, item.c)
-    #       append_code ==> items_compare_sub.append((item.a, item.b, item.c))
-    #       item_code ==> _item = (item.a, item.b, item.c)
-    for i, d in enumerate(dedupe):
-        if i == 0:
-            dedupe_code = '(item.{}'.format(d)
-            item_code = '_item = (item.{}'.format(d)
-        elif i > 0:
-            dedupe_code += ', item.{}'.format(d)
-            item_code += ', item.{}'.format(d)
-
-    dedupe_code += ')'
-    item_code += ')'
-
-    append_code = 'items_compare_sub.append({})'.format(dedupe_code)
-
-    # convert the items_compare list to just a list of tuples
-    #   based on the elements of the parameter dedupe
-    # assuming the parameter dedupe is the tuple ('a', 'b', 'c')
-    #   then the code that is to be executed would be
-    #       items_compare_sub.append((item.a, item.b, item.c))
-    items_compare_sub = []
-    for item in items_compare:
-        loc = locals()
-        glb = { }
-        exec(append_code, glb, loc)
-
-    # compare items in items_base against items_compare_sub
-    # the comparison is just based on a subset of the tuple elements
-    #   in the named tuple
-    # assuming the parameter dedupe is the tuple ('a', 'b', 'c')
-    #   then the code that is to be executed would be
-    #       _item = (item.a, item.b, item.c)
-    # the tuple _item is compared against the tuples within items_compare_sub
-    # if there is not a match, then the original named tuple is written to
-    #   the list named output
-    output = []
-    for item in items_base:
-        loc = locals()  # metaprogramming hack
-        glb = { }  # metaprogramming hack
-        exec(item_code, glb, loc)  # metaprogramming hack
-        _item = loc['_item']  # tuple with just the elements of dedupe
-        if _item not in items_compare_sub:
-            output.append(item)
-
+    num_base = [0]
+    output = list(anti_join(counted(items_base, num_base), items_compare,
+                            dedupe))
+    EMAILS_DEDUPED.labels(stage='history').inc(num_base[0] - len(output))
     return output
 
 
@@ -162,6 +130,11 @@ def random_lines(file_path, num_lines):
 def read_json_as_namedtuple(file_path, nt):
     """ Read a file of newline delimited json into a list of named tuples
 
+    The file is streamed a line at a time and the named tuple class is
+    created once for each distinct set of keys (normally once per file)
+    rather than once per line.  For Email history files see
+    fc.records.EmailFile, which is bound to the Email schema and is faster.
+
     Parameters
     ----------
     file_path : full path to the file to write as json
@@ -172,14 +145,18 @@ def read_json_as_namedtuple(file_path, nt):
     -------
     list_nt : a list of named tuples
     """
+    classes = {}
+    list_nt = []
     with open(file_path, 'r') as f:
-        items_json = f.read().splitlines()
-
-        list_nt = []
-        for item in items_json:
-            item_nt = json.loads(item,
-                object_hook=lambda d: namedtuple(nt, d.keys())(*d.values()))
-            list_nt.append(item_nt)
+        for line in f:
+            if not line.strip():
+                continue
+            d = json.loads(line)
+            keys = tuple(d)
+            cls = classes.get(keys)
+            if cls is None:
+                cls = classes[keys] = namedtuple(nt, keys)
+            list_nt.append(cls._make(d.values()))
     return list_nt
 
 
@@ -206,7 +183,7 @@ def unique_namedtuples(items, dedupe):
 
     Comparison is based on elements of the parameter dedupe
 
-    This function is too clever >:-(
+    The first named tuple seen for each key is kept (see fc.dedupe.unique).
 
     For instance, for a list with the named tuples
 
@@ -235,50 +212,10 @@ def unique_namedtuples(items, dedupe):
     -------
     output : a filtered list of named tuples
     """
-    seen = set()
-    output = []
-
-    # exec and metaprogramming hacks to dynamically create code
-    # assuming the parameter dedupe is the tuple ('a', 'b', 'c')
-    #   then the resulting strings would become
-    #       dedupe_code ==> (item.a, item.b, item.c)
-    #       seen_code ==> seen.add((item.a, item.b, item.c))
-    #       item_code ==> _item = (item.a, item.b, item.c)
-    for i, d in enumerate(dedupe):
-        if i == 0:
-            dedupe_code = '(item.{}'.format(d)
-            item_code = '_item = (item.{}'.format(d)
-        elif i > 0:
-            dedupe_code += ', item.{}'.format(d)
-            item_code += ', item.{}'.format(d)
-
-    dedupe_code += ')'
-    item_code += ')'
-
-    seen_code = 'seen.add({})'.format(dedupe_code)
-
-    # the comparison is just based on a subset of the tuple elements
-    #   in the named tuple
-    # assuming the parameter dedupe is the tuple ('a', 'b', 'c')
-    #   then the code that is to be executed would be
-    #       _item = (item.a, item.b, item.c)
-    # the tuple _item is compared against what has been seen before
-    # if there is not a match, then the original named tuple is written to
-    #   the list named output
-    for item in items:
-        loc = locals()  # metaprogramming hack
-        glb = { }  # metaprogramming hack
-        exec(item_code, glb, loc)  # metaprogramming hack
-        _item = loc['_item']  # tuple with just the elements of dedupe
-        if _item not in seen:
-            loc = locals()  # metaprogramming hack
-            glb = { }  # metaprogramming hack
-            exec(seen_code, glb, loc)  # metaprogramming hack
-            output.append(item)
-    return output
+    return list(unique(items, dedupe))
 
 
-def write_json(json_data, json_path):
+def write_json(json_data, json_path, fsync=False):
     """ Write JSON content within a requests object to a file
 
     Parameters
@@ -287,13 +224,19 @@ def write_json(json_data, json_path):
 
     json_path : full path to the json file
 
+    fsync : if True, wait for the file to reach the disk
+
     Returns
     -------
     null
     """
-    with open(json_path, 'w') as j:
+    with WRITE_SECONDS.labels(stage='json').time(), \
+            open(json_path, 'w') as j:
         json.dump(json_data, j)
         j.write('\n')
+        if fsync:
+            j.flush()
+            os.fsync(j.fileno())
 
 
 def write_namedtuple_as_json(file_path, list_nt, file_mode):
@@ -311,7 +254,7 @@ def write_namedtuple_as_json(file_path, list_nt, file_mode):
     -------
     null
     """
-    with open(file_path, file_mode) as f:
-        for nt in list_nt:
-            json.dump(nt._asdict(), f)
-            f.write('\n')
+    encode = json.JSONEncoder().encode
+    with WRITE_SECONDS.labels(stage='json').time(), \
+            open(file_path, file_mode) as f:
+        f.writelines(encode(nt._asdict()) + '\n' for nt in list_nt)
@@ -0,0 +1,200 @@
+# standard library
+import logging
+import queue
+import threading
+import time
+
+# local modules
+import fc.utils as utils
+
+logger = logging.getLogger()
+
+# put on the queue by close to tell the writer thread to drain and exit
+_STOP = object()
+
+class _Callback(object):
+    """ Queued by after_written, called once the results before it are
+    written """
+    __slots__ = ('func', 'args')
+
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+
+
+class BatchWriter(object):
+    """ Write results to a store from a dedicated background thread
+
+    HTTP workers call put, which only hands the result to a bounded queue.
+    The writer thread coalesces whatever is queued into batches and writes
+    each batch with a single store.put_many call, so workers never wait on
+    the (network mounted) disk unless the queue is full.
+
+    A batch is written once it reaches batch_size results or once
+    flush_interval seconds have passed since its first result.  A batch
+    that cannot be written is tried retries more times, a second apart,
+    and then left unwritten: the callbacks waiting on it (see after_written)
+    are never called and close raises the error.
+
+    Parameters
+    ----------
+    store : a store.FileStore or store.SegmentStore
+
+    maxsize : maximum number of results waiting to be written
+        put blocks when the queue is full, which bounds memory
+
+    batch_size : maximum number of results per write
+
+    flush_interval : maximum number of seconds a result waits to be written
+
+    fsync : 'never' leaves flushing to the operating system, 'batch' calls
+        fsync after every batch
+
+    retries : number of times a failed write is tried again
+    """
+    def __init__(self, store, maxsize=10000, batch_size=500,
+                 flush_interval=1.0, fsync='never', retries=3):
+        if fsync not in ('never', 'batch'):
+            raise ValueError('fsync should be one of never or batch')
+        self.store = store
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync == 'batch'
+        self.retries = retries
+        self.q = queue.Queue(maxsize)
+        self.num_written = 0
+        self.num_batches = 0
+        self.num_failed = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name='fc-writer',
+                                       daemon=True)
+        self.thread.start()
+
+    def put(self, dt, id_val, data):
+        """ Queue one result to be written
+
+        Parameters
+        ----------
+        dt : date when the id was created
+
+        id_val : id associated with email address
+
+        data : result to write
+
+        Returns
+        -------
+        null
+        """
+        self.q.put((dt, id_val, data))
+
+    def put_many(self, records):
+        """ Queue a batch of (dt, id, data) results to be written """
+        for record in records:
+            self.q.put(record)
+
+    def after_written(self, func, *args):
+        """ Call func(*args) from the writer thread once every result queued
+        so far has been written
+
+        Parameters
+        ----------
+        func : function to call, such as TimerQueue.completed
+
+        args : arguments for func
+
+        Returns
+        -------
+        null
+        """
+        self.q.put(_Callback(func, args))
+
+    def _write(self, batch):
+        records = [item for item in batch if not isinstance(item, _Callback)]
+        attempt = 0
+        while records:
+            try:
+                with utils.WRITE_SECONDS.labels(stage='batch').time():
+                    self.store.put_many(records, fsync=self.fsync)
+                break
+            except Exception as e:
+                attempt += 1
+                if attempt > self.retries:
+                    logger.exception(('Writer | failed to write a batch of'
+                                      ' {_n} results, leaving them'
+                                      ' unfinished').format(_n=len(records)))
+                    self.num_failed += len(records)
+                    self.error = e
+                    return
+                logger.info(('Writer | failed to write a batch of {_n}'
+                             ' results: {_err!r} | trying again')
+                            .format(_n=len(records), _err=e))
+                time.sleep(1.0)
+        if records:
+            self.num_written += len(records)
+            self.num_batches += 1
+
+        for item in batch:
+            if isinstance(item, _Callback):
+                try:
+                    item.func(*item.args)
+                except Exception:
+                    logger.exception('Writer | callback failed')
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self.q.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        item = self.q.get(timeout=remaining)
+                    else:
+                        item = self.q.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._write(batch)
+
+    def close(self):
+        """ Write everything still queued, stop the thread and close the
+        store
+
+        Raises the last write error if any batch could not be written.
+        """
+        self.q.put(_STOP)
+        self.thread.join()
+        self.store.close()
+        logger.info('Writer | wrote {_n} results in {_b} batches'
+                    .format(_n=self.num_written, _b=self.num_batches))
+        if self.error is not None:
+            raise IOError('{} results could not be written'
+                          .format(self.num_failed)) from self.error
+
+
+def after_written(out_store, func, *args):
+    """ Call func(*args) once everything put on a store so far is written
+
+    Parameters
+    ----------
+    out_store : a BatchWriter, or a store whose put writes immediately
+
+    func : function to call
+
+    args : arguments for func
+
+    Returns
+    -------
+    null
+    """
+    if isinstance(out_store, BatchWriter):
+        out_store.after_written(func, *args)
+    else:
+        func(*args)
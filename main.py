@@ -1,30 +1,69 @@
 #!/usr/bin/env python
 
 # standard lib
-from concurrent.futures import ThreadPoolExecutor
 from os import remove
 from os.path import dirname, isfile, join, realpath
+import argparse
 import datetime
+import functools
 import logging
-import queue
 import time
 
 # global vars
-from fc import (MAX_WORKERS,
+from fc import (DAEMON_OVERLAP,
+                DAEMON_POLL_INTERVAL,
+                JOURNAL_COMPACT_EVERY,
+                JOURNAL_FILE,
+                JOURNAL_FSYNC,
+                METRICS,
+                METRICS_FILE,
+                METRICS_PORT,
+                PARTITION_CACHE,
+                PARTITION_DIR,
+                PARTITION_KEEP_DAYS,
                 RATE_LIMIT,
                 RATE_LIMIT_REMAINING,
                 REPROCESS,
                 SEED,
-                TEST_FLAG)
+                SEEN_BLOOM,
+                SEEN_BLOOM_CAPACITY,
+                SEEN_BLOOM_FILE,
+                SEEN_BLOOM_FP_RATE,
+                SEEN_BLOOM_SAVE_INTERVAL,
+                TEST_FLAG,
+                TRACE,
+                TRACE_FILE)
 
 # local modules
+import fc.bloom as bloom
+import fc.daemon as daemon
 import fc.emails as emails
+import fc.journal as journal
+import fc.metrics as metrics
+import fc.partitions as partitions
 import fc.person as person
+import fc.ratelimit as ratelimit
+import fc.records as records
 import fc.scheduler as scheduler
+import fc.seen as seen
+import fc.trace as trace
 import fc.utils as utils
 
 if __name__ == '__main__':
 
+    ###
+    # arguments
+    ###
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--resume', action='store_true',
+                        help='only finish the lookups left in the queue'
+                             ' journal by a run that died')
+    parser.add_argument('--daemon', action='store_true',
+                        help='keep running, polling the database for new'
+                             ' emails every DAEMON_POLL_INTERVAL seconds')
+    args = parser.parse_args()
+
     ###
     # datetimes
     ###
@@ -57,144 +96,219 @@ if __name__ == '__main__':
     logger.info('Begin | process all apps from {_prev} to {_current}'
         .format(_prev=start_prev_hr, _current=start_current_hr))
 
-    ###
-    # emails
-    ###
-
-    # when pulling emails, they come back as a list of named tuples
-    # [(id1, dt1, email1), (id2, dt2, email2)]
-
     # setup file paths
     script_dir = dirname(realpath(__file__))
     local_data_dir = join(script_dir, 'data')
-    emails_10_days_file = join(local_data_dir, 'emails_10_days.json')
+    seen_db_file = join(local_data_dir, 'seen.db')
     emails_to_process_file = join(local_data_dir, 'emails_to_process.json')
 
-    # remove data files if reprocessing
-    if REPROCESS:
-        if isfile(emails_10_days_file):
-            remove(emails_10_days_file)
-        if isfile(emails_to_process_file):
-            remove(emails_to_process_file)
-
-    # does the data need to be seeded?
-    # if so, then we will not check for dupes within the last 10 days
-    #   but instead will check dupes against what we have already processed
-    # after 10 days then we will revert back to checking dupes within the last
-    #   10 days as a form of caching
-
-    # get unique emails seen in the last hour
-    emails_hr_unique = emails.get_unique_emails(start_prev_hr,
-                                                start_current_hr)
-    # seed data
-    if SEED:
-        # if have processed files prior
-        if isfile(emails_to_process_file):
-            emails_processed = \
-                    utils.read_json_as_namedtuple(emails_to_process_file,
-                                                  'Emails')
-
-            # dedupe the emails in the last hour against what we have seen
-            #   in the past
-            # the final list is that which will be used for query purposes
-            emails_to_process = utils.compare_namedtuples(emails_hr_unique,
-                                                          emails_processed,
-                                                          ('id', 'email'))
-        # if have never processed files before
-        else:
-            emails_to_process = emails_hr_unique
+    # Bloom filter in front of the seen index
+    seen_bloom = None
+    if SEEN_BLOOM:
+        seen_bloom = bloom.DailyBloomFilter(SEEN_BLOOM_FILE,
+                                            SEEN_BLOOM_CAPACITY,
+                                            SEEN_BLOOM_FP_RATE)
 
-        utils.write_namedtuple_as_json(emails_to_process_file,
-                                       emails_to_process, 'a')
-    # no need to continue seeding data
+    # journal of the lookup queue, holding any lookups left unfinished
+    #   by an earlier run
+    queue_journal = None
+    if not TEST_FLAG:
+        queue_journal = journal.Journal(JOURNAL_FILE, JOURNAL_COMPACT_EVERY,
+                                        JOURNAL_FSYNC)
+        logger.info('Journal | {_n} unfinished lookups from an earlier run'
+                    .format(_n=len(queue_journal.pending)))
+
+    if args.resume or args.daemon:
+        # only finish the lookups in the journal
+        # the hour was already extracted and deduped by the run that died
+        # the daemon polls for emails itself
+        emails = []
     else:
-        # if just completed seeding the data then emails_10_days.json has
-        #   not been created
-        if isfile(emails_10_days_file):
-            # if first hour of the day then write out all email addresses
-            #   seen in the last 10 days
-            # only need to run this once a day
-            # will append emails seen over the course of the day to this list
-            if start_current_hr.hour == 1:
-                emails_10_days = emails.get_unique_emails(prev_10_days,
-                                                          start_today)
-                # write the named tuples to disk as json
-                utils.write_namedtuple_as_json(emails_10_days_file,
-                                               emails_10_days, 'w')
+        ###
+        # emails
+        ###
+
+        # when pulling emails, they come back as a list of named tuples
+        # [(id1, dt1, email1), (id2, dt2, email2)]
+
+        # remove data files if reprocessing
+        if REPROCESS:
+            if isfile(seen_db_file):
+                remove(seen_db_file)
+            if isfile(emails_to_process_file):
+                remove(emails_to_process_file)
+            if isfile(emails_to_process_file + '.bin'):
+                remove(emails_to_process_file + '.bin')
+            # the seen index is rebuilt from the database, not from
+            #   partitions extracted before the reprocessing
+            if PARTITION_CACHE:
+                partitions.delete_partitions(PARTITION_DIR, prev_10_days,
+                                             start_current_hr)
+
+        # does the data need to be seeded?
+        # if so, then we will not check for dupes within the last 10 days
+        #   but instead will check dupes against what we have already processed
+        # after 10 days then we will revert back to checking dupes within the last
+        #   10 days as a form of caching
+
+        # get unique emails seen in the last hour
+        emails_hr_unique = emails.get_unique_emails(start_prev_hr,
+                                                    start_current_hr)
+        # seed data
+        if SEED:
+            # if have processed files prior
+            if isfile(emails_to_process_file):
+                emails_processed = \
+                        records.EmailFile(emails_to_process_file).read()
+
+                # dedupe the emails in the last hour against what we have seen
+                #   in the past
+                # the final list is that which will be used for query purposes
+                emails_to_process = utils.compare_namedtuples(emails_hr_unique,
+                                                              emails_processed,
+                                                              ('id', 'email'))
+            # if have never processed files before
             else:
-                # read the json in as a list of named tuples
-                emails_10_days = \
-                        utils.read_json_as_namedtuple(emails_10_days_file,
-                                                      'Emails')
-        # create the emails_10_days.json file
+                emails_to_process = emails_hr_unique
+
+            records.EmailFile(emails_to_process_file).write(
+                emails_to_process, 'a')
+        # no need to continue seeding data
         else:
-            emails_10_days = emails.get_unique_emails(prev_10_days,
-                                                      start_today)
-            # write the named tuples to disk as json
-            utils.write_namedtuple_as_json(emails_10_days_file,
-                                           emails_10_days, 'w')
-
-        # add emails seen since the beginning of the day until the start hour
-        emails_today = emails.get_unique_emails(start_today, start_prev_hr)
-        emails_10_days += emails_today
-
-        # dedupe the emails in the last hour against what we have seen
-        #   the last 10 days and against what we have seen today up to now
-        # the final list is that which will be used for query purposes
-        emails_to_process = utils.compare_namedtuples(emails_hr_unique,
-                                                      emails_10_days,
-                                                      ('id', 'email'))
-        # write to the file (overwrite)
-        utils.write_namedtuple_as_json(emails_to_process_file,
-                                       emails_to_process,
-                                       'w')
-
-    if TEST_FLAG:
-        from random import sample
-        # for testing, get 10 random Email named tuples
-        emails = [k for k in sample(emails_to_process, 10)]
-
-        # make sure we always have at least one 200
-        from collections import namedtuple
-        Email = namedtuple('Email', ['id', 'dt', 'email'])
-        emails.append(Email('000', '2016-01-01 00:00:00',
-                            'bart@fullcontact.com'))
-    else:
-        emails = emails_to_process
+            with seen.SeenIndex(seen_db_file, seen_bloom,
+                                SEEN_BLOOM_SAVE_INTERVAL) as seen_index:
+                # drop emails that have not been seen within the last 10 days
+                seen_index.expire(prev_10_days)
+
+                # load any hours that the index has not seen yet
+                # on the first run (or after reprocessing) this is the full
+                #   10 days, otherwise it is usually nothing
+                loaded_through = seen_index.get_loaded_through()
+                if loaded_through is None or loaded_through < prev_10_days:
+                    loaded_through = prev_10_days
+                if loaded_through < start_prev_hr:
+                    seen_index.add(emails.get_unique_emails(loaded_through,
+                                                            start_prev_hr))
+
+                # dedupe the emails in the last hour against what we have seen
+                #   the last 10 days and against what we have seen today up to now
+                # the final list is that which will be used for query purposes
+                emails_to_process = list(
+                    seen_index.filter_unseen(emails_hr_unique))
+
+                # the last hour is now part of the history
+                seen_index.add(emails_hr_unique)
+                seen_index.set_loaded_through(start_current_hr)
+
+            # write to the file (overwrite)
+            records.EmailFile(emails_to_process_file).write(
+                emails_to_process, 'w')
+
+        if TEST_FLAG:
+            from random import sample
+            # for testing, get 10 random Email named tuples
+            emails = [k for k in sample(emails_to_process, 10)]
+
+            # make sure we always have at least one 200
+            from collections import namedtuple
+            Email = namedtuple('Email', ['id', 'dt', 'email'])
+            emails.append(Email('000', '2016-01-01 00:00:00',
+                                'bart@fullcontact.com'))
+        else:
+            emails = emails_to_process
 
     ###
     # setup and process queue
     ###
 
-    # create an instance of a priority queue
-    q = queue.PriorityQueue()
-
-    # create a thread pool
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
-
-        # wait __ seconds before starting so that the entire
-        #   queue can be built up
-        execute_time = time.time() + 10
-
-        # add to queue
-        for i, email in enumerate(emails):
-            logger.info(('Queue | email: {_email}  id: {_id}'
-                        ' | add {_email} to the queue')
-                    .format(_email=email.email, _id=email.id))
-            q.put((execute_time, i, email.id,
-                   email.dt, email.email))
-            # update execute_time by __ seconds
-            if TEST_FLAG:
-                execute_time += 2
-            else:
-                # subtracting 100 gives 0.1 seconds of padding
-                execute_time += (RATE_LIMIT_REMAINING/(RATE_LIMIT-100))
+    # create an instance of a priority queue that wakes when items are due
+    q = scheduler.TimerQueue()
+
+    # rebuild the unfinished lookups, including any 202s waiting to be
+    #   polled again, with the execute time and attempts they had
+    # they are already in the journal, so it is attached afterwards
+    if queue_journal is not None:
+        for item in queue_journal.pending.values():
+            q.put(item)
+        q.journal = queue_journal
+    start_count = q.next_count()
+
+    # spans of every lookup from here on
+    if TRACE:
+        trace.start_tracing(TRACE_FILE)
+
+    # wait __ seconds before starting so that the entire
+    #   queue can be built up
+    execute_time = time.time() + 10
 
-        # process the queue
+    # add to queue
+    for i, email in enumerate(emails, start_count):
+        logger.info(('Queue | email: {_email}  id: {_id}'
+                    ' | add {_email} to the queue')
+                .format(_email=email.email, _id=email.id))
+        q.put((execute_time, i, email.id,
+               email.dt, email.email, ()))
+        trace.span(i, 'scheduled', time.time(), execute_time)
+        # update execute_time by __ seconds
+        # otherwise every email is due at once and the rate limiter
+        #   paces submissions based on the budget reported by the API
         if TEST_FLAG:
-            scheduler.process_queue(q, pool, utils.print_email)
-        else:
-            scheduler.process_queue(q, pool, person.process_one_email)
+            execute_time += 2
+
+    # shared token bucket re-synced from the X-Rate-Limit-* headers
+    limiter = ratelimit.RateLimiter(RATE_LIMIT, RATE_LIMIT_REMAINING)
+
+    # process the queue
+    if args.daemon:
+        # the seen index, database connection and HTTP connections stay
+        #   open between polls until the daemon is stopped
+        # metrics can be scraped while the daemon runs
+        metrics_server = None
+        if METRICS and METRICS_PORT is not None:
+            metrics_server = metrics.REGISTRY.serve(METRICS_PORT)
+        with seen.SeenIndex(seen_db_file, seen_bloom,
+                            SEEN_BLOOM_SAVE_INTERVAL) as seen_index:
+            service = daemon.Daemon(seen_index, q,
+                                    functools.partial(person.run_lookups,
+                                                      limiter=limiter,
+                                                      forever=True),
+                                    DAEMON_POLL_INTERVAL, DAEMON_OVERLAP)
+            service.run()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+    else:
+        # lookups from a thread pool sharing one keep-alive client, or
+        #   from a single thread with asyncio when ASYNC_ENGINE is set
+        person.run_lookups(q, limiter)
+
+    try:
+        # flush and close any open output segment
+        # raises if any batch of responses could not be written
+        person.get_store().close()
+    finally:
+        trace.stop_tracing()
+
+        # only lookups that never completed, or whose responses were not
+        #   written, are left in the journal
+        if queue_journal is not None:
+            queue_journal.close()
+
+        # run summary for the response cache
+        response_cache = person.get_response_cache()
+        if response_cache is not None:
+            response_cache.evict()
+            logger.info('Cache | ' + response_cache.summary())
+            response_cache.close()
+
+        # partitions older than the history are never read again
+        if PARTITION_CACHE:
+            partitions.expire_partitions(
+                PARTITION_DIR,
+                start_today - datetime.timedelta(days=PARTITION_KEEP_DAYS))
+
+        # metrics for the run in the Prometheus text format
+        if METRICS:
+            metrics.REGISTRY.write_textfile(METRICS_FILE)
 
     logger.info('End | process all apps from {_prev} to {_current}'
             .format(_prev=start_prev_hr, _current=start_current_hr))
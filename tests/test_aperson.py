@@ -0,0 +1,115 @@
+# standard lib
+from http.server import (BaseHTTPRequestHandler,
+                         ThreadingHTTPServer)
+import asyncio
+import json
+import socket
+import threading
+import time
+
+# third party
+import pytest
+
+# local
+import fc
+import fc.person as person
+from fc.aperson import AsyncHTTPClient, run_queue_async
+from fc.journal import Journal
+from fc.scheduler import TimerQueue
+from fc.stub import StubPersonAPI
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = '{{"path": "{}"}}'.format(self.path).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-Rate-Limit-Remaining', '59')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_async_client_keep_alive():
+    """ Concurrent requests complete and connections are reused
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    async def run():
+        url = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+        client = AsyncHTTPClient(url, max_connections=4)
+        responses = await asyncio.gather(
+            *[client.request('POST', '/p?i={}'.format(i)) for i in range(50)])
+        num_idle = len(client._idle)
+        await client.close()
+        return responses, num_idle
+
+    try:
+        responses, num_idle = asyncio.run(run())
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert [r.json()['path'] for r in responses] == \
+        ['/p?i={}'.format(i) for i in range(50)]
+    assert responses[0].headers['x-rate-limit-remaining'] == '59'
+    assert num_idle <= 4
+
+
+def test_async_client_timeout():
+    """ A server that accepts but never answers raises TimeoutError
+    """
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+
+    async def run():
+        url = 'http://127.0.0.1:{}/'.format(listener.getsockname()[1])
+        client = AsyncHTTPClient(url, timeout=0.2)
+        try:
+            await client.request('POST', '/p')
+        finally:
+            await client.close()
+
+    start = time.time()
+    try:
+        with pytest.raises(TimeoutError):
+            asyncio.run(run())
+    finally:
+        listener.close()
+    assert time.time() - start < 5
+
+
+def test_process_queue_async_waits_for_due_items(tmpdir, monkeypatch):
+    """ Items are dispatched once due without being put back on the queue
+    """
+    monkeypatch.setattr(fc, 'OUT_DIR', str(tmpdir))
+    monkeypatch.setattr(fc, 'RESPONSE_CACHE', False)
+    monkeypatch.setattr(fc, 'QUEUE_TIMEOUT', 0.5)
+    monkeypatch.setattr(person, '_store', None)
+    path = str(tmpdir.join('queue.journal'))
+    q = TimerQueue(Journal(path))
+    due = time.time() + 1.0
+    for i in range(5):
+        q.put((due, i, str(i), '2016-01-01 00:00:00',
+               'user{}@b.com'.format(i), ()))
+
+    stub = StubPersonAPI(rate_limit=100)
+    url = stub.serve()
+    try:
+        run_queue_async(q, 10, 10, url=url, api_key='key')
+    finally:
+        stub.shutdown()
+        person.get_store().close()
+
+    assert stub.stats()['status_counts'] == {200: 5}
+    with open(path) as f:
+        events = [json.loads(line)['e'] for line in f]
+    assert 'requeued' not in events
+    assert events.count('completed') == 5
@@ -0,0 +1,98 @@
+# local
+from fc.bloom import (DailyBloomFilter,
+                      bloom_key)
+from fc.records import Email
+from fc.seen import SeenIndex
+
+
+def test_daily_bloom_filter_false_positive_rate(tmpdir):
+    """ No false negatives and roughly the configured false positive rate
+    """
+    days = DailyBloomFilter(str(tmpdir.join('seen.bloom')), capacity=10000,
+                            fp_rate=0.01)
+    for i in range(10000):
+        days.add(bloom_key(i, 'a@b.com'), '2016-01-01 10:00:00')
+
+    assert all(bloom_key(i, 'a@b.com') in days for i in range(10000))
+    false_positives = sum(bloom_key(i, 'c@d.com') in days
+                          for i in range(10000))
+    assert false_positives < 200
+
+
+def test_daily_bloom_filter(tmpdir):
+    """ Days are saved, reloaded, dropped whole and share a bit once every
+    bit is taken
+    """
+    path = str(tmpdir.join('seen.bloom'))
+    days = DailyBloomFilter(path, capacity=100, fp_rate=0.01)
+    for i in range(20):
+        days.add(bloom_key(i, 'a@b.com'), '2016-01-01 10:00:00')
+    days.add(bloom_key(99, 'a@b.com'), '2016-01-02 10:00:00')
+    days.save()
+
+    days = DailyBloomFilter(path, capacity=100, fp_rate=0.01)
+    assert len(days) == 21
+    assert bloom_key(3, 'a@b.com') in days
+
+    assert days.expire('2016-01-02 00:00:00') == 1
+    assert bloom_key(3, 'a@b.com') not in days
+    assert bloom_key(99, 'a@b.com') in days
+    # built with another capacity, so ignored
+    assert len(DailyBloomFilter(path, capacity=1000)) == 0
+
+    for day in range(3, 20):
+        days.add(bloom_key(day, 'x@y.com'),
+                 '2016-01-{:02d} 00:00:00'.format(day))
+    assert len(days.days) == 16
+    assert days.expire('2016-01-19 00:00:00') == 15
+    # the 17th and 18th share the bit of the 19th, so are still held
+    assert bloom_key(17, 'x@y.com') in days
+    assert bloom_key(18, 'x@y.com') in days
+    assert bloom_key(19, 'x@y.com') in days
+
+
+def test_seen_index_with_bloom_filter(tmpdir):
+    """ The filter is built from an existing index and results match the
+    exact check
+    """
+    db_path = str(tmpdir.join('seen.db'))
+    seen_emails = [Email(i, '2016-01-01 00:00:00', 'a@b.com')
+                   for i in range(100)]
+    with SeenIndex(db_path) as seen_index:
+        seen_index.add(seen_emails)
+
+    candidates = [Email(i, '2016-01-02 00:00:00', 'a@b.com')
+                  for i in range(50, 150)]
+    days = DailyBloomFilter(str(tmpdir.join('seen.bloom')))
+    with SeenIndex(db_path, days) as seen_index:
+        assert len(days) == 100
+        assert [e.id for e in seen_index.filter_unseen(candidates)] == \
+                list(range(100, 150))
+        seen_index.add(candidates)
+        assert list(seen_index.filter_unseen(candidates)) == []
+
+
+def test_seen_index_rebuilds_stale_bloom_filter(tmpdir):
+    """ A filter that missed changes to the index is rebuilt, not trusted
+    """
+    db_path = str(tmpdir.join('seen.db'))
+    bloom_path = str(tmpdir.join('seen.bloom'))
+    first = [Email(i, '2016-01-01 00:00:00', 'a@b.com') for i in range(10)]
+    later = [Email(i, '2016-01-02 00:00:00', 'a@b.com')
+             for i in range(10, 20)]
+
+    with SeenIndex(db_path, DailyBloomFilter(bloom_path),
+                   save_interval=3600) as seen_index:
+        seen_index.add(first)
+    # a run without the filter
+    with SeenIndex(db_path) as seen_index:
+        seen_index.add(later)
+
+    days = DailyBloomFilter(bloom_path)
+    assert len(days) == 10
+    with SeenIndex(db_path, days, save_interval=3600) as seen_index:
+        assert list(seen_index.filter_unseen(first + later)) == []
+        seen_index.add([Email(99, '2016-01-02 00:00:00', 'a@b.com')])
+        # saved on close rather than on every add
+        assert len(DailyBloomFilter(bloom_path)) == 20
+    assert len(DailyBloomFilter(bloom_path)) == 21
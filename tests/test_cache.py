@@ -0,0 +1,19 @@
+# local
+from fc.cache import ResponseCache
+
+
+def test_response_cache(tmpdir):
+    """ Responses are keyed by normalized email and expire per status code
+    """
+    ttl = {200: 100, 404: 10}
+    with ResponseCache(str(tmpdir.join('responses.db')), ttl) as cache:
+        assert cache.put(' A@B.com', 200, b'{"status": 200}', fetched_at=0)
+        assert cache.put('c@d.com', 404, b'{"status": 404}', fetched_at=0)
+        assert not cache.put('e@f.com', 202, b'{"status": 202}')
+
+        assert cache.get('a@b.com ', now=50).json() == {'status': 200}
+        assert cache.get('c@d.com', now=50) is None
+        assert cache.get('e@f.com', now=50) is None
+        assert (cache.hits, cache.misses) == (1, 2)
+
+        assert cache.evict(now=50) == 1
@@ -0,0 +1,44 @@
+# standard lib
+import datetime
+
+# local
+from fc.daemon import Daemon
+from fc.emails import Email
+from fc.scheduler import TimerQueue
+from fc.seen import SeenIndex
+
+
+def test_daemon_polls_from_high_water_mark(tmpdir):
+    """ Each poll starts from the high-water mark less the overlap and only
+    queues emails that have not been seen
+    """
+    rows = [Email('1', '2016-06-03 19:00:10', 'a@x.com'),
+            Email('2', '2016-06-03 19:00:20', 'b@x.com')]
+    calls = []
+
+    def fetch(time_start, time_end):
+        calls.append((time_start, time_end))
+        return [e for e in rows if str(time_start) <= e.dt < str(time_end)]
+
+    q = TimerQueue()
+    with SeenIndex(str(tmpdir.join('seen.db'))) as seen_index:
+        seen_index.set_loaded_through(datetime.datetime(2016, 6, 3, 19))
+        service = Daemon(seen_index, q, None, overlap=60, fetch=fetch)
+
+        first = datetime.datetime(2016, 6, 3, 19, 1, 0)
+        assert service.poll(first) == 2
+
+        # a late row within the overlap is picked up, the others are not
+        #   queued again
+        rows.append(Email('3', '2016-06-03 19:00:30', 'c@x.com'))
+        second = datetime.datetime(2016, 6, 3, 19, 2, 0)
+        assert service.poll(second) == 1
+
+        assert calls[1] == (first - datetime.timedelta(seconds=60), second)
+        assert seen_index.get_high_water_mark() == second
+
+    assert q.next_count() == 3
+    assert Daemon(None, q, None).count == 3
+    assert [item[1] for item in q.get_due(timeout=0)] == [0, 1, 2]
+    assert q.next_count() == 0
+
@@ -0,0 +1,66 @@
+# standard lib
+import datetime
+
+# local
+from fc.db import (ConnectionPool,
+                   create_sqlite_table,
+                   iter_batches_split,
+                   split_range)
+from fc.emails import iter_emails
+
+
+XML = ('<ns0:some xmlns:ns0="http://custom-ns0" xmlns:ns1="http://custom-ns1"'
+       ' xmlns:ns2="http://custom-ns2"><ns1:long><ns2:xpath><ns2:email>'
+       'user{}@b.com</ns2:email></ns2:xpath></ns1:long></ns0:some>')
+
+
+def make_source(tmpdir, n):
+    """ sqlite stand-in with one row a minute from midnight, newest first
+    """
+    start = datetime.datetime(2016, 1, 1)
+    rows = [(start + datetime.timedelta(minutes=i), str(i), XML.format(i))
+            for i in reversed(range(n))]
+    return create_sqlite_table(str(tmpdir.join('dbtable.db')), rows)
+
+
+def test_split_range():
+    """ Sub-ranges are consecutive and cover the whole range """
+    start = datetime.datetime(2016, 1, 1)
+    end = datetime.datetime(2016, 1, 2)
+    ranges = split_range(start, end, 3)
+
+    assert len(ranges) == 3
+    assert ranges[0][0] == start and ranges[-1][1] == end
+    assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+
+
+def test_iter_batches_split(tmpdir):
+    """ Concurrent sub-ranges are merged back in dt order, honoring the end
+    bound
+    """
+    pool = ConnectionPool(make_source(tmpdir, 120), size=2)
+    start = datetime.datetime(2016, 1, 1)
+    end = datetime.datetime(2016, 1, 1, 1)
+
+    for end_inclusive, n in ((False, 60), (True, 61)):
+        rows = [row for batch in iter_batches_split(pool, start, end,
+                                                     end_inclusive, parts=5,
+                                                     arraysize=7)
+                for row in batch]
+        assert [row[0] for row in rows] == [str(i) for i in range(n)]
+    assert pool.num_open <= 2
+    pool.close()
+
+
+def test_iter_emails_sqlite(tmpdir):
+    """ Emails are extracted from the stand-in in dt order """
+    pool = ConnectionPool(make_source(tmpdir, 30), size=3)
+    emails = list(iter_emails(datetime.datetime(2016, 1, 1),
+                              datetime.datetime(2016, 1, 1, 0, 20),
+                              end_inclusive=False, xml_workers=0,
+                              pool=pool, parts=4))
+
+    assert [e.email for e in emails] == ['user{}@b.com'.format(i)
+                                         for i in range(20)]
+    assert emails[1].dt == '2016-01-01 00:01:00'
+    pool.close()
@@ -0,0 +1,66 @@
+# standard lib
+from collections import namedtuple
+
+# local
+from fc.dedupe import (anti_join,
+                       earliest_per_key,
+                       build_key_set,
+                       key_getter)
+
+
+Email = namedtuple('Email', ['id', 'dt', 'email'])
+
+
+def test_key_getter_single_element():
+    """ A single dedupe element still returns a tuple key
+    """
+    get_key = key_getter(('email',))
+    assert get_key(Email(1, '2016-01-01 00:00:00', 'a@b.com')) == ('a@b.com',)
+
+
+def test_anti_join_streams_iterators():
+    """ Both the base and comparison items may be one-shot iterators
+    """
+    items_base = [Email(1, '2016-01-01 00:00:00', 'a@b.com'),
+                  Email(2, '2016-01-01 00:00:00', 'c@d.com')]
+    items_compare = [Email(1, '2015-12-31 00:00:00', 'a@b.com')]
+    result = list(anti_join(iter(items_base), iter(items_compare),
+                            ('id', 'email')))
+
+    assert result == [Email(2, '2016-01-01 00:00:00', 'c@d.com')]
+
+
+def test_anti_join_prebuilt_key_set():
+    """ A prebuilt key set is used as is rather than rehashed
+    """
+    items_base = [Email(1, '2016-01-01 00:00:00', 'a@b.com'),
+                  Email(2, '2016-01-01 00:00:00', 'c@d.com')]
+    keys = build_key_set([Email(2, '2015-12-31 00:00:00', 'c@d.com')],
+                         ('id', 'email'))
+    result = list(anti_join(items_base, keys, ('id', 'email'), keys=True))
+
+    assert result == [Email(1, '2016-01-01 00:00:00', 'a@b.com')]
+
+
+def test_anti_join_set_of_named_tuples():
+    """ A set of named tuples is compared on its keys, not taken as keys
+    """
+    items_base = [Email(1, '2016-01-01 00:00:00', 'a@b.com'),
+                  Email(2, '2016-01-01 00:00:00', 'c@d.com')]
+    items_compare = {Email(2, '2015-12-31 00:00:00', 'c@d.com')}
+    result = list(anti_join(items_base, items_compare, ('id', 'email')))
+
+    assert result == [Email(1, '2016-01-01 00:00:00', 'a@b.com')]
+
+
+def test_earliest_per_key():
+    """ The earliest dt is kept per id and email regardless of input order
+    """
+    items = [Email(2, '2016-01-02 00:00:00', 'c@d.com'),
+             Email(1, '2016-01-03 00:00:00', 'a@b.com'),
+             Email(1, '2016-01-01 00:00:00', 'a@b.com'),
+             Email(1, '2016-01-02 00:00:00', 'a@b.com')]
+    result = [Email(1, '2016-01-01 00:00:00', 'a@b.com'),
+              Email(2, '2016-01-02 00:00:00', 'c@d.com')]
+
+    assert earliest_per_key(iter(items), ordered=True) == result
@@ -0,0 +1,74 @@
+# local
+from fc.extract import (extract_rows,
+                        make_email_extractor,
+                        make_pool,
+                        parallel_extract)
+
+
+NSMAP = {'a': 'http://a', 'b': 'http://b'}
+EMAIL_XPATH = '/a:root/b:person/b:email/text()'
+
+
+def test_extractors_agree():
+    """ The compiled and early exit extractors return the same email
+    """
+    xml = ('<a:root xmlns:a="http://a" xmlns:b="http://b">'
+           '<b:other><b:email>wrong@path.com</b:email></b:other>'
+           '<b:person><b:email/><b:email>a@b.com</b:email></b:person>'
+           '<b:padding/></a:root>')
+    for early_exit in (False, True):
+        extract = make_email_extractor(EMAIL_XPATH, NSMAP,
+                                       early_exit=early_exit, chunk_size=16)
+        assert extract(xml) == 'a@b.com'
+        assert extract('<a:root xmlns:a="http://a"/>') is None
+
+
+def test_parallel_extract():
+    """ Every batch is parsed by the process pool and rows without a match
+    are dropped
+    """
+    xml = ('<a:root xmlns:a="http://a" xmlns:b="http://b"><b:person>'
+           '<b:email>user{}@b.com</b:email></b:person></a:root>')
+    batches = [[(i, '2016-01-01 00:00:00', xml.format(i))
+                for i in range(j, j + 10)] for j in range(0, 100, 10)]
+    batches.append([(100, '2016-01-01 00:00:00',
+                     '<a:root xmlns:a="http://a"/>')])
+
+    results = parallel_extract(iter(batches), EMAIL_XPATH, NSMAP, workers=2)
+    expected = [(i, '2016-01-01 00:00:00', 'user{}@b.com'.format(i))
+                for i in range(100)]
+
+    assert sorted(results) == expected
+    assert list(parallel_extract(iter(batches), EMAIL_XPATH, NSMAP,
+                                 workers=2, ordered=True)) == expected
+
+    # a shared pool outlives each call
+    with make_pool(EMAIL_XPATH, NSMAP, workers=2) as pool:
+        for _ in range(2):
+            assert list(parallel_extract(iter(batches), EMAIL_XPATH, NSMAP,
+                                         workers=2, ordered=True,
+                                         pool=pool)) == expected
+
+
+def test_malformed_xml_is_skipped_and_counted():
+    """ A row that cannot be parsed is skipped rather than failing the
+    batch, in this process and in the worker processes
+    """
+    xml = ('<a:root xmlns:a="http://a" xmlns:b="http://b"><b:person>'
+           '<b:email>user{}@b.com</b:email></b:person></a:root>')
+    batches = [[(1, '2016-01-01 00:00:00', xml.format(1)),
+                (2, '2016-01-01 00:00:00', '<a>broken'),
+                (3, '2016-01-01 00:00:00', xml.format(3))]]
+    expected = [(1, '2016-01-01 00:00:00', 'user1@b.com'),
+                (3, '2016-01-01 00:00:00', 'user3@b.com')]
+
+    extract = make_email_extractor(EMAIL_XPATH, NSMAP)
+    assert extract_rows(extract, batches[0]) == (expected, 1)
+
+    parsed = []
+    assert list(parallel_extract(iter(batches), EMAIL_XPATH, NSMAP,
+                                 workers=1, ordered=True,
+                                 on_batch=lambda *a: parsed.append(a))) == \
+        expected
+    assert len(parsed) == 1
+    assert parsed[0][0] > 0 and parsed[0][1] == 1
@@ -0,0 +1,67 @@
+# standard lib
+import os
+
+# local
+from fc.journal import Journal, replay
+from fc.retry import Attempt
+from fc.scheduler import TimerQueue
+
+
+def test_journal_replay_after_crash(tmpdir):
+    """ Pending and requeued items survive, completed items and a torn
+    last line do not
+    """
+    path = str(tmpdir.join('queue.journal'))
+    q = TimerQueue(Journal(path))
+    q.put((100.0, 0, 'a', '2016-01-01', 'a@x.com', ()))
+    q.put((100.0, 1, 'b', '2016-01-01', 'b@x.com', ()))
+    q.put((100.0, 2, 'c', '2016-01-01', 'c@x.com', ()))
+    q.submitted(0)
+    q.completed(0, 200)
+    q.submitted(1)
+    q.put((130.0, 1, 'b', '2016-01-01', 'b@x.com', (Attempt(105.0, 202),)))
+    q.submitted(2)
+    # a crash partway through writing an event
+    with open(path, 'a') as f:
+        f.write('{"e":"completed","c"')
+
+    pending = replay(path)
+    assert sorted(pending) == [1, 2]
+    assert pending[1] == (130.0, 1, 'b', '2016-01-01', 'b@x.com',
+                          (Attempt(105.0, 202),))
+    assert pending[2][0] == 100.0
+
+
+def test_journal_compaction(tmpdir):
+    """ Compaction keeps one event per pending item """
+    path = str(tmpdir.join('queue.journal'))
+    journal = Journal(path, compact_every=5)
+    for i in range(4):
+        journal.put((100.0, i, str(i), '2016-01-01', 'x@x.com', ()))
+    for i in range(3):
+        journal.completed(i, 200)
+
+    with open(path) as f:
+        assert len(f.readlines()) < 7
+    journal.close()
+    with open(path) as f:
+        assert len(f.readlines()) == 1
+    assert list(Journal(path).pending) == [3]
+
+
+def test_journal_reopen_after_torn_line(tmpdir):
+    """ Events after reopening a journal with a torn last line are kept
+    """
+    path = str(tmpdir.join('queue.journal'))
+    journal = Journal(path)
+    journal.put((100.0, 1, 'a', '2016-01-01', 'a@x.com', ()))
+    with open(path, 'a') as f:
+        f.write('{"e":"completed","c"')
+
+    journal = Journal(path)
+    journal.put((100.0, 3, 'c', '2016-01-01', 'c@x.com', ()))
+    journal.put((100.0, 4, 'd', '2016-01-01', 'd@x.com', ()))
+    with open(path, 'a') as f:
+        f.write('{"e":"completed","c"')
+
+    assert sorted(replay(path)) == [1, 3, 4]
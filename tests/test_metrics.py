@@ -0,0 +1,62 @@
+# standard lib
+import os
+import urllib.request
+
+# local
+from fc.metrics import Registry
+from fc.scheduler import QUEUE_DEPTH, TimerQueue
+
+
+def test_registry_exposition(tmpdir):
+    """ Counters, gauges and histograms render in the Prometheus text
+    format, cumulatively for histogram buckets
+    """
+    registry = Registry()
+    lookups = registry.counter('lookups_total', 'Lookups', ['status'])
+    lookups.labels(status=200).inc()
+    lookups.labels('200').inc(2)
+    lookups.labels(status=404).inc()
+    depth = registry.gauge('queue_depth', 'Queue depth')
+    depth.set_function(lambda: 7)
+    latency = registry.histogram('http_seconds', 'Latency',
+                                 buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        latency.observe(value)
+
+    # registering again returns the same metric
+    assert registry.counter('lookups_total', 'Lookups', ['status']) is lookups
+
+    text = registry.exposition()
+    assert '# TYPE lookups_total counter' in text
+    assert 'lookups_total{status="200"} 3' in text
+    assert 'lookups_total{status="404"} 1' in text
+    assert 'queue_depth 7' in text
+    assert 'http_seconds_bucket{le="0.1"} 1' in text
+    assert 'http_seconds_bucket{le="1"} 2' in text
+    assert 'http_seconds_bucket{le="+Inf"} 3' in text
+    assert 'http_seconds_sum 5.55' in text
+    assert 'http_seconds_count 3' in text
+
+    path = str(tmpdir.join('metrics.prom'))
+    registry.write_textfile(path)
+    with open(path) as f:
+        assert f.read() == text
+    assert not os.path.exists(path + '.tmp')
+
+    server = registry.serve(0)
+    try:
+        url = 'http://127.0.0.1:{}/metrics'.format(server.server_address[1])
+        with urllib.request.urlopen(url) as r:
+            assert r.read().decode('utf-8') == registry.exposition()
+    finally:
+        server.shutdown()
+
+
+def test_queue_depth_gauge():
+    """ The queue depth follows puts and gets """
+    q = TimerQueue()
+    q.put((0.0, 0, 'a'))
+    q.put((0.0, 1, 'b'))
+    assert QUEUE_DEPTH.value == 2
+    q.get_due(timeout=0)
+    assert QUEUE_DEPTH.value == 0
@@ -0,0 +1,92 @@
+# standard lib
+import datetime
+
+# local
+from fc.emails import Email
+from fc.partitions import (delete_partitions,
+                           expire_partitions,
+                           iter_emails_cached,
+                           partition_path,
+                           settings_key,
+                           write_partition)
+
+
+def test_iter_emails_cached(tmpdir):
+    """ Complete hours are fetched once and then read from disk
+    """
+    fetched = []
+
+    def fetch(hr_start, hr_end):
+        fetched.append(hr_start)
+        dt = hr_start.strftime('%Y-%m-%d %H:%M:%S')
+        return [Email(hr_start.hour, dt, 'a@b.com')]
+
+    partition_dir = str(tmpdir)
+    now = datetime.datetime(2016, 1, 1, 2, 30, 0)
+    time_start = datetime.datetime(2016, 1, 1, 0, 0, 0)
+
+    first = list(iter_emails_cached(time_start, now, partition_dir, fetch,
+                                    now=now))
+    second = list(iter_emails_cached(time_start, now, partition_dir, fetch,
+                                     now=now))
+
+    assert first == second
+    assert [e.id for e in first] == [0, 1, 2]
+    # hours 0 and 1 are cached, hour 2 is incomplete and fetched each time
+    assert [hr.hour for hr in fetched] == [0, 1, 2, 2]
+
+
+def test_iter_emails_cached_grace_and_key(tmpdir):
+    """ An hour is cached only after the grace period and under the key of
+    its extraction settings, and reprocessing deletes it
+    """
+    fetched = []
+
+    def fetch(hr_start, hr_end):
+        fetched.append(hr_start.hour)
+        dt = hr_start.strftime('%Y-%m-%d %H:%M:%S')
+        return [Email(hr_start.hour, dt, 'a@b.com')]
+
+    partition_dir = str(tmpdir)
+    time_start = datetime.datetime(2016, 1, 1, 0, 0, 0)
+    time_end = datetime.datetime(2016, 1, 1, 2, 0, 0)
+    key = settings_key('/a:b/text()', {'a': 'http://a'})
+    assert key != settings_key('/a:c/text()', {'a': 'http://a'})
+
+    for minute in (5, 5, 20, 20):
+        now = datetime.datetime(2016, 1, 1, 2, minute, 0)
+        list(iter_emails_cached(time_start, time_end, partition_dir, fetch,
+                                now=now, grace=900.0, key=key))
+    # hour 1 ended less than 15 minutes before the first two runs
+    assert fetched == [0, 1, 1, 1]
+    assert tmpdir.join('2016-01-01', '01.{}.ndjson.gz'.format(key)).check()
+
+    # another xpath does not read these partitions
+    list(iter_emails_cached(time_start, time_end, partition_dir, fetch,
+                            now=now, key=settings_key('/x', {})))
+    assert fetched[4:] == [0, 1]
+
+    assert delete_partitions(partition_dir, time_start,
+                             datetime.datetime(2016, 1, 1, 1, 0, 0)) == 2
+    assert [p.basename for p in tmpdir.join('2016-01-01').listdir()
+            if p.basename.startswith('00')] == []
+
+
+def test_expire_partitions(tmpdir):
+    """ Days before the cutoff are deleted and no temporary files are left
+    """
+    partition_dir = str(tmpdir)
+    for day in (1, 2, 3):
+        hour = datetime.datetime(2016, 1, day, 5, 0, 0)
+        write_partition(partition_path(partition_dir, hour),
+                        [Email(day, '2016-01-0{} 05:00:00'.format(day),
+                               'a@b.com')])
+    tmpdir.mkdir('other')
+
+    deleted = expire_partitions(partition_dir, datetime.datetime(2016, 1, 2))
+
+    assert deleted == ['2016-01-01']
+    assert sorted(p.basename for p in tmpdir.listdir()) == \
+        ['2016-01-02', '2016-01-03', 'other']
+    assert [p.basename for p in tmpdir.join('2016-01-02').listdir()] == \
+        ['05.ndjson.gz']
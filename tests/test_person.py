@@ -0,0 +1,138 @@
+# standard lib
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import socket
+import threading
+import time
+
+# third party
+import pytest
+
+# local
+import fc
+import fc.aperson as aperson
+import fc.person as person
+import fc.scheduler as scheduler
+from fc.ratelimit import RateLimiter
+from fc.stub import StubPersonAPI
+
+
+@pytest.fixture
+def cached_stub(tmpdir, monkeypatch):
+    """ A stub API and a response cache holding 50 of 51 queued emails """
+    monkeypatch.setattr(fc, 'OUT_DIR', str(tmpdir))
+    monkeypatch.setattr(fc, 'RESPONSE_CACHE', True)
+    monkeypatch.setattr(fc, 'RESPONSE_CACHE_FILE',
+                        str(tmpdir.join('responses.db')))
+    monkeypatch.setattr(fc, 'QUEUE_TIMEOUT', 0.5)
+    monkeypatch.setattr(person, '_store', None)
+    monkeypatch.setattr(person, '_response_cache', None)
+
+    response_cache = person.get_response_cache()
+    for i in range(50):
+        response_cache.put('user{}@b.com'.format(i), 200,
+                           b'{"status":200}')
+
+    q = scheduler.TimerQueue()
+    for i in range(51):
+        q.put((time.time(), i, str(i), '2016-01-01 00:00:00',
+               'user{}@b.com'.format(i), ()))
+
+    stub = StubPersonAPI(rate_limit=100)
+    url = stub.serve()
+    yield q, stub, url
+    stub.shutdown()
+    person.get_store().close()
+    response_cache.close()
+
+
+def test_cache_hits_give_back_tokens(cached_stub):
+    """ Lookups answered from the cache leave nothing in flight """
+    q, stub, url = cached_stub
+    limiter = RateLimiter(limit=6000, period=60.0)
+    with person.PersonClient(url, api_key='key', pool_maxsize=4,
+                             limiter=limiter) as client:
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            scheduler.process_queue(q, pool, person.process_one_email,
+                                    client, limiter, timeout=0.5)
+
+    assert stub.stats()['requests'] == 1
+    assert limiter.in_flight == 0
+
+
+def test_cache_hits_give_back_tokens_async(cached_stub):
+    """ The same for the asyncio engine """
+    q, stub, url = cached_stub
+    limiter = RateLimiter(limit=6000, period=60.0)
+    aperson.run_queue_async(q, 10, 10, limiter, url, api_key='key')
+
+    assert stub.stats()['requests'] == 1
+    assert limiter.in_flight == 0
+
+
+def test_run_lookups_forever_async(cached_stub, monkeypatch):
+    """ The asyncio engine keeps waiting for new items until the queue is
+    closed, as the daemon needs
+    """
+    q, stub, url = cached_stub
+    monkeypatch.setattr(fc, 'ASYNC_ENGINE', True)
+    monkeypatch.setattr(fc, 'QUEUE_TIMEOUT', 0.0)
+    limiter = RateLimiter(limit=6000, period=60.0)
+    worker = threading.Thread(target=person.run_lookups,
+                              args=(q, limiter, url, 'key'),
+                              kwargs={'forever': True})
+    worker.start()
+
+    deadline = time.time() + 5
+    while stub.stats()['requests'] < 1 and time.time() < deadline:
+        time.sleep(0.05)
+    # still running with an empty queue
+    time.sleep(0.2)
+    assert worker.is_alive()
+    q.put((time.time(), q.next_count(), '99', '2016-01-01 00:00:00',
+           'new@b.com', ()))
+    while stub.stats()['requests'] < 2 and time.time() < deadline:
+        time.sleep(0.05)
+    q.close()
+    worker.join(5)
+
+    assert not worker.is_alive()
+    assert stub.stats()['requests'] == 2
+    assert limiter.in_flight == 0
+
+
+def test_request_timeout_is_logged(monkeypatch, caplog):
+    """ A lookup whose request times out is logged rather than lost """
+    monkeypatch.setattr(fc, 'RESPONSE_CACHE', False)
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    url = 'http://127.0.0.1:{}/'.format(listener.getsockname()[1])
+
+    limiter = RateLimiter(limit=6000, period=60.0)
+    limiter.acquire()
+    caplog.set_level(logging.INFO)
+    try:
+        with person.PersonClient(url, api_key='key', timeout=0.2,
+                                 limiter=limiter) as client:
+            person.process_one_email(scheduler.TimerQueue(), 0, '0',
+                                     '2016-01-01 00:00:00', 'a@b.com',
+                                     client=client)
+    finally:
+        listener.close()
+
+    assert 'request failed' in caplog.text
+    assert limiter.in_flight == 0
+
+
+def test_process_queue_logs_failed_lookups(caplog):
+    """ An exception raised by a lookup is logged by the scheduler """
+    def fail(*args):
+        raise RuntimeError('boom')
+
+    q = scheduler.TimerQueue()
+    q.put((time.time(), 0, '0', '2016-01-01 00:00:00', 'a@b.com', ()))
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        scheduler.process_queue(q, pool, fail, timeout=0.1)
+
+    assert "RuntimeError('boom')" in caplog.text
@@ -0,0 +1,29 @@
+# local
+from fc.ratelimit import RateLimiter
+
+
+def test_rate_limiter_syncs_from_headers():
+    """ The remaining budget less what is in flight becomes the tokens
+    """
+    limiter = RateLimiter(limit=300, period=60.0)
+    assert limiter.reserve() == 0.0
+    # the first token is gone until the first response syncs the bucket
+    assert limiter.reserve() > 0.0
+
+    limiter.update(200, {'X-Rate-Limit-Limit': '600',
+                         'X-Rate-Limit-Remaining': '3',
+                         'X-Rate-Limit-Reset': '30'})
+    assert limiter.rate == 10.0
+    assert [limiter.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.reserve() > 0.0
+
+
+def test_rate_limiter_pauses_on_quota():
+    """ A 429 empties the bucket, pauses and slows the refill rate
+    """
+    limiter = RateLimiter(limit=300, period=60.0)
+    limiter.reserve()
+    limiter.update(429, {'Retry-After': '20'})
+
+    assert limiter.rate == 2.5
+    assert 19.0 < limiter.reserve() <= 20.0
@@ -0,0 +1,62 @@
+# local
+from fc.dedupe import earliest_per_key
+from fc.records import (Email,
+                        EmailFile,
+                        EmailTable)
+from fc.utils import write_namedtuple_as_json
+
+
+def test_email_table_views():
+    """ Rows read back through views match the Email named tuples and
+    repeated values are stored once
+    """
+    emails = [Email(1, '2016-01-01 00:00:00', 'a@b.com'),
+              Email(2, '2016-01-01 00:00:00', 'a@b.com'),
+              Email(3, '2016-01-01 00:00:05', 'c@d.com')]
+    table = EmailTable(emails)
+
+    assert list(table) == emails
+    assert table[-1].email == 'c@d.com'
+    assert table.row(1) == emails[1]
+    assert table[0]._asdict() == emails[0]._asdict()
+    assert len(table.email_values) == 2
+    assert earliest_per_key(table, ('email',)) == [emails[0], emails[2]]
+
+    # views compare and hash like the named tuples
+    assert table[0] == table[0] and table[0] != table[1]
+    assert table[0] < table[1] and emails[0] < table[1] < emails[2]
+    assert set(table) == set(emails)
+    assert table[0].__eq__(5) is NotImplemented
+    assert table[0] != 5
+    # each distinct second is formatted once
+    assert table[0].dt is table[1].dt
+
+    # an id that is not an integer moves the ids to a list
+    table.append('x9', '2016-01-01 00:00:05', 'c@d.com')
+    assert table.row(3) == Email('x9', '2016-01-01 00:00:05', 'c@d.com')
+    assert table[0].id == 1
+
+
+def test_email_file(tmpdir):
+    """ Rows round trip through the json file and its sidecar, and the
+    lines match write_namedtuple_as_json
+    """
+    path = str(tmpdir.join('emails.json'))
+    emails = [Email('1', '2016-01-01 00:00:00', 'a@b.com'),
+              Email(2, '2016-01-01 00:10:00', 'c\u00e9@d.com')]
+    history = EmailFile(path)
+    history.write(emails[:1])
+    history.write(EmailTable(emails[1:]), 'a')
+
+    assert list(history) == emails
+    assert list(history.read_sidecar()) == emails
+
+    write_namedtuple_as_json(path + '.orig', emails, 'w')
+    with open(path) as f, open(path + '.orig') as g:
+        assert f.read() == g.read()
+
+    # a change to the json file makes the sidecar out of date
+    write_namedtuple_as_json(path, emails[:1], 'a')
+    assert history.read_sidecar() is None
+    assert list(history.read()) == emails + emails[:1]
+    assert list(history.read_sidecar()) == emails + emails[:1]
@@ -0,0 +1,55 @@
+# local
+from fc.retry import (Attempt,
+                      RetryPolicy,
+                      RetryRule,
+                      retry_after_seconds)
+
+
+POLICY = RetryPolicy({
+    202: RetryRule(base=5.0, factor=2.0, max_delay=30.0, max_attempts=5,
+                   jitter=0.0, retry_after=False),
+    503: RetryRule(base=30.0, factor=2.0, max_delay=600.0, max_attempts=3,
+                   jitter=0.0, retry_after=True),
+})
+
+
+def test_exponential_backoff_and_cap():
+    """ Delays double per consecutive attempt up to max_delay and stop at
+    max_attempts
+    """
+    attempts = ()
+    delays = []
+    for i in range(5):
+        attempts += (Attempt(float(i), 202),)
+        delays.append(POLICY.next_delay(202, attempts))
+
+    assert delays == [5.0, 10.0, 20.0, 30.0, None]
+
+
+def test_mixed_status_history():
+    """ Attempts with other status codes do not count towards the cap
+    """
+    attempts = tuple(Attempt(float(i), 202) for i in range(4))
+    attempts += (Attempt(4.0, 503),)
+    assert POLICY.next_delay(503, attempts) == 30.0
+    attempts += (Attempt(5.0, 503),)
+    assert POLICY.next_delay(503, attempts) == 60.0
+    attempts += (Attempt(6.0, 503),)
+    assert POLICY.next_delay(503, attempts) is None
+
+
+def test_retry_after_and_unknown_status():
+    """ Retry-After wins when allowed and other status codes never retry
+    """
+    attempts = (Attempt(0.0, 503),)
+    assert POLICY.next_delay(503, attempts, {'Retry-After': '120'}) == 120.0
+    assert POLICY.next_delay(503, attempts, {}) == 30.0
+    assert POLICY.next_delay(404, (Attempt(0.0, 404),)) is None
+
+
+def test_retry_after_http_date():
+    """ An HTTP date is converted to seconds from now
+    """
+    value = 'Thu, 01 Jan 1970 00:01:40 GMT'
+    assert retry_after_seconds(value, now=40.0) == 60.0
+    assert retry_after_seconds('soon') is None
@@ -0,0 +1,46 @@
+# standard lib
+import threading
+import time
+
+# local
+from fc.scheduler import TimerQueue
+
+
+def test_timer_queue_earlier_item_wakes_waiter():
+    """ An item due sooner than the head is returned without waiting for
+    the head
+    """
+    q = TimerQueue()
+    q.put((time.time() + 60, 0, 'late'))
+
+    def put_soon():
+        time.sleep(0.05)
+        q.put((time.time(), 1, 'early'))
+
+    threading.Thread(target=put_soon).start()
+    start = time.time()
+    items = q.get_due(timeout=1)
+
+    assert [item[2] for item in items] == ['early']
+    assert time.time() - start < 1
+    assert q.qsize() == 1
+
+
+def test_timer_queue_batch_and_timeout():
+    """ Every due item is returned at once and an empty queue times out
+    """
+    q = TimerQueue()
+    now = time.time()
+    for i in range(3):
+        q.put((now - i, i))
+
+    assert [item[1] for item in q.get_due(timeout=0.1)] == [2, 1, 0]
+    assert q.get_due(timeout=0.1) == []
+
+
+def test_timer_queue_close_wakes_waiter():
+    """ Closing the queue ends a get_due that would otherwise wait forever
+    """
+    q = TimerQueue()
+    threading.Timer(0.05, q.close).start()
+    assert q.get_due(timeout=None) == []
@@ -0,0 +1,28 @@
+# standard lib
+from collections import namedtuple
+import datetime
+
+# local
+from fc.seen import SeenIndex
+
+
+Email = namedtuple('Email', ['id', 'dt', 'email'])
+
+
+def test_seen_index(tmpdir):
+    """ Pairs are found after being added and dropped once expired
+    """
+    with SeenIndex(str(tmpdir.join('seen.db'))) as seen_index:
+        seen_index.add([Email('1', '2016-01-01 00:00:00', 'a@b.com'),
+                        Email('2', '2016-01-05 00:00:00', 'c@d.com')])
+        # a later sighting extends how long a pair is kept
+        seen_index.add([Email('1', '2016-01-06 00:00:00', 'a@b.com')])
+
+        items = [Email('1', '2016-01-10 00:00:00', 'a@b.com'),
+                 Email('3', '2016-01-10 00:00:00', 'e@f.com')]
+        assert list(seen_index.filter_unseen(items)) == [items[1]]
+
+        seen_index.expire(datetime.datetime(2016, 1, 6, 0, 0, 0))
+        assert ('1', 'a@b.com') in seen_index
+        assert ('2', 'c@d.com') not in seen_index
+        assert len(seen_index) == 1
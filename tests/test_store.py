@@ -0,0 +1,55 @@
+# local
+from fc.store import (FileStore,
+                      SegmentReader,
+                      SegmentStore)
+
+
+def test_segment_store_round_trip(tmpdir):
+    """ Point lookups return the latest result for each compression and
+    full scans return everything in the order written
+    """
+    for compression in (None, 'gzip', 'lzma'):
+        out_dir = tmpdir.mkdir(str(compression))
+        store = SegmentStore(str(out_dir), compression)
+        store.put_many([('2016-01-01', 1, {'status': 202}),
+                        ('2016-01-01', 2, {'status': 404})])
+        # raw bytes are passed through as is
+        store.put('2016-01-01', 1, b'{"status":\n200}')
+        store.close()
+
+        reader = SegmentReader(str(out_dir))
+        assert reader.get('2016-01-01', 1) == {'status': 200}
+        assert reader.get('2016-01-01', 2) == {'status': 404}
+        assert reader.get('2016-01-01', 3) is None
+        assert [data['status'] for _, _, data in reader.scan()] == \
+            [202, 404, 200]
+
+
+def test_segment_store_two_writers(tmpdir):
+    """ Offsets stay correct with two stores appending to one segment
+    """
+    for compression in (None, 'gzip'):
+        out_dir = str(tmpdir.mkdir(str(compression)))
+        first = SegmentStore(out_dir, compression)
+        second = SegmentStore(out_dir, compression)
+        first.put('2016-01-01', 1, {'status': 200, 'n': 1})
+        second.put_many([('2016-01-01', 2, {'status': 200, 'n': 2}),
+                         ('2016-01-01', 3, {'status': 200, 'n': 3})])
+        first.put('2016-01-01', 4, {'status': 200, 'n': 4})
+        first.close()
+        second.close()
+
+        reader = SegmentReader(out_dir)
+        assert [reader.get('2016-01-01', i)['n'] for i in range(1, 5)] == \
+            [1, 2, 3, 4]
+
+
+def test_file_store_passthrough(tmpdir):
+    """ Raw bytes are written to the per id file untouched
+    """
+    store = FileStore(str(tmpdir))
+    store.put('2016-01-01', 1, b'{"status":200}')
+    store.put('2016-01-01', 2, {'status': 404})
+
+    assert tmpdir.join('2016-01-01_1.json').read() == '{"status":200}\n'
+    assert tmpdir.join('2016-01-01_2.json').read() == '{"status": 404}\n'
@@ -0,0 +1,42 @@
+# local
+from fc.person import PersonClient
+from fc.stub import StubPersonAPI, parse_latency
+
+
+def test_stub_sequences_and_rate_limit():
+    """ 202s then a final response, rate limit headers and a 403 once the
+    window is used up
+    """
+    stub = StubPersonAPI(rate_limit=4, period=60.0, pending_polls=1)
+    url = stub.serve()
+    try:
+        with PersonClient(url, api_key='key', pool_maxsize=2) as client:
+            r = client.query('email', 'a@b.com')
+            assert r.status_code == 202
+            assert r.headers['X-Rate-Limit-Limit'] == '4'
+            assert r.headers['X-Rate-Limit-Remaining'] == '3'
+            assert 'Date' in r.headers
+
+            r = client.query('email', 'a@b.com')
+            assert r.status_code == 200
+            assert r.json()['emailAddresses'] == [{'value': 'a@b.com'}]
+
+            assert client.query('email', 'c@d.com').status_code == 202
+            assert client.query('email', 'c@d.com').status_code == 200
+            # over the limit for the window
+            assert client.query('email', 'e@f.com').status_code == 403
+    finally:
+        stub.shutdown()
+
+    assert stub.stats()['status_counts'] == {200: 2, 202: 2, 403: 1}
+
+
+def test_stub_error_injection():
+    """ Injected 503s carry Retry-After """
+    stub = StubPersonAPI(rate_limit=100, error_503_rate=1.0, retry_after=2)
+    status, headers, _ = stub.respond('a@b.com', 'key')
+    assert status == 503 and headers['Retry-After'] == '2'
+    assert stub.respond('a@b.com', None)[0] == 403
+
+    sample = parse_latency('uniform:0.1:0.2')
+    assert 0.1 <= sample(stub.rng) <= 0.2
@@ -0,0 +1,47 @@
+# standard lib
+from concurrent.futures import ThreadPoolExecutor
+import io
+import time
+
+# local
+import fc.trace as trace
+from fc.retry import Attempt
+from fc.scheduler import TimerQueue, process_queue
+
+
+def test_trace_lifecycle_and_report(tmpdir):
+    """ Spans are recorded through dispatch, a 202 retry and the lookup,
+    and the report finds the dominant stage
+    """
+    path = str(tmpdir.join('trace.jsonl'))
+    trace.start_tracing(path)
+
+    def lookup(q, count, id_val, dt, email, attempts, client):
+        with trace.timed(count, 'http', len(attempts)):
+            time.sleep(0.05)
+        if not attempts:
+            # a 202, polled again shortly
+            q.put((time.time() + 0.02, count, id_val, dt, email,
+                   (Attempt(time.time(), 202),)))
+
+    q = TimerQueue()
+    now = time.time()
+    for i in range(4):
+        q.put((now, i, str(i), '2016-01-01', 'a@x.com', ()))
+        trace.span(i, 'scheduled', now - 0.01, now)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        process_queue(q, pool, lookup, timeout=0.3)
+    trace.stop_tracing()
+
+    spans = trace.read_spans(path)
+    assert sorted(spans) == [0, 1, 2, 3]
+    stages = {s[0] for s in spans[0]}
+    assert stages == {'scheduled', 'queue', 'pool', 'http', 'backoff'}
+    assert sum(s[0] == 'http' for s in spans[0]) == 2
+
+    out = io.StringIO()
+    summary = trace.report(path, out)
+    assert len(summary['latency']) == 4
+    assert summary['latency'][0] >= 0.1
+    assert 'p99' in out.getvalue()
+    assert 'dominant stage: http' in out.getvalue()
@@ -17,7 +17,7 @@ def test_unique_namedtuples():
     result = [Hungry(2, 'eat', 'apple'),
               Hungry(3, 'prep', 'carrot')]
 
-    assert(unique_namedtuples(items, ('id', 'action')), result)
+    assert unique_namedtuples(items, ('id', 'action')) == result
 
 
 def test_compare_namedtuples():
@@ -33,5 +33,8 @@ def test_compare_namedtuples():
                      Hungry(4, 'prep', 'fennel')]
     result = [Hungry(3, 'prep', 'carrot')]
 
-    assert(compare_namedtuples(items_base, items_compare,
-                               ('id', 'action')), result)
+    assert compare_namedtuples(items_base, items_compare,
+                               ('id', 'action')) == result
+    # any iterator, as with dedupe.anti_join
+    assert compare_namedtuples(iter(items_base), iter(items_compare),
+                               ('id', 'action')) == result
@@ -0,0 +1,59 @@
+# third party
+import pytest
+
+# local
+from fc.writer import BatchWriter
+
+
+class ListStore(object):
+    """ Store that records each batch it is handed """
+    def __init__(self):
+        self.batches = []
+        self.closed = False
+
+    def put_many(self, records, fsync=False):
+        self.batches.append(list(records))
+
+    def close(self):
+        self.closed = True
+
+
+def test_batch_writer_drains_on_close():
+    """ Every queued result is written, in batches, before close returns
+    """
+    store = ListStore()
+    writer = BatchWriter(store, maxsize=10, batch_size=4, flush_interval=5.0)
+    for i in range(10):
+        writer.put('2016-01-01', i, {'i': i})
+    writer.close()
+
+    written = [id_val for batch in store.batches for _, id_val, _ in batch]
+    assert written == list(range(10))
+    assert all(len(batch) <= 4 for batch in store.batches)
+    assert store.closed
+
+
+class FailingStore(ListStore):
+    """ Store whose writes always fail """
+    def put_many(self, records, fsync=False):
+        raise OSError('disk full')
+
+
+def test_batch_writer_callbacks_wait_for_the_write():
+    """ Callbacks run after the results before them are written and never
+    for a batch that could not be written
+    """
+    store = ListStore()
+    writer = BatchWriter(store, batch_size=4, flush_interval=5.0)
+    done = []
+    writer.put('2016-01-01', 0, {'i': 0})
+    writer.after_written(lambda: done.append(len(store.batches)))
+    writer.close()
+    assert done == [1]
+
+    writer = BatchWriter(FailingStore(), retries=0)
+    writer.put('2016-01-01', 0, {'i': 0})
+    writer.after_written(done.append, 'written')
+    with pytest.raises(IOError):
+        writer.close()
+    assert done == [1]